@@ -0,0 +1,207 @@
+#   The image that the pieces get pasted into when they're joined.
+#
+#   Normally that's just an Image in memory.  But a long scroll can join
+#   up to 30000 x 400000 pixels, which is 36 GB of RGB--no way that fits.
+#   So a canvas can be kept on disk instead: a raw RGB file.  The pieces
+#   are written into it a band of rows at a time, each band through its
+#   own memory map (numpy.memmap) that's flushed and let go of right away,
+#   so only one band's worth of pages is ever mapped.  It's saved a strip
+#   at a time too (see strip_writer.py, which is also why it has to be
+#   saved as a TIFF, PNG or PPM), so the whole image is never in memory at
+#   once.
+#
+#   (Pieces that just go one under the other don't need a canvas at all:
+#   they can be written straight to the file--see strip_writer.write_image().)
+#
+#   These functions take either kind of canvas (the way
+#   edge_strips.load_band() takes a filename or an Image), so the joining
+#   code doesn't care which one it has:
+#
+#       new_image = canvas.new_canvas(width, height, on_disk)
+#       canvas.paste_image(new_image, piece, (x, y))
+#       canvas.save_canvas(new_image, 'assembled_0.tif')
+#       canvas.close_canvas(new_image)
+#
+#   The raw file is made next to the output and removed when the canvas
+#   is closed (or when the program exits, if it never was).
+#
+
+import atexit
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+import strip_writer
+
+
+####################
+#   constants
+####################
+
+# How many rows of a piece are copied into the canvas at a time
+BAND_ROWS = 256
+
+# The end of the raw files' names
+RAW_SUFFIX = '.canvas.raw'
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+# The raw files of the canvases that haven't been closed yet
+open_raw_files = set()
+
+
+####################
+#   Returns True if this is a canvas on disk (rather than an Image).
+#
+def is_disk_canvas(target):
+    return isinstance(target, dict)
+
+
+####################
+#   Makes a new (black) canvas.
+#
+#   params
+#       width, height   Size of the canvas.
+#
+#       on_disk         True for a memory-mapped canvas on disk, False for
+#                       a regular Image.
+#
+#       directory       Where to put the raw file (the output's directory
+#                       is a good bet--it'll need the room anyway).
+#
+#   returns
+#       An RGB Image, or a canvas on disk (a dictionary):
+#           'width', 'height'
+#           'raw_name'  The raw file, (height, width, 3) bytes of RGB.
+#
+def new_canvas(width, height, on_disk = False, directory = '.'):
+    if not on_disk:
+        return Image.new('RGB', (width, height))
+
+    handle, raw_name = tempfile.mkstemp(suffix = RAW_SUFFIX, dir = directory)
+    open_raw_files.add(raw_name)
+
+    # (all zeros--black--and it takes no room until something is written)
+    os.ftruncate(handle, width * height * 3)
+    os.close(handle)
+
+    if debug:
+        print(f'new_canvas() {width} x {height} on disk in {raw_name}')
+
+    return {
+        'width': width,
+        'height': height,
+        'raw_name': raw_name,
+    }
+
+
+####################
+#   Pastes an image into a canvas, just like Image.paste() (parts that
+#   fall outside the canvas are cut off).
+#
+#   params
+#       position        (x, y) of the image's top left corner.  A box
+#                       (left, upper, right, lower) is fine too (the right
+#                       and lower are ignored).
+#
+def paste_image(target, image, position):
+    if not is_disk_canvas(target):
+        target.paste(image, position)
+        return
+
+    x = position[0]
+    y = position[1]
+
+    # the part of the canvas that gets covered
+    left = max(0, x)
+    top = max(0, y)
+    right = min(target['width'], x + image.width)
+    bottom = min(target['height'], y + image.height)
+    if (right <= left) or (bottom <= top):
+        return
+
+    row_bytes = target['width'] * 3
+    for band_top in range(top, bottom, BAND_ROWS):
+        band_bottom = min(bottom, band_top + BAND_ROWS)
+        band = image.crop((left - x, band_top - y, right - x, band_bottom - y))
+        if band.mode != 'RGB':
+            band = band.convert('RGB')
+
+        # map just these rows of the canvas
+        pixels = np.memmap(target['raw_name'], dtype = np.uint8, mode = 'r+', offset = band_top * row_bytes,
+                           shape = (band_bottom - band_top, target['width'], 3))
+        pixels[:, left:right] = np.asarray(band)
+        pixels.flush()
+        del pixels
+
+
+####################
+#   Saves a canvas.  A canvas on disk is saved a strip at a time, so it
+#   has to go to a format strip_writer.py knows (TIFF, PNG or PPM).
+#
+#   returns
+#       True if it was saved.
+#
+def save_canvas(target, filename):
+    if not is_disk_canvas(target):
+        try:
+            target.save(filename)
+        except (OSError, ValueError, KeyError):
+            if debug:
+                print(f'save_canvas() unable to save {filename}')
+            return False
+        return True
+
+    writer = strip_writer.open_writer(filename, target['width'], target['height'])
+    if writer == None:
+        return False
+
+    width = target['width']
+    with open(target['raw_name'], 'rb') as raw_file:
+        for top in range(0, target['height'], BAND_ROWS):
+            rows = min(BAND_ROWS, target['height'] - top)
+            data = raw_file.read(rows * width * 3)
+            strip_writer.write_rows(writer, np.frombuffer(data, dtype = np.uint8).reshape(rows, width, 3))
+    strip_writer.close_writer(writer)
+
+    return True
+
+
+####################
+#   Lets go of a canvas (and removes its raw file).
+#
+def close_canvas(target):
+    if not is_disk_canvas(target):
+        target.close()
+        return
+
+    remove_raw_file(target['raw_name'])
+
+
+####################
+#   Removes a raw file (if it's still there).
+#
+def remove_raw_file(raw_name):
+    open_raw_files.discard(raw_name)
+    try:
+        os.remove(raw_name)
+    except OSError:
+        pass
+
+
+####################
+#   Removes the raw files of any canvases that were never closed.
+#
+def remove_raw_files():
+    for raw_name in list(open_raw_files):
+        remove_raw_file(raw_name)
+
+# just in case something goes wrong before they're closed
+atexit.register(remove_raw_files)
@@ -0,0 +1,8 @@
+#   pytest setup.  The tests are in tests/ and import the modules up here
+#   directly (this directory is put on sys.path because this file is in it).
+#
+#   crop_test.py is an old script, not a test--it runs as soon as it's
+#   imported--so it's left out.
+#
+
+collect_ignore = ['crop_test.py']
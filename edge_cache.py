@@ -0,0 +1,467 @@
+#   Keeps the edges (signatures) of pieces around so that they only
+#   have to be decoded once.
+#
+#   A signature is a dictionary with the edges of a piece plus its size
+#   and mode:
+#
+#       'top'       Top row, array of shape (width, channels).
+#       'bottom'    Bottom row, (width, channels).
+#       'left'      Left column, (height, channels).
+#       'right'     Right column, (height, channels).
+#       'width', 'height', 'mode'
+#       'orientation'   The EXIF orientation (1 is normal).
+#
+#   Not every signature has all four edges.  Joining one under the other
+#   only needs the top and bottom, and those can usually be read without
+#   decoding the whole piece (see edge_strips.py).  The left and right
+#   columns need the whole piece, so asking for either one gets all four.
+#
+#   Signatures are kept in memory (least recently used ones are thrown
+#   out once there are too many).  They can also be saved to a sidecar
+#   file in the pieces' directory so that the next run over the same
+#   directory doesn't have to decode anything at all.  The sidecar is
+#   keyed by filename, modification time and size, so changed files are
+#   decoded again.
+#
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+import image_cache
+from image_cache import get_file_key
+from edge_strips import image_to_array, get_image_orientation, get_edge_box, load_band
+
+
+####################
+#   constants
+####################
+
+# Name of the sidecar file (it lives in the same directory as the pieces)
+SIDECAR_NAME = '.edge_signatures.npz'
+
+# The four edges kept in a signature
+SIGNATURE_EDGES = ('top', 'bottom', 'left', 'right')
+
+# The edges that meet when pieces go one under the other, and side by side
+VERTICAL_EDGES = ('top', 'bottom')
+HORIZONTAL_EDGES = ('left', 'right')
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+# Most signatures to keep in memory at once
+max_signatures = 4096
+
+# The in-memory cache.  Keys are from get_file_key().
+signature_cache = OrderedDict()
+
+# The signatures read from the sidecar (an NpzFile, which only reads
+# arrays when asked) and a lookup from filename to its entry number.
+sidecar_file = None
+sidecar_entries = {}
+
+# The names of the arrays in the sidecar (which edges it has for which
+# entries)
+sidecar_arrays = set()
+
+# The sizes and modes of all the sidecar entries (read up front--these
+# are needed for every lookup)
+sidecar_dims = None
+sidecar_modes = None
+sidecar_orientations = None
+
+# Signatures that were decoded this run (and need to go in the sidecar)
+new_signatures = {}
+
+# Number of images actually decoded.  With a good sidecar this stays 0.
+num_decodes = 0
+
+
+####################
+#   Returns the edges a signature needs for pieces joined one under the
+#   other (VERTICAL_EDGES) or side by side (HORIZONTAL_EDGES).
+#
+def get_signature_edges(horizontal):
+    if horizontal:
+        return HORIZONTAL_EDGES
+    return VERTICAL_EDGES
+
+
+####################
+#   Returns True if a signature has all the given edges.
+#
+def has_edges(signature, edges):
+    for edge in edges:
+        if edge not in signature:
+            return False
+    return True
+
+
+####################
+#   Builds a signature with just the top and/or bottom rows of an image,
+#   decoding as little of it as it can (see edge_strips.load_band()).
+#
+#   returns
+#       The signature dictionary, or None if this isn't an image file.
+#
+def decode_row_edges(filename, edges):
+    with Image.open(filename) as image:
+        width, height = image.size
+        mode = image.mode
+        orientation = get_image_orientation(image)
+
+    signature = {
+        'width': width,
+        'height': height,
+        'mode': mode,
+        'orientation': orientation,
+    }
+    for edge in edges:
+        band = load_band(filename, get_edge_box(width, height, edge))
+        if band is None:
+            return
+        signature[edge] = band[0]
+
+    return signature
+
+
+####################
+#   Decodes a whole image and builds its signature (with all four edges).
+#   The image comes from (and stays in) the image cache, since the pieces
+#   that match get pasted soon after.
+#
+#   returns
+#       The signature dictionary, or None if this isn't an image file.
+#
+def decode_all_edges(filename):
+    image = image_cache.get_image(filename)
+    orientation = get_image_orientation(image)
+    pixels = image_to_array(image)
+
+    # copies, so that the full image can be freed
+    return {
+        'top': pixels[0].copy(),
+        'bottom': pixels[-1].copy(),
+        'left': pixels[:, 0].copy(),
+        'right': pixels[:, -1].copy(),
+        'width': pixels.shape[1],
+        'height': pixels.shape[0],
+        'mode': image.mode,
+        'orientation': orientation,
+    }
+
+
+####################
+#   Decodes the edges of an image and builds its signature.
+#
+#   params
+#       edges           The edges wanted (see the top of this file).
+#
+#       count           When False, num_decodes is left alone (for callers
+#                       in other threads, which count them themselves).
+#
+#   returns
+#       The signature dictionary, or None if this isn't an image file.
+#
+def decode_edge_signature(filename, edges = SIGNATURE_EDGES, count = True):
+    global num_decodes
+
+    try:
+        if set(edges) <= set(VERTICAL_EDGES):
+            signature = decode_row_edges(filename, edges)
+        else:
+            signature = decode_all_edges(filename)
+    except:
+        signature = None
+
+    if signature == None:
+        if debug:
+            print(f'decode_edge_signature() {filename} is not an image file')
+        return
+
+    if count:
+        num_decodes += 1
+
+    return signature
+
+
+####################
+#   Looks for a signature in the sidecar.
+#
+#   params
+#       edges       The edges it has to have.  None for whichever ones
+#                   the sidecar has.
+#
+#   returns
+#       The signature if the sidecar has one for this exact file (same
+#       modification time and size), None otherwise.
+#
+def find_sidecar_signature(key, edges = SIGNATURE_EDGES):
+    if sidecar_file == None:
+        return
+
+    path, mtime, size = key
+    entry = sidecar_entries.get(path)
+    if entry == None:
+        return
+
+    index, entry_mtime, entry_size = entry
+    if (entry_mtime != mtime) or (entry_size != size):
+        return
+
+    signature = {}
+    for edge in SIGNATURE_EDGES:
+        name = f'{index}_{edge}'
+        if name in sidecar_arrays:
+            signature[edge] = sidecar_file[name]
+        elif (edges != None) and (edge in edges):
+            return
+    signature['width'] = int(sidecar_dims[index][0])
+    signature['height'] = int(sidecar_dims[index][1])
+    signature['mode'] = str(sidecar_modes[index])
+    signature['orientation'] = int(sidecar_orientations[index])
+    return signature
+
+
+####################
+#   Returns the signature for the given file only if it's already in
+#   memory or in the sidecar (never decodes anything).
+#
+#   returns
+#       The signature dictionary, or None if it'd have to be decoded.
+#
+def find_cached_signature(filename, edges = SIGNATURE_EDGES):
+    key = get_file_key(filename)
+    if key == None:
+        return
+
+    signature = signature_cache.get(key)
+    if (signature != None) and has_edges(signature, edges):
+        return signature
+
+    return find_sidecar_signature(key, edges)
+
+
+####################
+#   Finds the signature for a file in the sidecar or decodes it, without
+#   touching the in-memory cache (or num_decodes).  So this is safe to
+#   call from several threads at once.  Decoded signatures can be handed
+#   to add_new_signatures() afterwards.
+#
+#   params
+#       edges       The edges wanted (see the top of this file).
+#
+#   returns
+#       (key, signature, decoded)
+#           decoded is True if it wasn't in the sidecar.  signature is
+#           None if the file isn't an image.
+#       None if the file can't be stat'ed.
+#
+def load_edge_signature(filename, edges = SIGNATURE_EDGES):
+    key = get_file_key(filename)
+    if key == None:
+        return
+
+    signature = find_sidecar_signature(key, edges)
+    if signature != None:
+        return (key, signature, False)
+
+    return (key, decode_edge_signature(filename, edges, count = False), True)
+
+
+####################
+#   Returns the signature for the given file, decoding it only if it
+#   isn't already in memory or in the sidecar.
+#
+#   params
+#       edges       The edges wanted (see the top of this file).
+#
+#   returns
+#       The signature dictionary (see top of file).
+#       None if the file isn't an image.
+#
+def get_edge_signature(filename, edges = SIGNATURE_EDGES):
+    key = get_file_key(filename)
+    if key == None:
+        return
+
+    if key in signature_cache:
+        signature_cache.move_to_end(key)
+        signature = signature_cache[key]
+        if (signature == None) or has_edges(signature, edges):
+            return signature
+
+    signature = find_sidecar_signature(key, edges)
+    if signature == None:
+        signature = decode_edge_signature(filename, edges)
+        if signature != None:
+            new_signatures[key] = signature
+
+    # Remember the non-images too (as None) so they aren't tried again.
+    signature_cache[key] = signature
+    if len(signature_cache) > max_signatures:
+        signature_cache.popitem(last = False)
+
+    return signature
+
+
+####################
+#   Returns the two edges that meet when the first piece goes above (or
+#   to the left of, when horizontal) the second.
+#
+#   returns
+#       (edge1, edge2)
+#       None if either signature is missing or they don't line up
+#       (different widths, or different heights when horizontal).
+#
+def get_seam_edges(first_signature, second_signature, horizontal = False):
+    if (first_signature == None) or (second_signature == None):
+        return
+
+    if horizontal:
+        if first_signature['height'] != second_signature['height']:
+            if debug:
+                print('get_seam_edges() Error!  Not same height!')
+            return
+        return (first_signature['right'], second_signature['left'])
+
+    if first_signature['width'] != second_signature['width']:
+        if debug:
+            print('get_seam_edges() Error!  Not same width!')
+        return
+    return (first_signature['bottom'], second_signature['top'])
+
+
+####################
+#   Adds signatures that were decoded somewhere else (by a worker process,
+#   say) as if they'd been decoded here, so they end up in the sidecar.
+#
+#   params
+#       signatures      Dictionary: key (from get_file_key()) -> signature.
+#
+def add_new_signatures(signatures):
+    global num_decodes
+
+    num_decodes += len(signatures)
+    for key in signatures:
+        new_signatures[key] = signatures[key]
+        signature_cache[key] = signatures[key]
+        signature_cache.move_to_end(key)
+        if len(signature_cache) > max_signatures:
+            signature_cache.popitem(last = False)
+
+
+####################
+#   Reads the sidecar from the given directory (if there is one).
+#
+def load_sidecar(directory = '.'):
+    global sidecar_file
+    global sidecar_entries
+    global sidecar_arrays
+    global sidecar_dims
+    global sidecar_modes
+    global sidecar_orientations
+
+    sidecar_name = os.path.join(directory, SIDECAR_NAME)
+    if not os.path.isfile(sidecar_name):
+        if debug:
+            print(f'load_sidecar() no sidecar in {directory}')
+        return
+
+    try:
+        sidecar_file = np.load(sidecar_name, allow_pickle = False)
+        sidecar_arrays = set(sidecar_file.files)
+        names = sidecar_file['names']
+        mtimes = sidecar_file['mtimes']
+        sizes = sidecar_file['sizes']
+        sidecar_dims = sidecar_file['dims']
+        sidecar_modes = sidecar_file['modes']
+        sidecar_orientations = sidecar_file['orientations']
+
+    except Exception as e:
+        print(f'Unable to read {sidecar_name} ({e}), ignoring it.')
+        sidecar_file = None
+        return
+
+    sidecar_entries = {}
+    for i in range(len(names)):
+        path = os.path.abspath(os.path.join(directory, str(names[i])))
+        sidecar_entries[path] = (i, int(mtimes[i]), int(sizes[i]))
+
+    if debug:
+        print(f'load_sidecar() read {len(sidecar_entries)} signatures from {sidecar_name}')
+
+
+####################
+#   Writes the sidecar for the given directory.  It'll have everything
+#   that was in the old sidecar (for files that haven't changed) plus
+#   all the signatures decoded this run for files in that directory.
+#
+def save_sidecar(directory = '.'):
+    directory = os.path.abspath(directory)
+
+    # figure out what goes in: path -> (key, signature)
+    entries = {}
+    for path in sidecar_entries:
+        key = get_file_key(path)
+        if key == None:
+            continue        # file is gone
+        signature = find_sidecar_signature(key, None)
+        if signature != None:
+            entries[path] = (key, signature)
+
+    for key in new_signatures:
+        if os.path.dirname(key[0]) == directory:
+            # keep the edges the old sidecar had that weren't decoded again
+            signature = new_signatures[key]
+            if (key[0] in entries) and (entries[key[0]][0] == key):
+                signature = dict(entries[key[0]][1], **signature)
+            entries[key[0]] = (key, signature)
+
+    if len(new_signatures) == 0 and len(entries) == len(sidecar_entries):
+        if debug:
+            print('save_sidecar() nothing new, not writing')
+        return
+
+    arrays = {}
+    names = []
+    mtimes = []
+    sizes = []
+    dims = []
+    modes = []
+    orientations = []
+    for path in sorted(entries):
+        key, signature = entries[path]
+        index = len(names)
+        names.append(os.path.basename(path))
+        mtimes.append(key[1])
+        sizes.append(key[2])
+        dims.append((signature['width'], signature['height']))
+        modes.append(signature['mode'])
+        orientations.append(signature['orientation'])
+        for edge in SIGNATURE_EDGES:
+            if edge in signature:
+                arrays[f'{index}_{edge}'] = signature[edge]
+
+    arrays['names'] = np.array(names, dtype = str)
+    arrays['mtimes'] = np.array(mtimes, dtype = np.int64)
+    arrays['sizes'] = np.array(sizes, dtype = np.int64)
+    arrays['dims'] = np.array(dims, dtype = np.int64).reshape(-1, 2)
+    arrays['modes'] = np.array(modes, dtype = str)
+    arrays['orientations'] = np.array(orientations, dtype = np.int64)
+
+    # write to a temp file first so a crash can't leave half a sidecar
+    sidecar_name = os.path.join(directory, SIDECAR_NAME)
+    tmp_name = sidecar_name + '.tmp.npz'
+    np.savez(tmp_name, **arrays)
+    os.replace(tmp_name, sidecar_name)
+
+    if debug:
+        print(f'save_sidecar() wrote {len(names)} signatures to {sidecar_name}')
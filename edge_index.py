@@ -0,0 +1,423 @@
+#   Finds which pieces might go together without comparing every piece
+#   with every other one.  For really big piles of pieces (100k+ with no
+#   useful file order) even the cost matrix in piece_order.py is too much:
+#   it grows with the square of the number of pieces.
+#
+#   Each edge gets a small descriptor: the edge shrunk down to a handful
+#   of pixels (each the average of a stretch of the edge) and rounded off.
+#   Edges that match have descriptors that are close together (averaging
+#   can only make two edges look more alike, never less), so:
+#
+#       1.  The top edge descriptors go into a locality sensitive hash
+#           (LSH): several tables, each keyed by a few random projections
+#           of the descriptor chopped into buckets.  Close descriptors
+#           usually land in the same bucket in at least one table.
+#
+#       2.  Each bottom edge looks up its buckets, keeps the few nearest
+#           descriptors it finds there, and only those get the real
+#           comparison (compare_row_to_many()).
+#
+#   So the work grows about linearly with the number of pieces.  The
+#   catch is that it's approximate--a match whose descriptors are unlucky
+#   enough to never share a bucket is missed.
+#
+#   Flat edges (blank margins and the like) are kept out of the hash
+#   tables.  They'd all land in the same bucket, so every one of them
+#   would be a candidate for every other.  Instead they're bucketed by
+#   their average color (buckets as wide as the tolerance, since edges
+#   that match can't have averages further apart than that), and kept in
+#   order of brightness within a bucket.  A flat edge only looks at the
+#   few edges nearest its own brightness in its bucket and the ones next
+#   to it, so it still gets a handful of candidates, not thousands.
+#
+
+import itertools
+import math
+
+import numpy as np
+
+from image_comparator import TOLERANCE, HUE_MASK
+from image_comparator import get_compare_channels, compare_row_to_many
+import piece_order
+
+
+####################
+#   constants
+####################
+
+# How many averaged pixels a descriptor has (per color plane)
+DESCRIPTOR_LENGTH = 32
+
+# Descriptors are rounded off to multiples of this (so they fit in a byte)
+DESCRIPTOR_STEP = 4
+
+# Number of hash tables, and the number of projections each is keyed by.
+# More tables find more of the real matches, more projections per table
+# make each table's buckets pickier.
+LSH_TABLES = 16
+LSH_HASHES = 8
+
+# How wide the buckets are, as a multiple of the descriptor distance that
+# a seam right at the tolerance could have.
+LSH_WIDTH_FACTOR = 4.0
+
+# The most candidates (the nearest descriptors) each bottom edge gets
+# compared with for real
+NUM_CANDIDATES = 16
+
+# Seed for the random projections, so that runs are repeatable
+INDEX_SEED = 0
+
+# Edges whose pixels vary less than this (the variances of the color
+# planes added up) are flat and go in the flat buckets instead of the
+# hash tables
+FLAT_EDGE_VARIANCE = 16.0
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+
+####################
+#   Makes the descriptor for an edge: DESCRIPTOR_LENGTH averages of equal
+#   stretches of the edge (for each color plane that compare_type uses),
+#   rounded off to DESCRIPTOR_STEP.
+#
+#   params
+#       edge            (width, channels) array.
+#
+#       compare_type    Which color planes to use.
+#
+#   returns
+#       Array (DESCRIPTOR_LENGTH * planes) of uint8.
+#
+def make_descriptor(edge, compare_type = HUE_MASK):
+    width = len(edge)
+    pixels = edge[:, get_compare_channels(compare_type)].astype(np.float64)
+
+    # Where each stretch starts.  Edges narrower than DESCRIPTOR_LENGTH
+    # just repeat pixels (reduceat() gives the single pixel when a start
+    # isn't before the next one).
+    starts = np.arange(DESCRIPTOR_LENGTH) * width // DESCRIPTOR_LENGTH
+    counts = np.maximum(np.diff(np.append(starts, width)), 1)
+
+    averages = np.add.reduceat(pixels, starts, axis = 0) / counts[:, np.newaxis]
+    return np.clip(np.rint(averages / DESCRIPTOR_STEP), 0, 255).astype(np.uint8).ravel()
+
+
+####################
+#   Tells whether an edge is too flat to be worth indexing (see
+#   FLAT_EDGE_VARIANCE).
+#
+#   params
+#       edge            (width, channels) array.
+#
+#       compare_type    Which color planes to look at.
+#
+#   returns
+#       True if the edge is flat.
+#
+def is_flat_edge(edge, compare_type = HUE_MASK):
+    pixels = edge[:, get_compare_channels(compare_type)].astype(np.float64)
+    return float(np.sum(np.var(pixels, axis = 0))) < FLAT_EDGE_VARIANCE
+
+
+####################
+#   Works out which flat bucket an edge goes in: its shape and its average
+#   color, chopped into steps as wide as the tolerance.
+#
+#   returns
+#       (key, brightness)
+#           key         Tuple: the edge's shape, then the step of each
+#                       color plane's average.
+#           brightness  The average of all of them (for ordering the
+#                       edges within a bucket).
+#
+def get_flat_key(edge, compare_type, tolerance):
+    averages = np.mean(edge[:, get_compare_channels(compare_type)], axis = 0, dtype = np.float64)
+    steps = np.floor(averages / tolerance).astype(np.int64)
+    return (edge.shape + tuple(steps.tolist()), float(np.mean(averages)))
+
+
+####################
+#   Makes the random projections for the hash tables.
+#
+#   returns
+#       (projections, shifts, bucket_width)
+#           projections     Array (LSH_TABLES, LSH_HASHES, size).
+#           shifts          Array (LSH_TABLES, LSH_HASHES), in [0, bucket_width).
+#           bucket_width    In descriptor units.
+#
+def make_projections(size, tolerance = TOLERANCE):
+    rng = np.random.default_rng(INDEX_SEED)
+
+    # A seam right at the tolerance has descriptors about this far apart
+    # (the average difference spread over every entry).
+    bucket_width = LSH_WIDTH_FACTOR * tolerance * math.sqrt(size) / DESCRIPTOR_STEP
+
+    projections = rng.standard_normal((LSH_TABLES, LSH_HASHES, size))
+    shifts = rng.uniform(0.0, bucket_width, (LSH_TABLES, LSH_HASHES))
+    return (projections, shifts, bucket_width)
+
+
+####################
+#   Works out the bucket each descriptor falls into, for every table.
+#   The LSH_HASHES bucket numbers of a table are rolled into one key, along
+#   with the edge's shape (only edges of the same size can match).
+#
+#   returns
+#       Array (n, LSH_TABLES) of int64 keys.
+#
+def get_bucket_keys(descriptors, shapes, index):
+    projections, shifts, bucket_width = index['projections']
+
+    # (n, tables, hashes)
+    buckets = np.floor((np.einsum('ths,ns->nth', projections, descriptors.astype(np.float64)) + shifts)
+                       / bucket_width).astype(np.int64)
+
+    # Roll them together (wrapping around is fine--a collision only means
+    # an extra candidate to check).
+    multipliers = index['multipliers']
+    keys = np.sum(buckets * multipliers, axis = 2)
+    keys += shapes[:, 0:1] * 1000003 + shapes[:, 1:2]
+    return keys
+
+
+####################
+#   Builds the index over a list of edges (the top edges of all the
+#   pieces).
+#
+#   params
+#       edges           List of (width, channels) arrays, None for pieces
+#                       that aren't images.  Flat edges (see
+#                       is_flat_edge()) go in the flat buckets instead of
+#                       the tables.
+#
+#       compare_type    Which color planes to use.
+#
+#       tolerance       What counts as a match.
+#
+#   returns
+#       The index, a dictionary:
+#           'edges'         The edges given.
+#           'descriptors'   Array (n, size) of descriptors (zeros for None).
+#           'shapes'        Array (n, 2) of each edge's shape ((0, 0) for None).
+#           'tables'        List of (sorted keys, edge numbers) per table.
+#           'flat_buckets'  Dictionary: flat key (see get_flat_key()) ->
+#                           (sorted brightnesses, edge numbers).
+#           plus what's needed to hash more edges the same way.
+#
+def build_edge_index(edges, compare_type = HUE_MASK, tolerance = TOLERANCE):
+    size = DESCRIPTOR_LENGTH * len(get_compare_channels(compare_type))
+    count = len(edges)
+
+    descriptors = np.zeros((count, size), dtype = np.uint8)
+    shapes = np.zeros((count, 2), dtype = np.int64)
+    present = np.zeros(count, dtype = bool)
+    flat_edges = {}
+    for i in range(count):
+        if edges[i] is not None:
+            descriptors[i] = make_descriptor(edges[i], compare_type)
+            shapes[i] = edges[i].shape
+            if is_flat_edge(edges[i], compare_type):
+                key, brightness = get_flat_key(edges[i], compare_type, tolerance)
+                flat_edges.setdefault(key, []).append((brightness, i))
+            else:
+                present[i] = True
+
+    rng = np.random.default_rng(INDEX_SEED + 1)
+    index = {
+        'edges': edges,
+        'descriptors': descriptors,
+        'shapes': shapes,
+        'compare_type': compare_type,
+        'tolerance': tolerance,
+        'projections': make_projections(size, tolerance),
+        'multipliers': rng.integers(1, 1 << 40, LSH_HASHES) | 1,
+    }
+
+    numbers = np.nonzero(present)[0]
+    keys = get_bucket_keys(descriptors[numbers], shapes[numbers], index)
+    tables = []
+    for table in range(LSH_TABLES):
+        order = np.argsort(keys[:, table], kind = 'stable')
+        tables.append((keys[order, table], numbers[order]))
+    index['tables'] = tables
+
+    flat_buckets = {}
+    for key, entries in flat_edges.items():
+        entries.sort()
+        flat_buckets[key] = (np.array([brightness for brightness, i in entries]),
+                             np.array([i for brightness, i in entries], dtype = np.int64))
+    index['flat_buckets'] = flat_buckets
+
+    if debug:
+        num_flat = sum(len(numbers) for brightnesses, numbers in flat_buckets.values())
+        print(f'build_edge_index() indexed {len(numbers)} edges and {num_flat} flat ones '
+              f'({len(flat_buckets)} buckets), {size} entries per descriptor')
+
+    return index
+
+
+####################
+#   Finds the edges in the index that might match the given edge: the
+#   ones that share a bucket with it in any table, nearest descriptors
+#   first.
+#
+#   params
+#       index           From build_edge_index().
+#
+#       edge            (width, channels) array.
+#
+#       num_candidates  The most to return.
+#
+#       exclude         An edge number to leave out (the piece itself).
+#
+#   returns
+#       Array of edge numbers, nearest first.  A flat edge only gets flat
+#       ones (see find_flat_candidates()).
+#
+def find_candidates(index, edge, num_candidates = NUM_CANDIDATES, exclude = -1):
+    descriptor = make_descriptor(edge, index['compare_type'])
+    if is_flat_edge(edge, index['compare_type']):
+        candidates = find_flat_candidates(index, edge, num_candidates, exclude)
+        return keep_nearest(index, candidates, descriptor, num_candidates)
+
+    shape = np.array([edge.shape], dtype = np.int64)
+    keys = get_bucket_keys(descriptor[np.newaxis], shape, index)[0]
+
+    found = []
+    for table in range(LSH_TABLES):
+        sorted_keys, numbers = index['tables'][table]
+        low = np.searchsorted(sorted_keys, keys[table], side = 'left')
+        high = np.searchsorted(sorted_keys, keys[table], side = 'right')
+        found.append(numbers[low:high])
+
+    candidates = np.unique(np.concatenate(found))
+
+    # the keys can collide, so make sure the sizes really match
+    candidates = candidates[np.all(index['shapes'][candidates] == shape, axis = 1) & (candidates != exclude)]
+    return keep_nearest(index, candidates, descriptor, num_candidates)
+
+
+####################
+#   Finds the flat edges that might match a flat edge: the ones in its
+#   flat bucket and the buckets next to it (every color plane's average
+#   one step either way), and of those only the num_candidates on either
+#   side of its brightness in each.  So a pile of blank pieces doesn't
+#   make every one of them a candidate for every other.
+#
+#   returns
+#       Array of edge numbers (in no particular order).
+#
+def find_flat_candidates(index, edge, num_candidates = NUM_CANDIDATES, exclude = -1):
+    key, brightness = get_flat_key(edge, index['compare_type'], index['tolerance'])
+    shape, steps = key[:2], key[2:]
+
+    found = [np.zeros(0, dtype = np.int64)]
+    for nudges in itertools.product((-1, 0, 1), repeat = len(steps)):
+        bucket = index['flat_buckets'].get(shape + tuple(step + nudge for step, nudge in zip(steps, nudges)))
+        if bucket == None:
+            continue
+
+        # (one extra on each side, in case one of them is the edge itself)
+        brightnesses, numbers = bucket
+        middle = np.searchsorted(brightnesses, brightness)
+        found.append(numbers[max(middle - num_candidates - 1, 0):middle + num_candidates + 1])
+
+    candidates = np.concatenate(found)
+    return candidates[candidates != exclude]
+
+
+####################
+#   Keeps the num_candidates edges whose descriptors are nearest the given
+#   one.
+#
+#   returns
+#       Array of edge numbers, nearest first (when there were too many).
+#
+def keep_nearest(index, candidates, descriptor, num_candidates):
+    if len(candidates) > num_candidates:
+        diff = index['descriptors'][candidates].astype(np.int64) - descriptor.astype(np.int64)
+        nearest = np.argsort(np.sum(diff * diff, axis = 1), kind = 'stable')[:num_candidates]
+        candidates = candidates[nearest]
+
+    return candidates
+
+
+####################
+#   Finds the links (which piece can go under which) using the index: each
+#   bottom edge is only compared for real with its candidate top edges.
+#
+#   params
+#       bottoms, tops   Lists of the bottom and top edges of each piece
+#                       ((width, channels) arrays, None for non-images).
+#
+#       compare_type, max_shift, tolerance
+#
+#       num_candidates  How many candidates each bottom edge gets compared with.
+#
+#   returns
+#       (rows, columns, costs)  Arrays: piece columns[k] can go under piece
+#                               rows[k] with a distance of costs[k] (under
+#                               the tolerance).
+#
+def find_piece_links(bottoms, tops, compare_type = HUE_MASK, max_shift = 0, tolerance = TOLERANCE,
+                     num_candidates = NUM_CANDIDATES):
+    index = build_edge_index(tops, compare_type, tolerance)
+
+    rows = []
+    columns = []
+    costs = []
+    checked = 0
+    for i in range(len(bottoms)):
+        if bottoms[i] is None:
+            continue
+
+        candidates = find_candidates(index, bottoms[i], num_candidates, exclude = i)
+        if len(candidates) == 0:
+            continue
+        checked += len(candidates)
+
+        stack = np.stack([tops[j] for j in candidates])
+        distances, offsets = compare_row_to_many(bottoms[i], stack, compare_type, max_shift)
+        keep = distances < tolerance
+        rows.extend([i] * int(np.count_nonzero(keep)))
+        columns.extend(candidates[keep].tolist())
+        costs.extend(distances[keep].tolist())
+
+    if debug:
+        print(f'find_piece_links() compared {checked} pairs for {len(bottoms)} pieces, found {len(costs)} links')
+
+    return (np.array(rows, dtype = np.int64), np.array(columns, dtype = np.int64), np.array(costs))
+
+
+####################
+#   Like piece_order.find_piece_chains(), but uses the index to find the
+#   links instead of comparing everything, and picks them greedily.
+#
+#   returns
+#       List of chains, each a list of indices into the given lists, top to
+#       bottom.  Sorted by their top piece.  Non-images aren't in any chain.
+#
+def find_piece_chains(bottoms, tops, compare_type = HUE_MASK, max_shift = 0, tolerance = TOLERANCE,
+                      num_candidates = NUM_CANDIDATES):
+    rows, columns, costs = find_piece_links(bottoms, tops, compare_type, max_shift, tolerance, num_candidates)
+
+    count = len(bottoms)
+    below = piece_order.solve_sparse_links_greedily(count, rows, columns, costs)
+
+    link_costs = {}
+    for k in range(len(costs)):
+        link_costs[int(rows[k]), int(columns[k])] = costs[k]
+
+    chains = []
+    for chain in piece_order.follow_links(below, link_costs):
+        if (bottoms[chain[0]] is not None) or (len(chain) > 1):
+            chains.append(chain)
+
+    chains.sort()
+    return chains
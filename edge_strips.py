@@ -0,0 +1,386 @@
+#   Pulls just the edges (a band of rows or columns) out of image files.
+#
+#   The comparators only ever look at the very edges of the pieces, but
+#   Image.load() decodes the whole thing.  On tall pieces that's most of
+#   the work.  The functions here try to decode only the rows that are
+#   actually needed and fall back to a regular load when they can't.
+#
+#   Full decodes go through the image cache (see image_cache.py), so an
+#   image is only ever decoded in full once.
+#
+#   What can be done without a full decode:
+#
+#       JPEG    Bands that start at the top row.  The decoder is simply
+#               stopped once it has produced enough scanlines (which for
+#               libjpeg means the first MCU row or so).  Baseline JPEGs
+#               can't be entered in the middle, so the bottom band still
+#               needs the whole file decoded.
+#
+#       PNG     Same as JPEG: bands starting at the top (non-interlaced only).
+#
+#       raw     (BMP, PPM...)  Any band--we just jump to the right spot in
+#               the file.
+#
+#       tiled   Formats that are stored in strips or tiles only decode the
+#               strips that overlap the band.
+#
+#   All of it is done by cutting down the image's tile list (what a file
+#   plugin hands Pillow to say where the pixels are) before it's loaded,
+#   which is as far into Pillow as we go.  The image keeps its full size;
+#   only the band gets decoded, and it's cropped out as usual.
+#
+
+import numpy as np
+from PIL import Image
+from PIL import ImageFile
+
+import image_cache
+
+
+####################
+#   constants
+####################
+
+# The four edges of an image
+TOP_EDGE = 'top'
+BOTTOM_EDGE = 'bottom'
+LEFT_EDGE = 'left'
+RIGHT_EDGE = 'right'
+
+# Bytes per pixel of the raw modes that don't come with a stride (like
+# PPM's), so the rows can still be counted
+RAW_PIXEL_BYTES = {'L': 1, 'P': 1, 'RGB': 3, 'RGBA': 4, 'RGBX': 4, 'CMYK': 4}
+
+# The EXIF tag for the orientation (1 means the pixels are the right way up)
+ORIENTATION_TAG = 0x0112
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+
+####################
+#   Converts a (partial) image into a NumPy array.  Single channel images
+#   still get a third dimension (of size 1) so that everything downstream
+#   can treat pixels the same way.
+#
+def image_to_array(image):
+    array = np.asarray(image)
+    if array.ndim == 2:
+        array = array[:, :, np.newaxis]
+    return array
+
+
+####################
+#   Returns the EXIF orientation of an opened image (1 through 8, where 1
+#   is normal).  Only looks at what was read with the header--asking for
+#   the EXIF of a PNG that has none makes Pillow decode the whole thing.
+#
+def get_image_orientation(image):
+    if (image.format != 'TIFF') and ('exif' not in image.info):
+        return 1
+
+    try:
+        return int(image.getexif().get(ORIENTATION_TAG, 1))
+    except:
+        return 1
+
+
+####################
+#   Returns the box (left, upper, right, lower) for the band of the given
+#   edge.
+#
+#   params
+#       width, height   Size of the whole image.
+#
+#       edge            One of TOP_EDGE, BOTTOM_EDGE, LEFT_EDGE, RIGHT_EDGE.
+#
+#       depth           How many rows (or columns) thick the band is.
+#                       Will be clipped to the size of the image.
+#
+def get_edge_box(width, height, edge, depth = 1):
+    if edge == TOP_EDGE:
+        return (0, 0, width, min(depth, height))
+
+    if edge == BOTTOM_EDGE:
+        return (0, max(0, height - depth), width, height)
+
+    if edge == LEFT_EDGE:
+        return (0, 0, min(depth, width), height)
+
+    if edge == RIGHT_EDGE:
+        return (max(0, width - depth), 0, width, height)
+
+    print(f'get_edge_box() unknown edge: {edge}')
+    return
+
+
+####################
+#   Makes a copy of a tile with new extents (and optionally a new file
+#   offset and args).  Tiles are namedtuples in newer versions of Pillow,
+#   plain tuples in older ones.
+#
+def replace_tile(tile, extents, offset = None, args = None):
+    if offset == None:
+        offset = tile[2]
+    if args == None:
+        args = tile[3]
+
+    if hasattr(tile, '_replace'):
+        return tile._replace(extents = extents, offset = offset, args = args)
+
+    return (tile[0], extents, offset, args)
+
+
+####################
+#   Decodes just the top rows of a JPEG: its tile is cut down to those
+#   rows, so the decoder stops once it has them.  It then complains that
+#   it wasn't asked for the rest of the image, which is fine--Pillow has
+#   already put our rows in place by then.
+#
+#   (A file that's broken partway through our rows stops the decoder the
+#   same way, and can't be told apart.  Its full decode fails too, so the
+#   piece is dropped once it's wanted for anything else.)
+#
+#   params
+#       image       A freshly opened (not loaded) JpegImageFile.
+#
+#       rows        The number of rows (from the top) to decode.
+#
+#   returns
+#       True if the rows were decoded.  Crop them out of the image (the
+#       rest of it is black).
+#       False if something went wrong (the image should be thrown away).
+#
+def decode_jpeg_top_rows(image, rows):
+    image.tile = [replace_tile(image.tile[0], (0, 0, image.width, rows))]
+
+    try:
+        image.load()
+    except OSError as e:
+        # Pillow only lets go of the tile once the decoder has stopped by
+        # itself.  If it's still there, the file ran out before our rows.
+        if image.tile:
+            if debug:
+                print(f'decode_jpeg_top_rows() unable to decode {rows} rows ({e})')
+            return False
+
+    return True
+
+
+####################
+#   Tries to set up the image's tiles so that the next load() only decodes
+#   the rows in [top, bottom).  The image stays the same size (the rows
+#   that aren't decoded are black).
+#
+#   The image must have been opened from a file object, not a filename:
+#   Pillow memory maps raw images it has a filename for, and a map would
+#   ignore where the tile says to start.
+#
+#   returns
+#       True if the image is set up, False if it can't be partially decoded.
+#
+def restrict_tiles(image, top, bottom):
+    # Plugins with their own load() do their own thing--can't help those.
+    if type(image).load is not ImageFile.ImageFile.load:
+        return False
+
+    tiles = image.tile
+    width = image.width
+
+    if len(tiles) > 1:
+        # Strips or tiles: only keep the ones overlapping the band.
+        kept = []
+        for tile in tiles:
+            if (tile[1][1] < bottom) and (tile[1][3] > top):
+                kept.append(tile)
+
+        if len(kept) == 0:
+            return False
+
+        image.tile = kept
+        return True
+
+    tile = tiles[0]
+    codec = tile[0]
+    args = tile[3]
+
+    if codec == 'raw' and isinstance(args, str) and (args in RAW_PIXEL_BYTES):
+        # just the raw mode: the rows are packed top to bottom
+        args = (args, width * RAW_PIXEL_BYTES[args], 1)
+
+    if codec == 'raw' and isinstance(args, tuple) and len(args) >= 3 and args[1] > 0:
+        # Raw pixels with a known stride--can go straight to any row.
+        stride = args[1]
+        orientation = args[2]
+        if orientation < 0:
+            # stored bottom-up
+            offset = tile[2] + (image.height - bottom) * stride
+        else:
+            offset = tile[2] + top * stride
+
+        image.tile = [replace_tile(tile, (0, top, width, bottom), offset, args)]
+        return True
+
+    if top == 0 and (codec == 'raw' or (codec == 'zip' and not image.info.get('interlace'))):
+        # Decoded top to bottom, so just stop early.
+        image.tile = [replace_tile(tile, (0, 0, width, bottom))]
+        return True
+
+    return False
+
+
+####################
+#   Decodes just a band of a freshly opened image (if it can).
+#
+#   returns
+#       A NumPy array of the band, None if it'd take a full decode.
+#
+def decode_partial_band(image, box):
+    top = box[1]
+    bottom = box[3]
+    try:
+        if image.format == 'JPEG' and top == 0 and len(image.tile) == 1:
+            if decode_jpeg_top_rows(image, bottom):
+                return image_to_array(image.crop(box))
+
+        elif image.tile and restrict_tiles(image, top, bottom):
+            image.load()
+            return image_to_array(image.crop(box))
+
+    except Exception as e:
+        if debug:
+            print(f'decode_partial_band() partial decode failed ({e}), using full decode')
+
+    return
+
+
+####################
+#   Loads a band of an image, decoding as little as it can.
+#
+#   params
+#       source      Either a filename or an already opened Image.  Images
+#                   that are already open are simply cropped (they may
+#                   have been loaded already, and we don't want to mess
+#                   with somebody else's Image).
+#
+#       box         (left, upper, right, lower) of the band.
+#
+#   returns
+#       A NumPy array of shape (rows, columns, channels).
+#       None on error (not an image file, etc.)
+#
+def load_band(source, box):
+    if not isinstance(source, str):
+        return image_to_array(source.crop(box))
+
+    try:
+        # (a file object, so Pillow won't memory map it--see restrict_tiles())
+        with open(source, 'rb') as file, Image.open(file) as image:
+            band = decode_partial_band(image, box)
+    except:
+        if debug:
+            print(f'load_band() {source} is not an image file--aborting!')
+        return
+
+    if band is None:
+        # Couldn't do it the quick way, so decode everything.  That goes
+        # through the image cache: the rest of the image is usually wanted
+        # soon (the other edge, or to be pasted).
+        whole_image = image_cache.get_image(source)
+        if whole_image == None:
+            if debug:
+                print(f'load_band() unable to load {source}!')
+            return
+        band = image_to_array(whole_image.crop(box))
+
+    return band
+
+
+####################
+#   Loads one edge of an image.
+#
+#   params
+#       source      Filename (or opened Image) to read.
+#
+#       edge        One of TOP_EDGE, BOTTOM_EDGE, LEFT_EDGE, RIGHT_EDGE.
+#
+#       depth       Number of rows (columns for left and right) to get.
+#
+#   returns
+#       NumPy array of the band, shaped like the image is: (depth, width,
+#       channels) for the top and bottom, (height, depth, channels) for
+#       the left and right.
+#       None on error.
+#
+def load_edge_strip(source, edge, depth = 1):
+    if isinstance(source, str):
+        try:
+            image = Image.open(source)
+            width, height = image.size
+            image.close()
+        except:
+            if debug:
+                print(f'load_edge_strip() {source} is not an image file--aborting!')
+            return
+    else:
+        width, height = source.size
+
+    box = get_edge_box(width, height, edge, depth)
+    if box == None:
+        return
+
+    return load_band(source, box)
+
+
+####################
+#   Loads one edge of a JPEG at a reduced size, using the decoder's draft
+#   mode (it skips most of the IDCT work, so it's much cheaper than a full
+#   decode).  Each pixel of the result is roughly the average of a
+#   scale x scale block of the original.
+#
+#   params
+#       filename    The JPEG to read.
+#
+#       edge        One of TOP_EDGE, BOTTOM_EDGE, LEFT_EDGE, RIGHT_EDGE.
+#
+#       scale       How much to shrink by.  JPEG can do 2, 4 or 8; the
+#                   decoder picks the closest one it can do that isn't
+#                   bigger than this.
+#
+#   returns
+#       (band, scale)   The one row (or column) thick band, shaped like
+#                       load_edge_strip() would, and the scale actually used.
+#       None if the file isn't a JPEG (or can't be read).
+#
+def load_draft_edge_strip(filename, edge, scale):
+    try:
+        image = Image.open(filename)
+    except:
+        if debug:
+            print(f'load_draft_edge_strip() {filename} is not an image file--aborting!')
+        return
+
+    if image.format != 'JPEG':
+        image.close()
+        return
+
+    try:
+        width, height = image.size
+        image.draft(image.mode, (max(1, width // scale), max(1, height // scale)))
+        actual_scale = width // image.width
+
+        box = get_edge_box(image.width, image.height, edge)
+        band = image_to_array(image.crop(box))
+
+    except Exception as e:
+        if debug:
+            print(f'load_draft_edge_strip() unable to decode {filename} ({e})')
+        image.close()
+        return
+
+    image.close()
+    return (band, actual_scale)
@@ -1,16 +1,30 @@
 #   Finds the rows within two images that best match.
 #
-#   O(n^2) as it does a line-by-line comparison between the
-#   two files.  But command line params can greatly reduce this
-#   to O(n).
+#   Every row of the first image is compared with every row of the
+#   second (O(n^2) rows), but matrix multiplies rule out most of the
+#   pairs a chunk at a time, so only the few that could be the best are
+#   compared pixel by pixel.  Command line params can reduce this to O(n).
+#
+#   With -j the rows are spread over worker processes: the two images go
+#   into shared memory (see shared_buffers.py) and each worker takes a
+#   slice of the rows of the first image.
 #
 
 import os
 import math
 import sys      # for command line arguments
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from PIL import Image
 from PIL import ImageOps
 
+from edge_strips import load_band, load_edge_strip, image_to_array, TOP_EDGE, BOTTOM_EDGE
+from image_comparator import find_best_overlap, find_overlap_alignment
+from image_comparator import RED_MASK, GREEN_MASK, BLUE_MASK, MIN_OVERLAP
+from image_comparator import find_closest_row_pairs
+import image_cache
+import shared_buffers
+
 ############################
 #   constants
 #
@@ -20,16 +34,35 @@ find_match_rows - a program to figure out which rows within two
 image files that best match.  The match number returned means
 how good a match was found.  The lower the better match (0 = perfect).
 
-find_match_rows <image1> <image2> [row] [-d]
+find_match_rows <image1> <image2> [row] [-k num] [-ov] [-pc] [-sub] [-m num] [-j num] [--max-mem size] [-d]
 
 [row]   The optional [row] param will only compare that row in the first
         file to all the rows in the second file.  Must come AFTER the two
         image file names.
 
+-k      Show the best 'num' pairs of rows instead of just the best one.
+
+-ov     Find how much the images overlap instead: the number of rows at
+        the bottom of image1 that best match the same number of rows at
+        the top of image2.  The result can be given straight to joiner.py -ov.
+
+-pc     Like -ov, but the images can also be shifted sideways (and can be
+        different widths).  Uses phase correlation to find both the overlap
+        and the sideways offset, ready for joiner.py -ov and -off.
+
+-sub    Used with -pc.  Find the overlap and offset to a fraction of a pixel.
+
+-m      Used with -ov or -pc.  The most rows the images could overlap (only
+        this many rows of each image are looked at).
+
+-j      Use this many processes to find the best rows (0 means one per CPU).
+
+--max-mem   The most memory to use for the decoded images, like 2G or
+        512M.  Defaults to 512M.
+
 -d      Turn on debug statements.  May appear anywhere.
 
-NOTE: the two images need to be the same width.  Maybe I'll work
-    on that later.
+NOTE: the two images need to be the same width (except with -pc).
 
 NOTE2: this assumes that the images are already in the appropriate
     orientation.  Yes, I'm lazy--no orientation correcting is done here.
@@ -38,6 +71,30 @@ NOTE2: this assumes that the images are already in the appropriate
 
 DEBUG_PARAM = '-d'
 
+# the next param is how many of the best pairs to show
+NUM_PAIRS_PARAM = '-k'
+
+# find the overlap instead of the best rows
+OVERLAP_PARAM = '-ov'
+
+# the next param is the biggest overlap to look for
+MAX_OVERLAP_PARAM = '-m'
+
+# find the overlap and sideways offset with phase correlation
+PHASE_PARAM = '-pc'
+
+# find the phase correlation to a fraction of a pixel
+SUBPIXEL_PARAM = '-sub'
+
+# the next param is how many worker processes to use
+WORKERS_PARAM = '-j'
+
+# the next param is the most memory for decoded images (like 2G)
+MAX_MEM_PARAM = '--max-mem'
+
+# Compare all the color planes (just like get_distance_between_pixels())
+COMPARE_TYPE = RED_MASK | GREEN_MASK | BLUE_MASK
+
 
 ############################
 #   globals
@@ -53,6 +110,24 @@ bottom_image_filename = None
 # top image should be used.
 master_row = -1
 
+# how many of the best pairs to show
+num_pairs = 1
+
+# When True, find the overlap between the images (instead of the best rows)
+find_overlap = False
+
+# The biggest overlap to look for (None means as tall as the shorter image)
+max_overlap = None
+
+# When True, use phase correlation to line up the images
+phase_correlation = False
+
+# When True, phase correlation results are to a fraction of a pixel
+subpixel = False
+
+# how many processes to find the best rows with
+num_workers = 1
+
 
 ############################
 #   functions
@@ -70,6 +145,20 @@ master_row = -1
 #                               the row number specified.  Should be '-1'
 #                               when called.
 #
+#       num_pairs               Set if NUM_PAIRS_PARAM exists.
+#
+#       find_overlap            True iff OVERLAP_PARAM exists.
+#
+#       max_overlap             Set if MAX_OVERLAP_PARAM exists.
+#
+#       phase_correlation       True iff PHASE_PARAM exists.
+#
+#       subpixel                True iff SUBPIXEL_PARAM exists.
+#
+#       num_workers             Set if WORKERS_PARAM exists.
+#
+#       image_cache.max_bytes   Set if MAX_MEM_PARAM exists.
+#
 def parse_params():
     # Note that sys.argv[0] is always 'joiner.py' and its path, so that
     # counts as the first argument.
@@ -78,16 +167,75 @@ def parse_params():
     global top_image_filename
     global bottom_image_filename
     global master_row
-
-    # loop through the args
-    for arg in sys.argv:
-
-        if arg == sys.argv[0]:      # skip the first arg--it's always the name of the script
-            continue
+    global num_pairs
+    global find_overlap
+    global max_overlap
+    global phase_correlation
+    global subpixel
+    global num_workers
+
+    # loop through the args (skipping the first--it's always the name of the script)
+    counter = 1
+    while counter < len(sys.argv):
+        arg = sys.argv[counter]
+        counter += 1
 
         if arg.lower() == DEBUG_PARAM:
             debug = True
 
+        elif arg.lower() == NUM_PAIRS_PARAM:
+            try:
+                num_pairs = int(sys.argv[counter])
+                counter += 1
+            except:
+                print(f'Unable to parse the number of pairs. Aborting!')
+                exit(USAGE)
+
+            if num_pairs < 1:
+                print(f'Need to show at least one pair. Aborting!')
+                exit(USAGE)
+
+        elif arg.lower() == OVERLAP_PARAM:
+            find_overlap = True
+
+        elif arg.lower() == PHASE_PARAM:
+            phase_correlation = True
+
+        elif arg.lower() == SUBPIXEL_PARAM:
+            subpixel = True
+
+        elif arg.lower() == MAX_OVERLAP_PARAM:
+            try:
+                max_overlap = int(sys.argv[counter])
+                counter += 1
+            except:
+                print(f'Unable to parse the max overlap. Aborting!')
+                exit(USAGE)
+
+        elif arg.lower() == WORKERS_PARAM:
+            try:
+                num_workers = int(sys.argv[counter])
+                counter += 1
+            except:
+                print(f'Unable to parse the number of workers. Aborting!')
+                exit(USAGE)
+
+            if num_workers < 0:
+                print(f'Number of workers must not be negative. Aborting!')
+                exit(USAGE)
+            if num_workers == 0:
+                num_workers = os.cpu_count() or 1
+
+        elif arg.lower() == MAX_MEM_PARAM:
+            max_mem = None
+            if counter < len(sys.argv):
+                max_mem = image_cache.parse_memory_size(sys.argv[counter])
+                counter += 1
+            if max_mem == None:
+                print(f'Unable to parse the memory size. Aborting!')
+                exit(USAGE)
+            image_cache.max_bytes = max_mem
+
         elif top_image_filename == None:
             top_image_filename = arg
 
@@ -206,62 +354,162 @@ def find_difference_between_two_rows(image_map1, row1, row1_width,
             return distance_sum / row2_width
 
 
-#########################################################
-#   begin
-#########################################################
+#########
+#   Finds the best row pairs for a slice of the rows of the first image.
+#   This is what runs in the workers for find_best_row_pairs_parallel().
+#
+#   returns
+#       List of (distance, row1, row2), with row1 counted from the top of
+#       the whole image.
+#
+def find_row_pairs_chunk(descriptor1, descriptor2, start, end, compare_type, num_pairs):
+    pixels1 = shared_buffers.attach_array(descriptor1)
+    pixels2 = shared_buffers.attach_array(descriptor2)
+
+    pairs = find_closest_row_pairs(pixels1[start:end], pixels2, compare_type, num_pairs)
+    return [(distance, row1 + start, row2) for distance, row1, row2 in pairs]
+
+
+#########
+#   find_closest_row_pairs(), spread over several processes.  The images
+#   go into shared memory once and each worker takes a slice of the first
+#   image's rows.  (The best pairs of each slice include any of the best
+#   pairs overall, so the answer is the same.)
+#
+#   returns
+#       List of (distance, row1, row2) tuples, best first.
+#       None if the images are different widths.
+#
+def find_best_row_pairs_parallel(pixels1, pixels2, compare_type, num_pairs = 1, workers = 1):
+    if (workers <= 1) or (len(pixels1) < 2):
+        return find_closest_row_pairs(pixels1, pixels2, compare_type, num_pairs)
+
+    if pixels1.shape[1] != pixels2.shape[1]:
+        return
 
-parse_params()
+    rows_each = -(-len(pixels1) // workers)
+    pairs = []
+    with shared_buffers.shared_buffers():
+        descriptor1 = shared_buffers.share_array(pixels1)
+        descriptor2 = shared_buffers.share_array(pixels2)
 
-# open images
-top_image = None
-bottom_image = None
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            futures = [executor.submit(find_row_pairs_chunk, descriptor1, descriptor2,
+                                       start, min(start + rows_each, len(pixels1)), compare_type, num_pairs)
+                       for start in range(0, len(pixels1), rows_each)]
+            for future in futures:
+                pairs.extend(future.result())
 
-try:
-    top_image = Image.open(top_image_filename)
-    bottom_image = Image.open(bottom_image_filename)
-except:
-    print('Unable to open images!')
-    exit(USAGE)
+    pairs.sort()
+    return pairs[:num_pairs]
 
-if top_image.width != bottom_image.width:
-    print('Images need to be the same width.  Aborting!!!')
-    exit()
 
+#########
+#   The whole program.
+#
+def main():
+    parse_params()
+
+    # open images
+    top_image = None
+    bottom_image = None
+
+    try:
+        top_image = Image.open(top_image_filename)
+        bottom_image = Image.open(bottom_image_filename)
+    except:
+        print('Unable to open images!')
+        exit(USAGE)
+
+    #########
+    #   Phase correlation mode: line up the bands that could overlap, which
+    #   can be different widths.
+    #
+    if phase_correlation:
+        most_rows = min(top_image.height, bottom_image.height)
+        if max_overlap != None:
+            most_rows = min(most_rows, max_overlap)
+
+        top_image.close()
+        bottom_image.close()
+
+        top_pixels = load_edge_strip(top_image_filename, BOTTOM_EDGE, most_rows)
+        bottom_pixels = load_edge_strip(bottom_image_filename, TOP_EDGE, most_rows)
+
+        result = find_overlap_alignment(top_pixels, bottom_pixels, COMPARE_TYPE, subpixel)
+        if result == None:
+            exit(f'The images do not seem to overlap (within {most_rows} rows).')
+
+        overlap, offset, peak = result
+        print(f'Best alignment: overlap = {overlap} rows, offset = {offset} pixels (confidence {peak})')
+        print(f'   joiner.py {top_image_filename} {bottom_image_filename} -v -ov {round(overlap)} -off {round(offset)}')
+        exit()
+
+
+    if top_image.width != bottom_image.width:
+        print('Images need to be the same width.  Aborting!!!')
+        exit()
 
-best_match = sys.maxsize        # the best match distance
-best_top_row = 0
-best_bottom_row = 0
-top_row_start = 0
-top_row_end = top_image.height
 
-# This makes the loop happen only on the 1 master row
-# (if it's specified).
-if master_row != -1:
-    top_row_start = master_row
-    top_row_end = master_row + 1
+    #########
+    #   Overlap mode: only the bands that could overlap are needed.
+    #
+    if find_overlap:
+        most_rows = min(top_image.height, bottom_image.height)
+        if max_overlap != None:
+            most_rows = min(most_rows, max_overlap)
 
-# the maps are needed for find_difference_between_two_rows()
-top_image_map = top_image.load()
-bottom_image_map = bottom_image.load()
+        top_image.close()
+        bottom_image.close()
 
+        top_pixels = load_edge_strip(top_image_filename, BOTTOM_EDGE, most_rows)
+        bottom_pixels = load_edge_strip(bottom_image_filename, TOP_EDGE, most_rows)
 
-# O(n^2)
-for i in range(top_row_start, top_image.height):
-    for j in range(0, bottom_image.height):
-        current_match = find_difference_between_two_rows(
-                top_image_map, i, top_image.width,
-                bottom_image_map, j, bottom_image.width,
-            )
+        result = find_best_overlap(top_pixels, bottom_pixels, COMPARE_TYPE)
+        if result == None:
+            exit(f'Images are too short to overlap by at least {MIN_OVERLAP} rows!')
 
-    if current_match < best_match:
-        best_match = current_match
-        best_top_row = i
-        best_bottom_row = j
-        if debug:
-            print(f'...Found better match: {current_match} top row = {best_top_row}, bottom row = {best_bottom_row}')
+        overlap, rms_distance = result
+        print(f'Best overlap: {overlap} rows (rms distance {rms_distance})')
+        print(f'   joiner.py {top_image_filename} {bottom_image_filename} -v -ov {overlap}')
+        exit()
 
-print(f'Best match: {current_match} top row = {best_top_row}, bottom row = {best_bottom_row}')
 
-top_image.close()
-bottom_image.close()
+    top_row_start = 0
+    top_row_end = top_image.height
+
+    # This makes the search happen only on the 1 master row
+    # (if it's specified).
+    if master_row != -1:
+        top_row_start = master_row
+        top_row_end = master_row + 1
+
+    # When there's a master row, that's the only part of the top image that
+    # gets decoded.
+    top_image.close()
+    bottom_image.close()
+
+    # (the bottom image is decoded through the image cache--if the top
+    # band needed a full decode of the same file, it's only done once)
+    top_pixels = load_band(top_image_filename, (0, top_row_start, top_image.width, top_row_end))
+    bottom_pixels = image_to_array(image_cache.get_image(bottom_image_filename))
+
+    # (the same distance find_difference_between_two_rows() finds)
+    matches = find_best_row_pairs_parallel(top_pixels, bottom_pixels, COMPARE_TYPE, num_pairs, num_workers)
+    matches = [(current_match, top_row + top_row_start, bottom_row) for current_match, top_row, bottom_row in matches]
+
+    best_match, best_top_row, best_bottom_row = matches[0]
+    print(f'Best match: {best_match} top row = {best_top_row}, bottom row = {best_bottom_row}')
+
+    if num_pairs > 1:
+        for current_match, top_row, bottom_row in matches[1:num_pairs]:
+            print(f'      next: {current_match} top row = {top_row}, bottom row = {bottom_row}')
+
+
+#########################################################
+#   begin
+#########################################################
 
+# Only when run as a program (worker processes may import this file again).
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+#   Keeps decoded pieces in memory, and decodes the next few pieces in
+#   the background before they're asked for.
+#
+#   Opening and decoding the pieces one after the other means waiting on
+#   the disk (or the network) for every single one.  Pillow lets go of the
+#   GIL while it decodes, so a few threads can be reading and decoding the
+#   next pieces while the current ones are compared or pasted:
+#
+#       image_cache.prefetch(file_list[i + 1 : i + 1 + image_cache.PREFETCH_COUNT])
+#       image = image_cache.get_image(file_list[i])
+#
+#   get_image() returns the decoded image if it's already here, waits for
+#   it if it's being decoded, or decodes it right away if neither.
+#
+#   The images are kept until they add up to more than max_bytes, then
+#   the least recently used ones are thrown out.  Every script has a
+#   --max-mem param for it (see parse_memory_size()).  Pieces that are
+#   only needed once (to be pasted) should be let go of as soon as they're
+#   used, so that a huge group never has all its pieces decoded at once:
+#
+#       for image in image_cache.take_images(file_list):
+#           new_image.paste(image, ...)
+#
+#   Images are kept by path, modification time and size, so a file that
+#   changes (or a temp file that's made again under the same name) is
+#   decoded again.
+#
+#   The images belong to the cache: don't close() them (that throws away
+#   their pixels, and someone else may be using them).  They're freed once
+#   they're thrown out and nobody is using them any more.
+#
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+from PIL import ImageMode
+
+
+####################
+#   constants
+####################
+
+# Default for max_bytes (512 MB)
+DEFAULT_MAX_BYTES = 512 << 20
+
+# How many pieces ahead to decode
+PREFETCH_COUNT = 4
+
+# The suffixes parse_memory_size() knows about
+MEMORY_SUFFIXES = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+# Number of threads decoding in the background
+PREFETCH_THREADS = 4
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+# The most bytes of pixels to keep
+max_bytes = DEFAULT_MAX_BYTES
+
+# The cache: key (see get_file_key()) -> decoded image (least recently
+# used first)
+image_cache = OrderedDict()
+
+# Bytes of pixels in the cache
+cache_bytes = 0
+
+# Images being decoded in the background: key -> Future
+pending = {}
+
+# Guards everything above (the background threads change it too)
+cache_lock = threading.Lock()
+
+# The background threads (started when first needed)
+prefetch_executor = None
+
+# How many get_image() calls found their image already decoded
+num_hits = 0
+
+# How many had to decode it on the spot
+num_misses = 0
+
+
+####################
+#   Returns the key used for a file: its absolute path, modification
+#   time (in ns) and size.  None if the file can't be stat'ed.
+#
+def get_file_key(filename):
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return
+
+    return (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+
+
+####################
+#   Reads a number of bytes the way a person would write it: '2G',
+#   '512M', '1.5g', '300000' (K, M, G and T are powers of 1024, and a
+#   trailing B is fine too).
+#
+#   returns
+#       The number of bytes, or None if it can't be read.
+#
+def parse_memory_size(text):
+    text = text.strip().upper()
+    if text.endswith('B'):
+        text = text[:-1]
+
+    multiplier = 1
+    if (len(text) > 0) and (text[-1] in MEMORY_SUFFIXES):
+        multiplier = MEMORY_SUFFIXES[text[-1]]
+        text = text[:-1]
+
+    try:
+        size = int(float(text) * multiplier)
+    except ValueError:
+        return
+
+    if size < 0:
+        return
+    return size
+
+
+####################
+#   Returns about how many bytes of pixels an image takes (16 bit and
+#   32 bit modes like I;16, I and F take 2 or 4 bytes a band).
+#
+def get_image_bytes(image):
+    try:
+        mode = ImageMode.getmode(image.mode)
+        pixel_bytes = int(mode.typestr[2:]) * len(mode.bands)
+    except (KeyError, ValueError):
+        pixel_bytes = len(image.getbands())
+
+    return image.width * image.height * pixel_bytes
+
+
+####################
+#   Opens and decodes an image.
+#
+#   returns
+#       The loaded image, or None if this isn't an image file.
+#
+def decode_image(filename):
+    try:
+        image = Image.open(filename)
+        image.load()
+    except:
+        if debug:
+            print(f'decode_image() {filename} is not an image file')
+        return
+
+    return image
+
+
+####################
+#   Puts an image in the cache, throwing out the least recently used ones
+#   if that makes it too big.  Images bigger than the whole budget aren't
+#   kept at all.  Call with cache_lock held.
+#
+#   returns
+#       True if the image was kept.
+#
+def add_image(key, image):
+    global cache_bytes
+
+    size = get_image_bytes(image)
+    if size > max_bytes:
+        if debug:
+            print(f'add_image() {key[0]} is too big to keep ({size} bytes)')
+        return False
+
+    if key in image_cache:
+        cache_bytes -= get_image_bytes(image_cache.pop(key))
+
+    image_cache[key] = image
+    cache_bytes += size
+
+    while cache_bytes > max_bytes:
+        old_key, old_image = image_cache.popitem(last = False)
+        cache_bytes -= get_image_bytes(old_image)
+        if debug:
+            print(f'add_image() threw out {old_key[0]}')
+
+    return True
+
+
+####################
+#   Decodes an image in a background thread and puts it in the cache.
+#   An image that can't be kept (too big, or not an image at all) stays
+#   in pending instead, so that get_image() picks it up from there rather
+#   than decoding it all over again.
+#
+def prefetch_image(filename, key):
+    image = decode_image(filename)
+
+    with cache_lock:
+        if (image != None) and add_image(key, image):
+            pending.pop(key, None)
+
+    return image
+
+
+####################
+#   Starts decoding the given pieces in the background (the ones that
+#   aren't already here or on their way).
+#
+def prefetch(filenames):
+    global prefetch_executor
+
+    keys = [get_file_key(filename) for filename in filenames]
+
+    with cache_lock:
+        if prefetch_executor == None:
+            prefetch_executor = ThreadPoolExecutor(max_workers = PREFETCH_THREADS)
+
+        for filename, key in zip(filenames, keys):
+            if (key == None) or (key in image_cache) or (key in pending):
+                continue
+            pending[key] = prefetch_executor.submit(prefetch_image, filename, key)
+
+
+####################
+#   Returns the decoded image for a file (see the top of this file).
+#
+#   returns
+#       The image (don't close it), or None if this isn't an image file.
+#
+def get_image(filename):
+    global num_hits
+    global num_misses
+
+    key = get_file_key(filename)
+    if key == None:
+        if debug:
+            print(f'get_image() unable to find {filename}')
+        return
+
+    with cache_lock:
+        if key in image_cache:
+            image_cache.move_to_end(key)
+            num_hits += 1
+            return image_cache[key]
+
+        future = pending.get(key)
+        if future != None:
+            num_hits += 1
+
+    if future != None:
+        image = future.result()
+        with cache_lock:
+            if pending.get(key) is future:
+                pending.pop(key)
+        return image
+
+    image = decode_image(filename)
+    with cache_lock:
+        num_misses += 1
+        if image != None:
+            add_image(key, image)
+
+    return image
+
+
+####################
+#   Lets go of a file's image (once it's been used and won't be needed
+#   again).  Anyone still holding it can keep using it.
+#
+def release_image(filename):
+    global cache_bytes
+
+    key = get_file_key(filename)
+    with cache_lock:
+        image = image_cache.pop(key, None)
+        if image != None:
+            cache_bytes -= get_image_bytes(image)
+
+
+####################
+#   Goes through the images of some pieces that are each needed just once
+#   (to be pasted, say).  Only the next PREFETCH_COUNT are decoded ahead
+#   of time, and each one is let go of as soon as the caller is done with
+#   it (when it asks for the next).
+#
+#   Files that can't be opened (gone, or not images after all) are
+#   skipped, with a message, so the callers never see None.
+#
+#   yields
+#       The images, in order.
+#
+def take_images(filenames):
+    for k in range(len(filenames)):
+        prefetch(filenames[k + 1 : k + 1 + PREFETCH_COUNT])
+        image = get_image(filenames[k])
+        if image == None:
+            print(f'Unable to open {filenames[k]}, skipping it.')
+            continue
+
+        yield image
+        release_image(filenames[k])
+
+
+####################
+#   Throws everything out and stops the background threads.
+#
+def clear_cache():
+    global cache_bytes
+    global prefetch_executor
+
+    if prefetch_executor != None:
+        prefetch_executor.shutdown(wait = True, cancel_futures = True)
+        prefetch_executor = None
+
+    with cache_lock:
+        image_cache.clear()
+        pending.clear()
+        cache_bytes = 0
+
+    if debug:
+        print(f'clear_cache() {num_hits} hits, {num_misses} misses')
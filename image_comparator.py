@@ -2,8 +2,11 @@
 #
 
 import math
+import numpy as np
 from PIL import Image
 
+from edge_strips import *
+
 # Currently not using these
 # from colormath.color_objects import LabColor, HSLColor      # takes a while
 # from colormath.color_conversions import convert_color       # takes a while too
@@ -25,6 +28,54 @@ LIGHT_MASK = 0x4
 
 TOLERANCE = 12.0
 
+# The most rows (of each image) to work on at once when finding the
+# distances between all the rows of two images.  Keeps memory in check.
+ROW_CHUNK_SIZE = 512
+
+# Each row is cut into this many pieces to bound how far apart two rows
+# can be without comparing every pixel (see find_closest_row_pairs()).
+ROW_BOUND_SEGMENTS = 16
+
+# How much smaller (relatively) a row distance bound is made, so rounding
+# can't make it too big (see find_row_distance_bounds())
+ROW_BOUND_ROUNDING = 1e-9
+
+# Most pixels (times the number of offsets) for compare_row_to_many() to
+# work on at once.  Keeps memory in check.
+MANY_CHUNK_PIXELS = 1 << 20
+
+# How many pixels of a seam to compare before checking whether the
+# answer is already known (see compare_rows_bounded()).
+BOUND_CHUNK_SIZE = 256
+
+# Sampling seams (see compare_rows_sampled()): columns are added this many
+# at a time, no decision is made on fewer than SAMPLE_MIN_COLUMNS, and the
+# confidence interval is SAMPLE_Z standard errors either way.  The seed
+# keeps the samples (and so the answers) the same from run to run.
+SAMPLE_BATCH_SIZE = 64
+SAMPLE_MIN_COLUMNS = 128
+SAMPLE_Z = 4.0
+SAMPLE_SEED = 0
+
+# The most values (columns times color planes) to put through the FFT at
+# once when finding overlaps.
+OVERLAP_CHUNK_SIZE = 1024
+
+# The smallest overlap (in rows) worth considering.  Anything less can
+# match by pure luck.
+MIN_OVERLAP = 4
+
+# How many times the pyramid halves the edges when matching coarse to fine
+PYRAMID_LEVELS = 3
+
+# Extra tolerance (as a fraction of TOLERANCE) given to each coarser level
+# of the pyramid.  See get_pyramid_tolerance().
+PYRAMID_SLACK = 0.5
+
+# An offset is only thrown out by the pyramid when its bound is past the
+# tolerance by more than rounding could account for
+PYRAMID_ROUNDING = 1.0 + 1e-9
+
 ####################
 #   globals
 ####################
@@ -257,14 +308,123 @@ def find_average_color_in_block(image_map, image_width, defining_pixel, block_si
     return color_ave
 
 
+####################
+#   Finds the average color of every block along the edge of a band, all
+#   at once, using an integral image (summed-area table).  Once the table
+#   is built each block's sum is just four lookups, no matter how big the
+#   blocks are.
+#
+#   params
+#       band            The edge band, (rows, width, channels).  Must have
+#                       at least block_size rows.
+#
+#       block_size      The length of a block's side in pixels.
+#
+#       channels        The color planes to average (from get_compare_channels()).
+#
+#       top_image       When True this is the band of the top image and the
+#                       blocks sit on its bottom row.  False means the bottom
+#                       image, with the blocks hanging down from the top row.
+#
+#   returns
+#       Array (width, len(channels)).  Entry x is the average color of the
+#       block whose defining pixel is in column x (see the drawing in
+#       compare_edges_using_blocks()).  Blocks that run off the right side
+#       are averaged over just the columns that are there.
+#
+def find_block_averages(band, block_size, channels, top_image):
+    if top_image:
+        rows = band[-block_size:, :, channels]
+    else:
+        rows = band[:block_size, :, channels]
+
+    width = rows.shape[1]
+
+    # table[y, x] is the sum of everything above and left of (y, x)
+    table = np.zeros((block_size + 1, width + 1, len(channels)))
+    table[1:, 1:] = np.cumsum(np.cumsum(rows.astype(np.float64), axis = 0), axis = 1)
+
+    left = np.arange(width)
+    right = np.minimum(left + block_size, width)
+    sums = table[block_size, right] - table[0, right] - table[block_size, left] + table[0, left]
+
+    counts = (right - left) * block_size
+    return sums / counts[:, np.newaxis]
+
+
+####################
+#   The array version of compare_edges_using_blocks().  Compares the blocks
+#   along the bottom of band1 with the blocks along the top of band2.
+#
+#   params
+#       band1, band2    Edge bands, (rows, width, channels).  Both need at
+#                       least block_size rows.
+#
+#       block_size      The length of a block's side in pixels.
+#
+#       compare_type    Which color planes to use (see compare_edges_with_type()).
+#
+#   returns
+#       The average distance between the blocks' colors (0 = perfect match).
+#       None on error (different widths or bands that are too short).
+#
+def compare_bands_using_blocks(band1, band2, block_size, compare_type = HUE_MASK):
+    if band1.shape[1] != band2.shape[1]:
+        if debug:
+            print('compare_bands_using_blocks() Error!  Not same width!')
+        return
+
+    if (len(band1) < block_size) or (len(band2) < block_size):
+        if debug:
+            print('compare_bands_using_blocks() Error!  Bands are shorter than a block!')
+        return
+
+    channels = get_compare_channels(compare_type)
+    block_colors1 = find_block_averages(band1, block_size, channels, True)
+    block_colors2 = find_block_averages(band2, block_size, channels, False)
+
+    diff = block_colors1 - block_colors2
+    distances = np.sqrt(np.sum(diff * diff, axis = 1))
+    distance_ave = float(np.cumsum(distances)[-1]) / len(distances)
+
+    if debug:
+        print(f'compare_bands_using_blocks() -> average = {distance_ave}')
+
+    return distance_ave
+
+
 ####################
 #   Instead of comparing just pixels, this compares blocks.
 #
+#   Each pixel along the seam defines a block.  For the top image (file1),
+#   the block's lower left pixel is the defining pixel:
+#
+#   0 0 0   
+#   0 0 0
+#   x 0 0   <- a 3x3 block defined by the pixel at x
+#
+#   The bottom image uses the top left pixel as its defining point:
+#
+#   x 0 0   <- defined by pixel at x
+#   0 0 0
+#   0 0 0
+#
+#   When the blocks reach the right side of the images where pixels don't
+#   exist, only the part of the block that's there is used.
+#
 #   param
 #       block_size      The length of a square block in pixels.
 #                       So a block_size of 3 will make a 3x3 square
 #                       block.
 #
+#       compare_type    Which color planes to use.  Defaults to just HUE.
+#
+#   returns
+#       0 = perfect match
+#       otherwise the bigger the worse the match
+#       None means error (not graphics files, different widths, or images
+#       shorter than a block)
+#
 def compare_edges_using_blocks(file1, file2, block_size, compare_type = HUE_MASK):
     if debug:
         print(f'compare_edges_using_blocks( {file1}, {file2}, {block_size} )')
@@ -280,101 +440,117 @@ def compare_edges_using_blocks(file1, file2, block_size, compare_type = HUE_MASK
 
     # make sure that these have the same widths
     width = image1.width
-    if (width != image2.width):
+    width2 = image2.width
+    image2.close()
+    image1.close()
+
+    if (width != width2):
         if debug:
             print(f'compare_edges_using_blocks( {file1}, {file2}, {block_size} ) Error!  Not same width!')
         return
 
-    # this is the number for the bottom row of the file1
-    bottom = image1.height - 1
-
-    map1 = image1.load()
-    map2 = image2.load()
-
-    # the running total of the distances
-    distance_sum = 0.0
+    # Only the bands along the seam are needed.
+    band1 = load_edge_strip(file1, BOTTOM_EDGE, block_size)
+    band2 = load_edge_strip(file2, TOP_EDGE, block_size)
+    if (band1 is None) or (band2 is None):
+        return
 
-    # not sure this is needed for this function
-    skipped_pixels = 0
+    return compare_bands_using_blocks(band1, band2, block_size, compare_type)
 
-    # just doing HUE for now (TODO: make this work for any aspect)
-    #
-    # Loop through all the pixels in the two maps, keeping track of the total
-    # color difference between all the corresponding pixels.
-    for x in range(width):
-        # Get the two pixels -- don't forget to take the offset into account!
-        # And we'll ignore out of range pixels.
-        pixel1 = map1[x, bottom]
-        pixel2 = map2[x, 0]   # here the offset is applied
-
-        #
-        # Find the average color of the box for this pixel. Time to define
-        # a block:
-        #       For the top image (image1), the block's lower left pixel is
-        #       the one we just got.
-        #
-        #   0 0 0   
-        #   0 0 0
-        #   x 0 0   <- a 3x3 block defined by the pixel at x
-        #
-        #
-        #       The bottom image uses the top left pixel as its defining
-        #       point.    
-        #
-        #   x 0 0   <- defined by pixel at x
-        #   0 0 0
-        #   0 0 0
-        #
-        # When the pattern reaches the right side of the images where pixels
-        # don't exist, those blocks will simply be skipped.
-        #
-
-        block_color1 = find_average_color_in_block(map1, image1.width, pixel1, block_size, True, compare_type)
-        block_color2 = find_average_color_in_block(map2, image1.width, pixel2, block_size, False, compare_type)
-
-        # check for errors -- probably bad data from here on out!!!
-        if (block_color1 == None) or (block_color2 == None):
-            print(f'error determining block color! skipping this loop')
-            skipped_pixels += 1
-            continue
 
-        if type(block_color1) is tuple:
-            # todo: handle full-on colors
-            print('Whoops, not handling full on tuples for block colors yet!!!')
-            break
+####################
+#   Returns the list of color planes (channel indices) that the given
+#   compare_type asks for.  See compare_edges_with_type() for a full
+#   description of the bits.
+#
+#   returns
+#       A list of channel indices, [0..2].  Could be empty if no
+#       bits are set (in which case every pixel is a perfect match).
+#
+def get_compare_channels(compare_type):
+    # are we doing HSL or RGB
+    if compare_type < 8:
+        masks = (HUE_MASK, SATURATION_MASK, LIGHT_MASK)
+    else:
+        masks = (RED_MASK, GREEN_MASK, BLUE_MASK)
 
-            """
-            # The distance between the two blocks is the square root of
-            # the differences of the color planes.
-            dist = 0.0
+    channels = []
+    for i in range(len(masks)):
+        if compare_type & masks[i]:
+            channels.append(i)
 
-            if compare_type & HUE_MASK:
-                dist += (block_color1[0] - block_color2[0]) ** 2
+    return channels
 
-            if compare_type & SATURATION_MASK:
-                dist += (block_color1[1] - block_color2[1]) ** 2
 
-            if compare_type & LIGHT_MASK:
-                dist += (block_color1[2] - block_color2[2]) ** 2
+####################
+#   Finds the distance between each pair of corresponding pixels in
+#   two rows (same pythagorean distance as always, but only using the
+#   color planes in channels).
+#
+#   params
+#       row1, row2      Arrays of the same shape, (width, channels).
+#
+#       channels        List of color planes to use, as returned by
+#                       get_compare_channels().
+#
+#   returns
+#       Array (width) of float64 distances.
+#
+def get_pixel_distances(row1, row2, channels):
+    # float64 holds these squares exactly, so this is the same number
+    # the old per-pixel loop came up with.
+    diff = row1[..., channels].astype(np.float64) - row2[..., channels].astype(np.float64)
+    return np.sqrt(np.sum(diff * diff, axis = -1))
 
-            # the actual distance between the two pixel colors
-            dist = math.sqrt(dist)    
-            """
 
-        else:
-            dist = abs(block_color1 - block_color2)
+####################
+#   The vectorized heart of compare_edges_with_type().  Compares two rows
+#   of pixels (already pulled out of their images) in one pass.
+#
+#   params
+#       row1            The bottom row of the top image.  Array of shape
+#                       (width, channels).
+#
+#       row2            The top row of the bottom image.  Same shape.
+#
+#       compare_type    See compare_edges_with_type().
+#
+#       offset          See compare_edges_with_type().
+#
+#   returns
+#       The average distance (exactly what the old pixel by pixel loop
+#       returned--the distances are summed in the same order).
+#       None if the rows are different widths or the offset leaves
+#       nothing to compare.
+#
+def compare_rows_with_type(row1, row2, compare_type, offset = 0):
+    width = len(row1)
+    if width != len(row2):
+        if debug:
+            print(f'compare_rows_with_type() Error!  Not same width!')
+        return
 
-        # increase the distance
-        distance_sum += dist
+    # only the pixels that are still in range after applying the offset
+    start = max(0, -offset)
+    end = min(width, width - offset)
+    if end <= start:
+        if debug:
+            print(f'compare_rows_with_type() Error!  offset {offset} is too big for width {width}')
+        return
 
-    # done with images
-    image2.close()
-    image1.close()
+    distances = get_pixel_distances(row1[start:end],
+                                    row2[start + offset:end + offset],
+                                    get_compare_channels(compare_type))
 
-    distance_ave = distance_sum / (width - skipped_pixels)
+    # cumsum() adds up in order, just like the old loop did (np.sum() uses
+    # pairwise summation, which can round a little differently).
+    distance_sum = float(np.cumsum(distances)[-1])
+    distance_ave = distance_sum / (end - start)
 
     if debug:
-        print(f'compare_edges_using_blocks() -> distance_sum = {distance_sum}, average = {distance_ave}')
+        print(f'   -> total distance = {distance_sum}')
+        print(f'   -> width = {width}')
+        print(f'   -> average = {distance_ave}')
 
     return distance_ave
 
@@ -426,100 +602,1398 @@ def compare_edges_with_type(file1, file2, compare_type, offset = 0):
     if (width != image2.width):
         if debug:
             print(f'compare_edges_with_type( {file1}, {file2} ) Error!  Not same width!')
+        image2.close()
+        image1.close()
         return
 
-    # this is the number for the bottom row of the file1
-    bottom = image1.height - 1
+    # done with images (we only needed their sizes)
+    image2.close()
+    image1.close()
 
-    map1 = image1.load()
-    map2 = image2.load()
+    # the bottom row of file1 and the top row of file2
+    band1 = load_edge_strip(file1, BOTTOM_EDGE)
+    band2 = load_edge_strip(file2, TOP_EDGE)
+    if (band1 is None) or (band2 is None):
+        return
 
-    # the running total of the distances
-    distance_sum = 0.0
-        
-    # for keeping track of pixels that may be skipped because of offsets
-    skipped_pixels = 0
-    offset_x = 0
+    return compare_rows_with_type(band1[0], band2[0], compare_type, offset)
+    
 
-    # are we doing HSL or RGB
-    if compare_type < 8:
-        # HSL
-        # Loop through all the pixels in the two maps, keeping track of the total
-        # color difference between all the corresponding pixels.
-        for x in range(width):
-            # Get the two pixels -- don't forget to take the offset into account!
-            # And we'll ignore out of range pixels.
-            offset_x = x + offset
-            if offset_x in range(0, width):
-                pixel1 = map1[x, bottom]
-                pixel2 = map2[offset_x, 0]   # here the offset is applied
-            else:
-                skipped_pixels += 1
-                continue
 
-            # The distance between the two pixels is the square root of
-            # the differences of the color planes.
-            dist = 0.0
-            if compare_type & HUE_MASK:
-                dist += (pixel1[0] - pixel2[0]) ** 2
+####################
+#   Adds up the pixel distances between two rows at a bunch of offsets
+#   at once, by sliding a window over a padded copy of row2.
+#
+#   params
+#       row1, row2      float64 rows, (length, channels), already cut
+#                       down to the channels being compared.  They
+#                       don't have to be the same length.
+#
+#       offsets         Array of offsets.  row1[x] is compared with
+#                       row2[x + offset] wherever both are in range.
+#
+#   returns
+#       A tuple: (sums, counts) arrays, one entry per offset--the total
+#       distance and how many pixels went into it.  The totals are added
+#       up in order, so sums / counts is exactly what
+#       compare_rows_with_type() gets for that offset.
+#
+def get_offset_sums(row1, row2, offsets):
+    width1 = len(row1)
+    width2 = len(row2)
+    pad = int(np.max(np.abs(offsets)))
+
+    # padded[pad + x] is row2[x]
+    padded = np.zeros((max(width1, width2) + 2 * pad, row1.shape[1]))
+    padded[pad:pad + width2] = row2
 
-            if compare_type & SATURATION_MASK:
-                dist += (pixel1[1] - pixel2[1]) ** 2
+    # windows[i, :, x] is row2[x + offsets[i]]
+    windows = np.lib.stride_tricks.sliding_window_view(padded, width1, axis = 0)[offsets + pad]
+    diff = row1.T[np.newaxis] - windows
+    distances = np.sqrt(np.sum(diff * diff, axis = 1))
 
-            if compare_type & LIGHT_MASK:
-                dist += (pixel1[2] - pixel2[2]) ** 2
+    # throw out the pixels that were shifted out of range
+    shifted = np.arange(width1)[np.newaxis] + offsets[:, np.newaxis]
+    in_range = (shifted >= 0) & (shifted < width2)
+    distances[~in_range] = 0.0
 
-            # the actual distance between the two pixel colors
-            dist = math.sqrt(dist)    
+    # Summed in order along each row (adding the zeros doesn't change a
+    # thing) so these match compare_rows_with_type() exactly.
+    counts = np.sum(in_range, axis = 1)
+    sums = np.cumsum(distances, axis = 1)[:, -1]
+    return (sums, counts)
 
-            # increase the distance
-            distance_sum += dist
 
-    else:
-        # RGB        
-        # same technique as HSL
-        for x in range(width):
-            # get the two pixels
-            offset_x = x + offset
-            if offset_x in range(0, width):
-                pixel1 = map1[x, bottom]
-                pixel2 = map2[offset_x, 0]   # here the offset is applied
-            else:
-                skipped_pixels += 1
-                continue
+####################
+#   Compares two rows at every offset in [-max_shift, max_shift] in one
+#   go (instead of calling compare_rows_with_type() over and over).
+#
+#   All the offsets are lined up at once (see get_offset_sums()), so
+#   this costs about the same as a single comparison for small shifts.
+#
+#   params
+#       row1, row2      The rows to compare, (width, channels) arrays.
+#
+#       compare_type    See compare_edges_with_type().
+#
+#       max_shift       The biggest offset (either way) to try.
+#
+#   returns
+#       A tuple: (distances, best_offset)
+#           distances       Array of the average distances.  The distance
+#                           for offset o is at distances[o + max_shift].
+#                           Each is exactly what compare_rows_with_type()
+#                           would return for that offset (inf if the offset
+#                           leaves nothing to compare).
+#           best_offset     The offset with the smallest distance.  Ties go
+#                           to the smaller shift (0, 1, -1, 2, -2, ...).
+#       None if the rows are different widths.
+#
+def compare_rows_with_offsets(row1, row2, compare_type, max_shift):
+    width = len(row1)
+    if width != len(row2):
+        if debug:
+            print(f'compare_rows_with_offsets() Error!  Not same width!')
+        return
 
-            # The distance between the two pixels is the square root of
-            # the differences of the color planes.
-            dist = 0.0
-            if compare_type & RED_MASK:
-                dist += (pixel1[0] - pixel2[0]) ** 2
+    channels = get_compare_channels(compare_type)
+    offsets = np.arange(-max_shift, max_shift + 1)
+    sums, counts = get_offset_sums(row1[..., channels].astype(np.float64),
+                                   row2[..., channels].astype(np.float64),
+                                   offsets)
+    averages = np.full(len(offsets), np.inf)
+    averages[counts > 0] = sums[counts > 0] / counts[counts > 0]
 
-            if compare_type & GREEN_MASK:
-                dist += (pixel1[1] - pixel2[1]) ** 2
+    # smallest distance wins, ties go to the smallest shift
+    best_offset = min(offsets, key = lambda o: (averages[o + max_shift], abs(o), o < 0))
 
-            if compare_type & BLUE_MASK:
-                dist += (pixel1[2] - pixel2[2]) ** 2
+    if debug:
+        print(f'compare_rows_with_offsets() -> best offset = {best_offset}, distance = {averages[best_offset + max_shift]}')
 
-            # the actual distance between the two pixel colors
-            dist = math.sqrt(dist)    
+    return (averages, int(best_offset))
 
-            # increase the distance
-            distance_sum += dist
 
-    # done with images
+####################
+#   Like compare_edges_with_type(), but tries all the offsets from
+#   -max_shift to max_shift using just one read of the two edges.
+#
+#   returns
+#       (distances, best_offset)    See compare_rows_with_offsets().
+#       None on error (not graphics files or different widths).
+#
+def compare_edges_with_offsets(file1, file2, compare_type, max_shift):
+    if debug:
+        print(f'compare_edges_with_offsets( {file1}, {file2}, {compare_type}, {max_shift})')
+
+    try:
+        image1 = Image.open(file1)
+        image2 = Image.open(file2)
+
+    except:
+        if debug:
+            print('One or more files were not image files--aborting!')
+        return
+
+    width = image1.width
+    width2 = image2.width
     image2.close()
     image1.close()
 
-    distance_ave = distance_sum / (width - skipped_pixels)
+    if width != width2:
+        if debug:
+            print(f'compare_edges_with_offsets( {file1}, {file2} ) Error!  Not same width!')
+        return
 
-    # average out the difference
-    if debug:
-        print(f'   -> total distance = {distance_sum}')
-        print(f'   -> width = {width}')
-        print(f'   -> average = {distance_ave}')
+    band1 = load_edge_strip(file1, BOTTOM_EDGE)
+    band2 = load_edge_strip(file2, TOP_EDGE)
+    if (band1 is None) or (band2 is None):
+        return
 
-    return distance_ave
-    
+    return compare_rows_with_offsets(band1[0], band2[0], compare_type, max_shift)
+
+
+####################
+#   The biggest distance one pixel can possibly be from another (every
+#   color plane as far apart as it can go).  Used to prove that the rest
+#   of a seam can't change the outcome.
+#
+#   returns
+#       The distance, or inf if the pixels aren't integers (no way to know).
+#
+def get_max_pixel_distance(row, channels):
+    if not np.issubdtype(row.dtype, np.integer):
+        return math.inf
+
+    info = np.iinfo(row.dtype)
+    return math.sqrt(len(channels)) * (int(info.max) - int(info.min))
+
+
+####################
+#   Compares two rows a chunk at a time, stopping as soon as the answer
+#   is known.  Meant for when all that's needed is a yes or no from
+#   is_difference_within_tolerance().
+#
+#   After each chunk:
+#       - If the distances so far (divided by the whole width) are already
+#         at the tolerance, there's no way the average can come in under
+#         it.  Reject.
+#       - If even the worst possible distances for the rest of the pixels
+#         can't push the average up to the tolerance, it's a match.  Accept.
+#
+#   params
+#       row1, row2, compare_type, offset    See compare_rows_with_type().
+#
+#       tolerance       The average distance to decide on.
+#
+#       chunk_size      How many pixels to do between checks.
+#
+#   returns
+#       (within, distance)
+#           within      True if the average is proven to be under the
+#                       tolerance, False if it's proven not to be, None
+#                       on error (different widths or too big an offset).
+#           distance    The total distance so far divided by the number of
+#                       pixels in the whole seam--a lower bound on the real
+#                       average (and exactly it when every chunk was done).
+#                       None on error.
+#
+def compare_rows_bounded(row1, row2, compare_type, offset = 0, tolerance = TOLERANCE, chunk_size = BOUND_CHUNK_SIZE):
+    width = len(row1)
+    if width != len(row2):
+        if debug:
+            print(f'compare_rows_bounded() Error!  Not same width!')
+        return (None, None)
+
+    start = max(0, -offset)
+    end = min(width, width - offset)
+    if end <= start:
+        if debug:
+            print(f'compare_rows_bounded() Error!  offset {offset} is too big for width {width}')
+        return (None, None)
+
+    channels = get_compare_channels(compare_type)
+    max_distance = max(get_max_pixel_distance(row1, channels), get_max_pixel_distance(row2, channels))
+    count = end - start
+
+    distance_sum = 0.0
+    for chunk_start in range(start, end, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, end)
+        distances = get_pixel_distances(row1[chunk_start:chunk_end],
+                                        row2[chunk_start + offset:chunk_end + offset],
+                                        channels)
+
+        # keep adding in order (same sum compare_rows_with_type() gets)
+        distances = np.concatenate(([distance_sum], distances))
+        distance_sum = float(np.cumsum(distances)[-1])
+
+        if distance_sum / count >= tolerance:
+            if debug:
+                print(f'compare_rows_bounded() reject after {chunk_end - start} of {count} pixels')
+            return (False, distance_sum / count)
+
+        remaining = end - chunk_end
+        if (remaining > 0) and ((distance_sum + remaining * max_distance) / count < tolerance):
+            if debug:
+                print(f'compare_rows_bounded() accept after {chunk_end - start} of {count} pixels')
+            return (True, distance_sum / count)
+
+    return (distance_sum / count < tolerance, distance_sum / count)
+
+
+####################
+#   Returns the columns of a seam in a stratified random order: the seam
+#   is cut into batch_size equal strips and the first batch_size columns
+#   have one from each strip (chosen at random), the next batch_size have
+#   another from each, and so on.  This way every batch is spread across
+#   the whole seam.
+#
+#   params
+#       width       Number of columns.
+#
+#       batch_size  Number of strips.
+#
+#       rng         A NumPy Generator.
+#
+#   returns
+#       Array of all the column numbers [0..width), in sampling order.
+#
+def get_stratified_order(width, batch_size, rng):
+    strips = np.arange(width) * batch_size // width
+    keys = rng.random(width)
+
+    # rank of each column within its strip (by its random key)
+    by_strip = np.lexsort((keys, strips))
+    strip_starts = np.searchsorted(strips[by_strip], strips[by_strip])
+    ranks = np.empty(width, dtype = np.int64)
+    ranks[by_strip] = np.arange(width) - strip_starts
+
+    return np.lexsort((strips, ranks))
+
+
+####################
+#   Like compare_rows_bounded(), but looks at a sample of the columns
+#   instead of going left to right.  Columns are added a batch at a time
+#   (see get_stratified_order()) and after each batch a confidence
+#   interval for the average distance is worked out from the sample:
+#
+#       mean +/- z * sqrt(variance / n * (1 - n / width))
+#
+#   (the last bit because the columns are drawn without replacement).
+#   Once the whole interval is on one side of the tolerance, that's the
+#   answer.  The hard bounds from compare_rows_bounded() are checked too,
+#   so a decision made that way is certain.  If it never becomes clear,
+#   every column ends up being looked at and the answer is exact.
+#
+#   The answer is a statistical one--with the default z it's very
+#   unlikely to differ from the full scan, but it could, so use
+#   compare_rows_bounded() where that matters.
+#
+#   params
+#       row1, row2, compare_type, offset    See compare_rows_with_type().
+#
+#       tolerance       The average distance to decide on.
+#
+#       z               How many standard errors wide the interval is.
+#
+#       rng             A NumPy Generator to pick the columns with.  Made
+#                       from SAMPLE_SEED if not given, so that the same
+#                       rows always give the same answer.
+#
+#   returns
+#       (within, distance, examined)
+#           within      True/False (is the average under the tolerance),
+#                       None on error (different widths or too big an offset).
+#           distance    The sample's average distance (exact when every
+#                       column was examined).  None on error.
+#           examined    How many columns were looked at.
+#
+def compare_rows_sampled(row1, row2, compare_type, offset = 0, tolerance = TOLERANCE,
+                         z = SAMPLE_Z, rng = None):
+    width = len(row1)
+    if width != len(row2):
+        if debug:
+            print(f'compare_rows_sampled() Error!  Not same width!')
+        return (None, None, 0)
+
+    start = max(0, -offset)
+    end = min(width, width - offset)
+    if end <= start:
+        if debug:
+            print(f'compare_rows_sampled() Error!  offset {offset} is too big for width {width}')
+        return (None, None, 0)
+
+    if rng == None:
+        rng = np.random.default_rng(SAMPLE_SEED)
+
+    channels = get_compare_channels(compare_type)
+    max_distance = max(get_max_pixel_distance(row1, channels), get_max_pixel_distance(row2, channels))
+    count = end - start
+    order = get_stratified_order(count, min(SAMPLE_BATCH_SIZE, count), rng) + start
+
+    distance_sum = 0.0
+    square_sum = 0.0
+    examined = 0
+    while examined < count:
+        columns = order[examined:examined + SAMPLE_BATCH_SIZE]
+        distances = get_pixel_distances(row1[columns], row2[columns + offset], channels)
+        distance_sum += float(np.sum(distances))
+        square_sum += float(np.sum(distances * distances))
+        examined += len(columns)
+        if examined == count:
+            break
+
+        # certain answers first (same as compare_rows_bounded())
+        if distance_sum / count >= tolerance:
+            return (False, distance_sum / examined, examined)
+        if (distance_sum + (count - examined) * max_distance) / count < tolerance:
+            return (True, distance_sum / examined, examined)
+
+        if examined < SAMPLE_MIN_COLUMNS:
+            continue
+
+        mean = distance_sum / examined
+        variance = max(0.0, (square_sum - examined * mean * mean) / (examined - 1))
+        margin = z * math.sqrt(variance / examined * (1.0 - examined / count))
+        if mean + margin < tolerance:
+            within = True
+        elif mean - margin >= tolerance:
+            within = False
+        else:
+            continue
+
+        if debug:
+            print(f'compare_rows_sampled() decided after {examined} of {count} columns: mean = {mean} +/- {margin}')
+        return (within, mean, examined)
+
+    # looked at everything, so get the exact average
+    distance_ave = compare_rows_with_type(row1, row2, compare_type, offset)
+    return (distance_ave < tolerance, distance_ave, examined)
+
+
+####################
+#   Tries the offsets one at a time (0, 1, -1, 2, -2, ... up to max_shift)
+#   with compare_rows_bounded() and stops at the first one that's proven
+#   to match.  Gives the same yes or no as checking the best offset from
+#   compare_rows_with_offsets(), but pairs that don't match are usually
+#   thrown out after a chunk or so at each offset.
+#
+#   params
+#       sample      When True, use compare_rows_sampled() instead (faster
+#                   on wide seams, but the answer is a statistical one).
+#
+#   returns
+#       (within, distance, offset)
+#           within      True if some offset matches, False if none do, None
+#                       on error (different widths).
+#           distance    The (partial) distance for that offset (see
+#                       compare_rows_bounded()).  When nothing matches it's
+#                       the biggest lower bound found, from the offset with
+#                       the smallest one.
+#           offset      The offset that matched (or came closest).
+#
+def find_matching_offset(row1, row2, compare_type, max_shift = 0, tolerance = TOLERANCE, sample = False):
+    if len(row1) != len(row2):
+        if debug:
+            print(f'find_matching_offset() Error!  Not same width!')
+        return (None, None, None)
+
+    closest = None
+    for shift in range(max_shift + 1):
+        for offset in ((0,) if shift == 0 else (shift, -shift)):
+            if sample:
+                within, distance, examined = compare_rows_sampled(row1, row2, compare_type, offset, tolerance)
+            else:
+                within, distance = compare_rows_bounded(row1, row2, compare_type, offset, tolerance)
+            if within == None:
+                continue
+            if within:
+                return (True, distance, offset)
+            if (closest == None) or (distance < closest[0]):
+                closest = (distance, offset)
+
+    if closest == None:
+        return (None, None, None)
+
+    return (False, closest[0], closest[1])
+
+
+####################
+#   Like compare_edges_with_type(), but only answers whether the edges
+#   match (see compare_rows_bounded()).  Tries every offset up to
+#   max_shift, stopping at the first match.
+#
+#   returns
+#       (within, distance, offset)      See find_matching_offset().
+#
+def compare_edges_bounded(file1, file2, compare_type, max_shift = 0, tolerance = TOLERANCE):
+    if debug:
+        print(f'compare_edges_bounded( {file1}, {file2}, {compare_type}, {max_shift})')
+
+    try:
+        image1 = Image.open(file1)
+        image2 = Image.open(file2)
+
+    except:
+        if debug:
+            print('One or more files were not image files--aborting!')
+        return (None, None, None)
+
+    width = image1.width
+    width2 = image2.width
+    image2.close()
+    image1.close()
+
+    if width != width2:
+        if debug:
+            print(f'compare_edges_bounded( {file1}, {file2} ) Error!  Not same width!')
+        return (None, None, None)
+
+    band1 = load_edge_strip(file1, BOTTOM_EDGE)
+    band2 = load_edge_strip(file2, TOP_EDGE)
+    if (band1 is None) or (band2 is None):
+        return (None, None, None)
+
+    return find_matching_offset(band1[0], band2[0], compare_type, max_shift, tolerance)
+
+
+####################
+#   Loads the right edge of file1 and the left edge of file2 for the
+#   column comparisons below.  The bands are turned on their sides so
+#   that they look like rows: the right edge becomes a bottom edge and
+#   the left edge becomes a top edge.  That way all the row functions
+#   work on columns too.
+#
+#   params
+#       depth       How many columns thick the bands should be.
+#
+#   returns
+#       (band1, band2)  Arrays (depth, height, channels).
+#       None on error (not graphics files or different heights).
+#
+def load_column_edges(file1, file2, depth = 1):
+    try:
+        image1 = Image.open(file1)
+        image2 = Image.open(file2)
+
+    except:
+        if debug:
+            print('One or more files were not image files--aborting!')
+        return
+
+    # side by side pieces need the same heights
+    height = image1.height
+    height2 = image2.height
+    image2.close()
+    image1.close()
+
+    if height != height2:
+        if debug:
+            print(f'load_column_edges( {file1}, {file2} ) Error!  Not same height!')
+        return
+
+    band1 = load_edge_strip(file1, RIGHT_EDGE, depth)
+    band2 = load_edge_strip(file2, LEFT_EDGE, depth)
+    if (band1 is None) or (band2 is None):
+        return
+
+    return (band1.transpose(1, 0, 2), band2.transpose(1, 0, 2))
+
+
+####################
+#   Like compare_edges_with_type(), but for pieces that go side by side:
+#   compares the right column of file1 with the left column of file2.
+#
+#   params
+#       offset      Shift this many pixels.  Positive is shift up,
+#                   negative is shift down.
+#
+#   returns
+#       0 = perfect match
+#       otherwise the bigger the worse the match
+#       None means error (either not a graphics file or different heights)
+#
+def compare_columns_with_type(file1, file2, compare_type, offset = 0):
+    if debug:
+        print(f'compare_columns_with_type( {file1}, {file2}, {compare_type}, {offset})')
+
+    bands = load_column_edges(file1, file2)
+    if bands == None:
+        return
+
+    band1, band2 = bands
+    return compare_rows_with_type(band1[-1], band2[0], compare_type, offset)
+
+
+####################
+#   Like compare_edges_with_offsets(), but for the right column of file1
+#   and the left column of file2.
+#
+#   returns
+#       (distances, best_offset)    See compare_rows_with_offsets().
+#       None on error (not graphics files or different heights).
+#
+def compare_columns_with_offsets(file1, file2, compare_type, max_shift):
+    if debug:
+        print(f'compare_columns_with_offsets( {file1}, {file2}, {compare_type}, {max_shift})')
+
+    bands = load_column_edges(file1, file2)
+    if bands == None:
+        return
+
+    band1, band2 = bands
+    return compare_rows_with_offsets(band1[-1], band2[0], compare_type, max_shift)
+
+
+####################
+#   Like compare_edges_using_blocks(), but for the right side of file1
+#   and the left side of file2.  Each pixel down the seam defines a block
+#   (the top right pixel for file1, the top left pixel for file2).
+#
+#   returns
+#       0 = perfect match
+#       otherwise the bigger the worse the match
+#       None means error (not graphics files, different heights, or images
+#       narrower than a block)
+#
+def compare_columns_using_blocks(file1, file2, block_size, compare_type = HUE_MASK):
+    if debug:
+        print(f'compare_columns_using_blocks( {file1}, {file2}, {block_size} )')
+
+    bands = load_column_edges(file1, file2, block_size)
+    if bands == None:
+        return
+
+    band1, band2 = bands
+    return compare_bands_using_blocks(band1, band2, block_size, compare_type)
+
+
+####################
+#   Sorts a bunch of edges into stacks that can be handed to
+#   compare_row_to_many().  Edges can only be stacked with others of the
+#   same width (and the same number of color planes).
+#
+#   params
+#       edges       List of edges, (width, channels) arrays.  None entries
+#                   (pieces that aren't images) are skipped.
+#
+#   returns
+#       Dictionary: (width, channels) -> (indices, stack)
+#           indices     Array of where each stacked edge was in the list.
+#           stack       Array (len(indices), width, channels).
+#
+def stack_edges_by_width(edges):
+    groups = {}
+    for i in range(len(edges)):
+        if edges[i] is None:
+            continue
+        groups.setdefault(edges[i].shape, []).append(i)
+
+    stacks = {}
+    for shape in groups:
+        indices = np.array(groups[shape], dtype = np.int64)
+        stacks[shape] = (indices, np.stack([edges[i] for i in indices]))
+
+    return stacks
+
+
+####################
+#   Compares one edge against a whole stack of them at once, trying every
+#   offset in [-max_shift, max_shift] for each.  It's the same as calling
+#   compare_rows_with_offsets() on each of the stacked edges, but in one
+#   go.
+#
+#   params
+#       row             The bottom row of the top image, (width, channels).
+#
+#       rows            The top rows of all the candidates, (N, width,
+#                       channels).  See stack_edges_by_width().
+#
+#       compare_type    See compare_edges_with_type().
+#
+#       max_shift       The biggest offset (either way) to try.
+#
+#   returns
+#       (distances, best_offsets)
+#           distances       Array (N) of the average distance of each
+#                           candidate at its best offset.  Exactly what
+#                           compare_rows_with_offsets() gets.
+#           best_offsets    Array (N) of those offsets (ties go to the
+#                           smaller shift, same as compare_rows_with_offsets()).
+#       None if the widths don't match.
+#
+def compare_row_to_many(row, rows, compare_type, max_shift = 0):
+    width = len(row)
+    if (rows.ndim != 3) or (rows.shape[1] != width):
+        if debug:
+            print(f'compare_row_to_many() Error!  Not same width!')
+        return
+
+    channels = get_compare_channels(compare_type)
+    row = row[..., channels].astype(np.float64)
+
+    # which pixels are still in range for each offset
+    offsets = np.arange(-max_shift, max_shift + 1)
+    shifted = np.arange(width)[np.newaxis] + offsets[:, np.newaxis]
+    in_range = (shifted >= 0) & (shifted < width)
+    counts = np.sum(in_range, axis = 1)
+
+    # the order offsets are preferred in when there's a tie: 0, 1, -1, 2, -2...
+    preferred = np.array(sorted(range(len(offsets)), key = lambda k: (abs(offsets[k]), offsets[k] < 0)))
+
+    distances = np.empty(len(rows))
+    best_offsets = np.empty(len(rows), dtype = np.int64)
+
+    # a chunk of candidates at a time, so the windows don't take up too much memory
+    chunk_size = max(1, MANY_CHUNK_PIXELS // (len(offsets) * max(1, width)))
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size, :, channels].astype(np.float64)
+
+        # padded[n, o + max_shift + x] is chunk[n, x + o]
+        padded = np.zeros((len(chunk), width + 2 * max_shift, len(channels)))
+        padded[:, max_shift:max_shift + width] = chunk
+
+        # windows[n, k, :, x] is candidate n's window for offset k - max_shift
+        windows = np.lib.stride_tricks.sliding_window_view(padded, width, axis = 1)
+        diff = row.T[np.newaxis, np.newaxis] - windows
+        pixel_distances = np.sqrt(np.sum(diff * diff, axis = 2))
+        pixel_distances[:, ~in_range] = 0.0
+
+        # summed in order, same as compare_rows_with_offsets()
+        sums = np.cumsum(pixel_distances, axis = 2)[:, :, -1]
+        averages = np.full(sums.shape, np.inf)
+        averages[:, counts > 0] = sums[:, counts > 0] / counts[counts > 0]
+
+        best = preferred[np.argmin(averages[:, preferred], axis = 1)]
+        distances[start:start + len(chunk)] = averages[np.arange(len(chunk)), best]
+        best_offsets[start:start + len(chunk)] = offsets[best]
+
+    return (distances, best_offsets)
+
+
+####################
+#   Turns the rows of an image array into flat float64 vectors (just the
+#   color planes that compare_type asks for).
+#
+#   returns
+#       Array (rows, width * len(channels)).
+#
+def get_row_vectors(pixels, compare_type):
+    channels = get_compare_channels(compare_type)
+    rows = pixels[..., channels].astype(np.float64)
+    return rows.reshape(len(rows), -1)
+
+
+####################
+#   Works out the distance between every row of one image and every row
+#   of another, a chunk at a time (so memory stays bounded no matter how
+#   tall the images are).
+#
+#   Row distances come from matrix products:
+#
+#       |a - b|^2 = |a|^2 + |b|^2 - 2 a.b
+#
+#   which means the distance used here is the mean SQUARED distance between
+#   the pixels of the two rows.  Take the square root to get the RMS pixel
+#   distance, which is never smaller than the average pixel distance that
+#   compare_rows_with_type() returns (so it's good for screening).
+#
+#   params
+#       pixels1, pixels2    Image arrays (rows, width, channels).  Same width.
+#
+#       compare_type        Which color planes to use.
+#
+#       chunk_size          The most rows of each image to work on at once.
+#
+#   yields
+#       (start1, start2, block) where block[i, j] is the mean squared pixel
+#       distance between row start1 + i of pixels1 and row start2 + j of
+#       pixels2.
+#
+def find_row_distance_blocks(pixels1, pixels2, compare_type, chunk_size = ROW_CHUNK_SIZE):
+    width = pixels1.shape[1]
+
+    for start1 in range(0, len(pixels1), chunk_size):
+        vectors1 = get_row_vectors(pixels1[start1:start1 + chunk_size], compare_type)
+        norms1 = np.sum(vectors1 * vectors1, axis = 1)
+
+        for start2 in range(0, len(pixels2), chunk_size):
+            vectors2 = get_row_vectors(pixels2[start2:start2 + chunk_size], compare_type)
+            norms2 = np.sum(vectors2 * vectors2, axis = 1)
+
+            block = norms1[:, np.newaxis] + norms2[np.newaxis, :] - 2.0 * (vectors1 @ vectors2.T)
+
+            # rounding can make perfect matches a hair below zero
+            np.maximum(block, 0.0, out = block)
+            yield (start1, start2, block / width)
+
+
+####################
+#   Finds the pairs of rows (one from each image) that match best, using
+#   the row distance matrix from find_row_distance_blocks().  Only the best
+#   num_pairs are ever kept, so memory use is bounded.
+#
+#   returns
+#       List of (rms_distance, row1, row2) tuples, best first.
+#       None if the images are different widths.
+#
+def find_best_row_pairs(pixels1, pixels2, compare_type, num_pairs = 1, chunk_size = ROW_CHUNK_SIZE):
+    if pixels1.shape[1] != pixels2.shape[1]:
+        if debug:
+            print('find_best_row_pairs() Error!  Not same width!')
+        return
+
+    best_distances = np.empty(0)
+    best_rows1 = np.empty(0, dtype = np.int64)
+    best_rows2 = np.empty(0, dtype = np.int64)
+
+    for start1, start2, block in find_row_distance_blocks(pixels1, pixels2, compare_type, chunk_size):
+        flat = block.ravel()
+        if len(flat) > num_pairs:
+            keep = np.argpartition(flat, num_pairs)[:num_pairs]
+        else:
+            keep = np.arange(len(flat))
+
+        rows1, rows2 = np.unravel_index(keep, block.shape)
+        best_distances = np.concatenate((best_distances, flat[keep]))
+        best_rows1 = np.concatenate((best_rows1, rows1 + start1))
+        best_rows2 = np.concatenate((best_rows2, rows2 + start2))
+
+        # only hang on to the best num_pairs so far
+        order = np.argsort(best_distances, kind = 'stable')[:num_pairs]
+        best_distances = best_distances[order]
+        best_rows1 = best_rows1[order]
+        best_rows2 = best_rows2[order]
+
+    pairs = []
+    for i in range(len(best_distances)):
+        pairs.append((math.sqrt(best_distances[i]), int(best_rows1[i]), int(best_rows2[i])))
+
+    if debug:
+        print(f'find_best_row_pairs() -> {pairs}')
+
+    return pairs
+
+
+####################
+#   Works out what find_row_distance_bounds() needs to know about each
+#   row of an image.
+#
+#   returns
+#       Dictionary:
+#           'segment_means'     Array (rows, segments, len(channels)), the
+#                               mean color of each piece of each row (see
+#                               ROW_BOUND_SEGMENTS).
+#           'segment_sizes'     Array (segments), pixels in each piece.
+#           'means'             Array (rows, len(channels)), mean colors.
+#           'spreads'           Array (rows), how far each row's farthest
+#                               pixel is from its mean color.
+#           'mean_squares'      Array (rows), |row|^2 / width (how big
+#                               rounding errors in the matrix can get).
+#
+def get_row_summaries(pixels, compare_type):
+    channels = get_compare_channels(compare_type)
+    rows = pixels[..., channels].astype(np.float64)
+    width = rows.shape[1]
+
+    bounds = np.linspace(0, width, min(width, ROW_BOUND_SEGMENTS) + 1).astype(np.int64)
+    segment_sizes = np.diff(bounds)
+    means = np.mean(rows, axis = 1)
+
+    return {
+        'segment_means': np.add.reduceat(rows, bounds[:-1], axis = 1) / segment_sizes[np.newaxis, :, np.newaxis],
+        'segment_sizes': segment_sizes,
+        'means': means,
+        'spreads': np.sqrt(np.max(np.sum((rows - means[:, np.newaxis]) ** 2, axis = 2), axis = 1)),
+        'mean_squares': np.sum(rows * rows, axis = (1, 2)) / width,
+    }
+
+
+####################
+#   Finds the smallest average distance each of a block of row pairs
+#   could have (see find_closest_row_pairs()).
+#
+#   params
+#       summaries1, summaries2  From get_row_summaries().
+#
+#       start1, start2, block   From find_row_distance_blocks().
+#
+#       max_distance    The biggest a pixel distance can be, if that's
+#                       known (see get_max_pixel_distance()).
+#
+#       use_segments    Also use find_segment_bounds().  It's the tighter
+#                       of the two, but takes a lot longer over a whole
+#                       block--it can be left for the pairs that get past
+#                       this one.
+#
+#   returns
+#       Array like block.
+#
+def find_row_distance_bounds(summaries1, summaries2, start1, start2, block, max_distance = math.inf,
+                             use_segments = True):
+    rows1 = slice(start1, start1 + block.shape[0])
+    rows2 = slice(start2, start2 + block.shape[1])
+
+    segment_bound = 0.0
+    if use_segments:
+        segment_bound = find_segment_bounds(summaries1['segment_means'][rows1, np.newaxis],
+                                            summaries2['segment_means'][np.newaxis, rows2],
+                                            summaries1['segment_sizes'])
+
+    # The mean of the squares is at most the average distance times the
+    # biggest distance, which can't be more than the two spreads plus the
+    # distance between the row means (or max_distance).  (The squares come
+    # from the matrix, so they're made a hair smaller than rounding could
+    # have made them.)
+    diff = summaries1['means'][rows1, np.newaxis] - summaries2['means'][np.newaxis, rows2]
+    biggest = summaries1['spreads'][rows1, np.newaxis] + summaries2['spreads'][np.newaxis, rows2] \
+              + np.sqrt(np.sum(diff * diff, axis = 2))
+    np.minimum(biggest, max_distance, out = biggest)
+    squares = block - ROW_BOUND_ROUNDING * (summaries1['mean_squares'][rows1, np.newaxis]
+                                            + summaries2['mean_squares'][np.newaxis, rows2])
+    square_bound = np.divide(np.maximum(squares, 0.0), biggest, out = np.zeros(block.shape), where = biggest > 0)
+
+    return np.maximum(segment_bound, square_bound) * (1.0 - ROW_BOUND_ROUNDING)
+
+
+####################
+#   The average of the distances is at least the distance between the
+#   averages, segment by segment (the triangle inequality).
+#
+#   params
+#       segment_means1, segment_means2  'segment_means' from
+#                       get_row_summaries(), for the rows to pair up
+#                       (anything that broadcasts together).
+#
+#       segment_sizes   'segment_sizes' from get_row_summaries().
+#
+#   returns
+#       Array of the bounds, shaped like the pairs (not made any smaller
+#       for rounding).
+#
+def find_segment_bounds(segment_means1, segment_means2, segment_sizes):
+    bound = 0.0
+    for k in range(len(segment_sizes)):
+        diff = segment_means1[..., k, :] - segment_means2[..., k, :]
+        bound = bound + segment_sizes[k] * np.sqrt(np.sum(diff * diff, axis = -1))
+
+    return bound / np.sum(segment_sizes)
+
+
+####################
+#   Finds the pairs of rows (one from each image) with the smallest
+#   average pixel distance--the one compare_rows_with_type() returns.
+#   That's not always the same order as the RMS distance the matrix gives
+#   (find_best_row_pairs()), so the matrix is only used to rule out pairs
+#   that can't be among the best:
+#
+#       The best num_pairs by RMS distance are compared for real, and
+#       the worst of those is the cutoff (it gets smaller as better pairs
+#       turn up).  The winners can't be any worse.
+#
+#       Every pair gets a lower bound on its average distance (see
+#       find_row_distance_bounds()).  Only the pairs whose bound isn't
+#       past the cutoff are compared for real (compare_row_to_many()).
+#
+#   So the answer is the same as comparing every pair, just faster.
+#
+#   returns
+#       List of (distance, row1, row2) tuples, best first.  Ties go to the
+#       smaller row1, then the smaller row2 (the order a loop over all the
+#       pairs would find them in).
+#       None if the images are different widths.
+#
+def find_closest_row_pairs(pixels1, pixels2, compare_type, num_pairs = 1, chunk_size = ROW_CHUNK_SIZE):
+    screened = find_best_row_pairs(pixels1, pixels2, compare_type, num_pairs, chunk_size)
+    if screened == None:
+        return
+
+    cutoff = -np.inf
+    for rms_distance, row1, row2 in screened:
+        cutoff = max(cutoff, compare_rows_with_type(pixels1[row1], pixels2[row2], compare_type))
+
+    summaries1 = get_row_summaries(pixels1, compare_type)
+    summaries2 = get_row_summaries(pixels2, compare_type)
+
+    pairs = []
+    num_compared = 0
+    for start1, start2, block in find_row_distance_blocks(pixels1, pixels2, compare_type, chunk_size):
+        bounds = find_row_distance_bounds(summaries1, summaries2, start1, start2, block)
+
+        for i in np.nonzero(np.any(bounds <= cutoff, axis = 1))[0]:
+            rows2 = np.nonzero(bounds[i] <= cutoff)[0]
+            distances = compare_row_to_many(pixels1[start1 + i], pixels2[start2 + rows2], compare_type)[0]
+            num_compared += len(rows2)
+            for j in range(len(rows2)):
+                pairs.append((float(distances[j]), start1 + int(i), start2 + int(rows2[j])))
+
+            # once there are plenty, only the best are worth keeping
+            if len(pairs) >= 2 * num_pairs + chunk_size:
+                pairs.sort()
+                del pairs[num_pairs:]
+                cutoff = min(cutoff, pairs[-1][0])
+
+    pairs.sort()
+    del pairs[num_pairs:]
+
+    if debug:
+        print(f'find_closest_row_pairs() compared {num_compared} of {len(pixels1) * len(pixels2)} pairs -> {pairs}')
+
+    return pairs
+
+
+####################
+#   Scores every possible vertical overlap between two images: how well
+#   do the bottom L rows of the top image match the top L rows of the
+#   bottom image?
+#
+#   For an overlap of L rows the score is the mean squared pixel distance
+#   over the L overlapping rows.  That's a sum along one diagonal of the
+#   row distance matrix, and with |a - b|^2 = |a|^2 + |b|^2 - 2 a.b it
+#   splits into:
+#
+#       the |a|^2 and |b|^2 parts       cumulative sums of the row norms
+#       the a.b parts                   a correlation along the rows, done
+#                                       for every L at once with an FFT
+#
+#   So all the overlaps together cost about as much as reading the bands
+#   (O(H W log H)) instead of comparing every row to every other row.
+#
+#   params
+#       pixels1         Image array (rows, width, channels) of the top image
+#                       (only its bottom max_overlap rows matter).
+#
+#       pixels2         Image array of the bottom image (only its top
+#                       max_overlap rows matter).  Same width as pixels1.
+#
+#       compare_type    Which color planes to use.
+#
+#       max_overlap     The biggest overlap to consider.  None means as
+#                       much as the shorter image.
+#
+#   returns
+#       Array of scores, indexed by the overlap in rows.  Entry 0 is inf
+#       (no overlap isn't an overlap).  Take the square root of a score
+#       for the RMS pixel distance.
+#       None if the images are different widths.
+#
+def find_overlap_distances(pixels1, pixels2, compare_type, max_overlap = None):
+    if pixels1.shape[1] != pixels2.shape[1]:
+        if debug:
+            print('find_overlap_distances() Error!  Not same width!')
+        return
+
+    most_rows = min(len(pixels1), len(pixels2))
+    if max_overlap != None:
+        most_rows = min(most_rows, max_overlap)
+
+    width = pixels1.shape[1]
+    top = get_row_vectors(pixels1[len(pixels1) - most_rows:], compare_type)
+    bottom = get_row_vectors(pixels2[:most_rows], compare_type)
+
+    # For overlap L the top image's rows are [most_rows - L, most_rows)
+    # and the bottom image's rows are [0, L).
+    top_norms = np.sum(top * top, axis = 1)
+    bottom_norms = np.sum(bottom * bottom, axis = 1)
+    top_sums = np.concatenate(([0.0], np.cumsum(top_norms[::-1])))
+    bottom_sums = np.concatenate(([0.0], np.cumsum(bottom_norms)))
+
+    # cross[k] = sum over i of top[i + k] . bottom[i], a chunk of
+    # columns at a time to keep the FFTs from getting huge
+    fft_size = 2 * most_rows
+    spectrum = np.zeros(fft_size // 2 + 1, dtype = np.complex128)
+    for start in range(0, top.shape[1], OVERLAP_CHUNK_SIZE):
+        top_fft = np.fft.rfft(top[:, start:start + OVERLAP_CHUNK_SIZE], n = fft_size, axis = 0)
+        bottom_fft = np.fft.rfft(bottom[:, start:start + OVERLAP_CHUNK_SIZE], n = fft_size, axis = 0)
+        spectrum += np.sum(top_fft * np.conj(bottom_fft), axis = 1)
+    cross = np.fft.irfft(spectrum, n = fft_size)[:most_rows]
+
+    overlaps = np.arange(1, most_rows + 1)
+    scores = np.full(most_rows + 1, np.inf)
+    scores[1:] = top_sums[1:] + bottom_sums[1:] - 2.0 * cross[most_rows - overlaps]
+    scores[1:] = np.maximum(scores[1:], 0.0) / (overlaps * width)
+
+    return scores
+
+
+####################
+#   Finds the overlap (in rows) where the bottom of the top image best
+#   matches the top of the bottom image.
+#
+#   params
+#       See find_overlap_distances().
+#
+#       min_overlap     The smallest overlap to consider.  Tiny overlaps
+#                       can match by pure luck (especially on plain
+#                       backgrounds).
+#
+#   returns
+#       (overlap, rms_distance)
+#       None on error (different widths, or the images are shorter
+#       than min_overlap).
+#
+def find_best_overlap(pixels1, pixels2, compare_type, max_overlap = None, min_overlap = MIN_OVERLAP):
+    scores = find_overlap_distances(pixels1, pixels2, compare_type, max_overlap)
+    if (scores is None) or (len(scores) <= min_overlap):
+        return
+
+    overlap = min_overlap + int(np.argmin(scores[min_overlap:]))
+    rms_distance = math.sqrt(scores[overlap])
+
+    if debug:
+        print(f'find_best_overlap() -> overlap = {overlap}, rms distance = {rms_distance}')
+
+    return (overlap, rms_distance)
+
+
+####################
+#   Squashes the color planes that compare_type asks for into one plane
+#   (their average), as float64.
+#
+def get_intensity(pixels, compare_type):
+    channels = get_compare_channels(compare_type)
+    if len(channels) == 0:
+        return np.zeros(pixels.shape[:2])
+    return np.mean(pixels[..., channels].astype(np.float64), axis = -1)
+
+
+####################
+#   Fits a parabola through a peak and its two neighbors and returns how
+#   far (between -0.5 and 0.5) the real top of the peak is from the middle
+#   one.
+#
+def find_subpixel_peak(left, middle, right):
+    denominator = left - 2.0 * middle + right
+    if denominator == 0.0:
+        return 0.0
+    return max(-0.5, min(0.5, 0.5 * (left - right) / denominator))
+
+
+####################
+#   Finds how far the second image is moved (translated) from the first
+#   using phase correlation.  Only the phases of the two Fourier transforms
+#   are compared, so differences in brightness or contrast don't matter
+#   much, and the whole thing is O(N log N).
+#
+#   The arrays can be different sizes (they're padded out to the same
+#   size, lined up at their top left corners).  They're also padded to
+#   double size so that shifts don't wrap around.
+#
+#   params
+#       pixels1, pixels2    Image arrays (rows, width, channels).
+#
+#       compare_type        Which color planes to use.
+#
+#       subpixel            When True, the shift is refined to a fraction
+#                           of a pixel.  Otherwise it's whole pixels.
+#
+#   returns
+#       (dx, dy, peak) where the content at (x, y) in pixels1 shows up at
+#       (x + dx, y + dy) in pixels2.  peak is the height of the correlation
+#       peak, from 0 (no idea) to 1 (perfect).
+#
+def find_translation(pixels1, pixels2, compare_type, subpixel = False):
+    intensity1 = get_intensity(pixels1, compare_type)
+    intensity2 = get_intensity(pixels2, compare_type)
+
+    height = 2 * max(intensity1.shape[0], intensity2.shape[0])
+    width = 2 * max(intensity1.shape[1], intensity2.shape[1])
+
+    # remove the averages so that the padding doesn't make an edge
+    fft1 = np.fft.rfft2(intensity1 - np.mean(intensity1), s = (height, width))
+    fft2 = np.fft.rfft2(intensity2 - np.mean(intensity2), s = (height, width))
+
+    cross_power = fft2 * np.conj(fft1)
+    cross_power /= np.maximum(np.abs(cross_power), 1e-12)
+    surface = np.fft.irfft2(cross_power, s = (height, width))
+
+    peak_y, peak_x = np.unravel_index(np.argmax(surface), surface.shape)
+    peak = float(surface[peak_y, peak_x])
+
+    dy = float(peak_y)
+    dx = float(peak_x)
+    if subpixel:
+        dy += find_subpixel_peak(surface[peak_y - 1, peak_x], peak, surface[(peak_y + 1) % height, peak_x])
+        dx += find_subpixel_peak(surface[peak_y, peak_x - 1], peak, surface[peak_y, (peak_x + 1) % width])
+
+    # past halfway round means it was a negative shift
+    if dy >= height / 2:
+        dy -= height
+    if dx >= width / 2:
+        dx -= width
+
+    if debug:
+        print(f'find_translation() -> dx = {dx}, dy = {dy}, peak = {peak}')
+
+    return (dx, dy, peak)
+
+
+####################
+#   Lines up two vertically overlapping pieces that may also be shifted
+#   sideways, and returns the result the way joiner.py wants it.
+#
+#   params
+#       pixels1         Bottom band of the top piece (rows, width, channels).
+#
+#       pixels2         Top band of the bottom piece.  Should be the same
+#                       number of rows as pixels1 (but can be a different
+#                       width).
+#
+#       compare_type    Which color planes to use.
+#
+#       subpixel        See find_translation().
+#
+#   returns
+#       (overlap, offset, peak)
+#           overlap     Number of rows the pieces overlap (joiner.py -ov).
+#                       Never more than either band has.
+#           offset      How far to move the bottom piece right (joiner.py
+#                       -off).  This takes into account that joiner.py
+#                       centers pieces of different widths.
+#           peak        How sure we are, 0 to 1 (see find_translation()).
+#       None if the pieces don't seem to overlap at all.
+#
+def find_overlap_alignment(pixels1, pixels2, compare_type, subpixel = False):
+    dx, dy, peak = find_translation(pixels1, pixels2, compare_type, subpixel)
+
+    # row len(pixels1) + dy of the top band is where the bottom piece starts
+    overlap = len(pixels1) + dy
+    if overlap <= 0:
+        if debug:
+            print(f'find_overlap_alignment() pieces do not overlap (overlap = {overlap})')
+        return
+
+    # The pieces can't overlap by more rows than either one has (a short
+    # bottom piece can end up entirely inside the top band).
+    most_rows = min(len(pixels1), len(pixels2))
+    if overlap > most_rows:
+        if debug:
+            print(f'find_overlap_alignment() overlap {overlap} is more than {most_rows} rows, using {most_rows}')
+        overlap = most_rows
+
+    # joiner.py centers each piece in the widest one.  The bottom piece
+    # needs to end up dx to the left of the top one.
+    widest = max(pixels1.shape[1], pixels2.shape[1])
+    adjustment1 = int((widest - pixels1.shape[1]) / 2)
+    adjustment2 = int((widest - pixels2.shape[1]) / 2)
+    offset = adjustment1 - adjustment2 - dx
+
+    return (float(overlap), float(offset), peak)
+
+
+####################
+#   Shrinks a row by averaging it in blocks of scale pixels, starting
+#   phase pixels in (so block j is row[phase + scale * j] up to, but not
+#   including, row[phase + scale * (j + 1)]).  Pixels left over at either
+#   end that don't make a whole block are dropped.
+#
+#   returns
+#       float64 array (blocks, channels).
+#
+def get_block_row(row, scale, phase = 0):
+    blocks = (len(row) - phase) // scale
+    block_row = row[phase:phase + blocks * scale].astype(np.float64)
+    return block_row.reshape(blocks, scale, -1).mean(axis = 1)
+
+
+####################
+#   The tolerance to use at a level of the pyramid.  Averaging smooths
+#   out the differences, so a coarse distance is usually lower than the
+#   real one--but blending rows from either side of a seam (JPEG draft
+#   decoding does this) can push it up a bit.  So the coarser levels get
+#   a little slack over TOLERANCE.  Only for the draft decode in
+#   compare_edges_pyramid(); compare_rows_pyramid() doesn't need it.
+#
+def get_pyramid_tolerance(level):
+    return TOLERANCE * (1.0 + PYRAMID_SLACK * level)
+
+
+####################
+#   Works out, on rows shrunk by scale, a lower bound on what
+#   compare_rows_with_type() would return for each of the offsets.
+#
+#   Row1 is cut into blocks starting at its first pixel.  Row2 is cut
+#   into blocks starting at each offset's phase (offset mod scale), so
+#   that every block of row1 lands exactly on a block of row2 (the
+#   pixels in them are the ones the offset pairs up).  The distance
+#   between two blocks' averages is never more than the average distance
+#   between their pixels, so scale times the block distances can only
+#   add up to less than the real total.  Dividing that by the number of
+#   pixels the offset compares at full size gives a bound on the real
+#   average.
+#
+#   params
+#       row1, row2      float64 rows, (width, channels), already cut down
+#                       to the channels being compared.
+#
+#       offsets         Array of offsets, all less than width (either way).
+#
+#   returns
+#       Array of bounds, one per offset.  0 where the rows are too
+#       narrow at this scale to tell anything.
+#
+def get_offset_bounds(row1, row2, scale, offsets):
+    bounds = np.zeros(len(offsets))
+    blocks1 = get_block_row(row1, scale)
+    counts = len(row2) - np.abs(offsets)
+
+    # all the offsets with the same phase use the same blocks of row2
+    phases = offsets % scale
+    for phase in np.unique(phases):
+        same = (phases == phase)
+        blocks2 = get_block_row(row2, scale, int(phase))
+        if (len(blocks1) == 0) or (len(blocks2) == 0):
+            continue
+
+        # block j of row1 lines up with block j + block_offset of row2
+        block_sums, _ = get_offset_sums(blocks1, blocks2, (offsets[same] - phase) // scale)
+        bounds[same] = scale * block_sums / counts[same]
+
+    return bounds
+
+
+####################
+#   Compares two rows coarse to fine.  Most offsets (and most pairs) that
+#   don't match are thrown out at a small fraction of the size; only the
+#   ones that might match get looked at full size.
+#
+#   Every offset from -max_shift to max_shift starts out at the coarsest
+#   level (rows shrunk 2^levels times).  Each level works out a lower
+#   bound on each remaining offset's distance (see get_offset_bounds())
+#   and throws out the ones that are already past the tolerance.  What
+#   makes it to full size is compared for real.
+#
+#   Since the bounds never overshoot, nothing that could match is ever
+#   thrown out: whenever some offset is within the tolerance, the answer
+#   is exactly what compare_rows_with_offsets() would pick.
+#
+#   returns
+#       (distance, offset)  The best offset and its distance.  When no
+#           offset matches, the distance is the smallest one found--a
+#           lower bound for offsets that were thrown out early, the real
+#           distance for the others--and it's past the tolerance too.
+#       None if the rows are different widths.
+#
+def compare_rows_pyramid(row1, row2, compare_type, max_shift = 0, levels = PYRAMID_LEVELS, tolerance = TOLERANCE):
+    width = len(row1)
+    if width != len(row2):
+        if debug:
+            print('compare_rows_pyramid() Error!  Not same width!')
+        return
+
+    channels = get_compare_channels(compare_type)
+    row1 = row1[..., channels].astype(np.float64)
+    row2 = row2[..., channels].astype(np.float64)
+
+    if width == 0:
+        if debug:
+            print('compare_rows_pyramid() Error!  Nothing to compare!')
+        return
+
+    max_shift = min(max_shift, width - 1)
+    offsets = np.arange(-max_shift, max_shift + 1)
+    distances = np.full(len(offsets), np.inf)
+    alive = np.ones(len(offsets), dtype = bool)
+
+    for level in range(levels, 0, -1):
+        scale = 2 ** level
+        if (width < scale) or not np.any(alive):
+            continue
+
+        # Offsets thrown out keep their bound as their distance (it's
+        # past the tolerance, and it's all we know about them).
+        left = np.sum(alive)
+        distances[alive] = get_offset_bounds(row1, row2, scale, offsets[alive])
+        alive &= (distances < tolerance * PYRAMID_ROUNDING)
+
+        if debug:
+            print(f'compare_rows_pyramid() level {level}: {np.sum(alive)} of {len(offsets)} offsets left')
+
+        # Nothing thrown out here (smooth rows that line up at every
+        # offset), so the finer levels won't do any better--go straight
+        # to full size.
+        if np.sum(alive) == left:
+            break
+
+    if np.any(alive):
+        sums, counts = get_offset_sums(row1, row2, offsets[alive])
+        distances[alive] = sums / counts
+
+    # smallest distance wins, ties go to the smallest shift (just like
+    # compare_rows_with_offsets())
+    best = min(range(len(offsets)), key = lambda i: (distances[i], abs(offsets[i]), offsets[i] < 0))
+
+    return (float(distances[best]), int(offsets[best]))
+
+
+####################
+#   Compares the bottom of file1 with the top of file2, coarse to fine.
+#   For JPEGs the coarsest level comes from a draft (scaled down) decode,
+#   which is much cheaper than decoding at full size, so pairs that
+#   obviously don't match never get fully decoded at all.
+#
+#   The draft look is only a quick screen, not a bound like the ones in
+#   compare_rows_pyramid(): a draft pixel isn't exactly a block average,
+#   and odd offsets fall between the draft pixels.  So it gets some slack
+#   (see get_pyramid_tolerance()), but could still (rarely) turn down a
+#   real match.  Everything that gets past it goes through
+#   compare_rows_pyramid() at full size.
+#
+#   params
+#       max_shift   Biggest offset to try (see compare_edges_with_offsets()).
+#
+#       levels      How many times to halve.  The JPEG draft decode can
+#                   only go down to 1/8 (3 levels).
+#
+#   returns
+#       (distance, offset)      See compare_rows_pyramid().
+#       None on error (not graphics files or different widths).
+#
+def compare_edges_pyramid(file1, file2, compare_type, max_shift = 0, levels = PYRAMID_LEVELS):
+    if debug:
+        print(f'compare_edges_pyramid( {file1}, {file2}, {compare_type}, {max_shift}, {levels})')
+
+    try:
+        image1 = Image.open(file1)
+        image2 = Image.open(file2)
+
+    except:
+        if debug:
+            print('One or more files were not image files--aborting!')
+        return
+
+    width = image1.width
+    width2 = image2.width
+    image2.close()
+    image1.close()
+
+    if width != width2:
+        if debug:
+            print(f'compare_edges_pyramid( {file1}, {file2} ) Error!  Not same width!')
+        return
+
+    # the quick look (only works if both are JPEGs)
+    coarse1 = load_draft_edge_strip(file1, BOTTOM_EDGE, 2 ** levels)
+    coarse2 = load_draft_edge_strip(file2, TOP_EDGE, 2 ** levels)
+    if (coarse1 != None) and (coarse2 != None) and (coarse1[1] == coarse2[1]):
+        scale = coarse1[1]
+        level = int(math.log2(scale))
+        result = compare_rows_with_offsets(coarse1[0][-1], coarse2[0][0], compare_type, -(-max_shift // scale))
+        if result != None:
+            distances, offset = result
+            distance = distances[offset + len(distances) // 2]
+            if debug:
+                print(f'compare_edges_pyramid() draft level {level}: distance = {distance}')
+
+            if distance >= get_pyramid_tolerance(level):
+                return (distance, max(-max_shift, min(max_shift, offset * scale)))
+
+    # might match, so now the real thing
+    band1 = load_edge_strip(file1, BOTTOM_EDGE)
+    band2 = load_edge_strip(file2, TOP_EDGE)
+    if (band1 is None) or (band2 is None):
+        return
+
+    return compare_rows_pyramid(band1[0], band2[0], compare_type, max_shift, levels)
 
 
 ####################
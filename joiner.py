@@ -7,6 +7,10 @@ import sys      # for command line arguments
 from PIL import Image, ImageDraw
 from PIL import ImageOps
 
+import image_cache
+import canvas
+import strip_writer
+
 
 ############################
 #   constants
@@ -16,7 +20,7 @@ USAGE = """
 Joiner - a program to stitch together two images.
 
 Usage:
-    joiner <file1_name> <file2_name> +[file?_name] [-v] [-ov[2] <integer>] [-ovlr <int> <int>] [-off <integer>] [-o out_file] [-debug]
+    joiner <file1_name> <file2_name> +[file?_name] [-v] [-ov[2] <integer>] [-ovlr <int> <int>] [-off <integer>] [-o out_file] [--max-mem size] [--on-disk] [-debug]
 
 Joins files vertically or horizontally or vertically (using the -v options).  File1 will be
 left-most (or top), file2 will be next, file3 will be after that, and so on for as many files
@@ -53,6 +57,14 @@ The top and bottom file should be the same width (unless -f option is used).
         Supply the number of pixels of space to add.  This can make the image look a
         little better if parts have been clipped.
 
+--max-mem   The most memory to use for the decoded images, like 2G or 512M.
+        Defaults to 512M.
+
+--on-disk   For giant images: build the joined image in a file on disk
+        (memory-mapped) instead of in memory, and save it a strip at a time.
+        The output file (-o) has to be a .tif (a BigTIFF past 4 GB), .png or
+        .ppm then--the default name is a .tif.  Doesn't apply to -ovlr.
+
 -debug  Print debug info.
 
 """
@@ -90,6 +102,13 @@ OFFSET_PARAM = '-off'
 # pixels of black should appear between the images.
 SPACE_PARAM = "-sp"
 
+# Indicates that the following param is the most memory to use for the
+# decoded images (like 2G or 512M).
+MAX_MEM_PARAM = '--max-mem'
+
+# Build the joined image on disk (the output file says what it's saved as).
+ON_DISK_PARAM = '--on-disk'
+
 # indicates that all debug messages need to be displayed
 DEBUG_PARAM = '-debug'
 
@@ -142,6 +161,9 @@ trim_left = 0
 # Similar to trim_left, but for the left side of the right image.
 trim_right = 0
 
+# When True, build the joined image on disk (see canvas.py)
+use_disk_canvas = False
+
 
 ############################
 #   functions
@@ -163,6 +185,10 @@ trim_right = 0
 #
 #       debug               Will be set to True only if one of the params is '-d'
 #
+#       image_cache.max_bytes   Will change if MAX_MEM_PARAM is used
+#
+#       use_disk_canvas     Will be set to True only if ON_DISK_PARAM is used
+#
 def parse_params():
     # Note that sys.argv[0] is always 'joiner.py' and its path, so that
     # counts as the first argument.
@@ -178,6 +204,7 @@ def parse_params():
     global space_pixels
     global trim_left
     global trim_right
+    global use_disk_canvas
 
 
     # loop through all the params
@@ -242,6 +269,23 @@ def parse_params():
             if debug:
                 print(f'   space: {space_pixels}')
 
+        elif this_param.lower() == MAX_MEM_PARAM:
+            counter += 1
+            max_mem = None
+            if counter < len(sys.argv):
+                max_mem = image_cache.parse_memory_size(sys.argv[counter])
+            if max_mem == None:
+                print(f'Unable to parse the memory size!')
+                exit(USAGE)
+            image_cache.max_bytes = max_mem
+            if debug:
+                print(f'   max mem: {max_mem}')
+
+        elif this_param.lower() == ON_DISK_PARAM:
+            use_disk_canvas = True
+            if debug:
+                print('   use_disk_canvas is set to True')
+
         # From here on out these are input filenames.
         # Since they go in order, it's pretty easy to figure out which one.
         else:
@@ -256,6 +300,10 @@ def parse_params():
         print("Hmmm, can't seem to find enough input files.  Try again. ")
         exit(USAGE)
 
+    if use_disk_canvas and (len(new_filename) != 0) and (strip_writer.get_output_format(new_filename) == None):
+        print(f'With {ON_DISK_PARAM} the output file has to be a .tif, .png or .ppm, not {new_filename}')
+        exit(USAGE)
+
     if debug:
         print('parse_params() results:')
         print(f'   filenames = {filenames}')
@@ -313,7 +361,11 @@ def create_output_filename():
     start_name_prefix = get_file_prefix(filenames[0])
     end_name_prefix = get_file_prefix(filenames[-1])   # python way of getting last element in list
 
-    new_output_file = start_name_prefix + ' - ' + end_name_prefix + '.jpg'
+    extension = '.jpg'
+    if use_disk_canvas:
+        extension = '.tif'
+
+    new_output_file = start_name_prefix + ' - ' + end_name_prefix + extension
     if debug:
         print(f'   new_output_file = {new_output_file}')
     return get_unique_name(new_output_file)     # make sure we don't overwrite some file
@@ -593,43 +645,46 @@ def join_files_vertically(images_list, out_file, overlap, overlap2, offset, spac
                 print(f'image[{i}] with width {this_width} has adjustment of {width_adjustment_list[i]}')
 
 
-    # figure out height of output image
+    # figure out height of output image (every seam loses the overlap)
     out_image_height = 0
     max_overlap = max(overlap, overlap2)
     for image in images_list:
-        out_image_height += image.height - max_overlap
+        out_image_height += image.height
+    out_image_height -= (len(images_list) - 1) * max_overlap
 
     # The amount of space to add is the space * (number of images - 1)
     out_image_height += (len(images_list) - 1) * space
 
-    # new image combines heights
-    out_image = Image.new('RGB', (widest, out_image_height))
+    # new image combines heights (on disk with ON_DISK_PARAM--see canvas.py)
+    out_image = canvas.new_canvas(widest, out_image_height, use_disk_canvas, os.path.dirname(out_file) or '.')
 
     # Paste the pieces (centering, which will do nothing if the width already matches
     # the image width) together. Don't forget the offset and space!
+    # paste_line is always just below the last image pasted (plus the space).
     paste_line = 0
     for i in range(len(images_list)):
         if i >= 1:
             # only the 2nd and later images can have an offset and overlap
             if overlap >= overlap2:
-                out_image.paste(images_list[i], (width_adjustment_list[i] + offset, paste_line - overlap))
+                canvas.paste_image(out_image, images_list[i], (width_adjustment_list[i] + offset, paste_line - overlap))
+                paste_line += images_list[i].height - overlap + space
             else:
                 # this is a little more complicted: 
                 # First, make a temporary image from the image to paste, but take away the
                 # part that is being overlapped
                 tmp_image = Image.new('RGB', (images_list[i].width, images_list[i].height - overlap2))
                 tmp_image.paste(images_list[i], (0, 0 - overlap2))    # seems like negatives work
-                out_image.paste(tmp_image, (width_adjustment_list[i] + offset, paste_line))
+                canvas.paste_image(out_image, tmp_image, (width_adjustment_list[i] + offset, paste_line))
+                paste_line += images_list[i].height - overlap2 + space
         else:
-            out_image.paste(images_list[i], (width_adjustment_list[i], paste_line))
-            
-        paste_line += images_list[i].height - overlap + space
+            canvas.paste_image(out_image, images_list[i], (width_adjustment_list[i], paste_line))
+            paste_line += images_list[i].height + space
 
     # Save result and clean up
-    out_image.save(out_file)
-    out_image.close()
+    saved = canvas.save_canvas(out_image, out_file)
+    canvas.close_canvas(out_image)
 
-    return True
+    return saved
 
 
 #########
@@ -696,46 +751,49 @@ def join_files_horizontally(images_list, out_file, overlap, overlap2, offset, sp
                 print(f'image[{i}] with height {this_height} has adjustment of {height_adjustment_list[i]}')
 
 
-    # figure out width of output image
+    # figure out width of output image (every seam loses the overlap)
     out_image_width = 0
     overlap_width = max(overlap, overlap2)
     for image in images_list:
-        out_image_width += image.width - overlap_width
+        out_image_width += image.width
+    out_image_width -= (len(images_list) - 1) * overlap_width
 
     # The amount of space to add is the space * (number of images - 1)
     out_image_width += (len(images_list) - 1) * space
 
-    # new image combines widths
-    out_image = Image.new('RGB', (out_image_width, tallest))
+    # new image combines widths (on disk with ON_DISK_PARAM--see canvas.py)
+    out_image = canvas.new_canvas(out_image_width, tallest, use_disk_canvas, os.path.dirname(out_file) or '.')
 
     # Paste the pieces (centering, which will do nothing if the height already
     # matches the image height) together.  Don't forget to add the offset, the space, 
     # and subtract the overlap!
+    # paste_line is always just right of the last image pasted (plus the space).
     paste_line = 0
     for i in range(len(images_list)):
         if i >= 1:
             # only do the 2nd, 3rd, etc images with an offset (and overlap)!
             if overlap >= overlap2:
                 # overlap the right over the left (or bottom over top)
-                out_image.paste(images_list[i], (paste_line - overlap, height_adjustment_list[i] + offset))
+                canvas.paste_image(out_image, images_list[i], (paste_line - overlap, height_adjustment_list[i] + offset))
+                paste_line += images_list[i].width - overlap + space
             else:
                 # Overlap the left over the right--this is a little more complicated.
                 # First, make a temporary image from the image to paste, but take away the
                 # part that is being overlapped
                 tmp_image = Image.new('RGB', (images_list[i].width - overlap2, images_list[i].height))
                 tmp_image.paste(images_list[i], (0 - overlap2, 0))    # yep, negatives seem to work
-                out_image.paste(tmp_image, (paste_line, height_adjustment_list[i] + offset))
+                canvas.paste_image(out_image, tmp_image, (paste_line, height_adjustment_list[i] + offset))
+                paste_line += images_list[i].width - overlap2 + space
 
         else:
-            out_image.paste(images_list[i], (paste_line, height_adjustment_list[i]))
-
-        paste_line += images_list[i].width - overlap + space
+            canvas.paste_image(out_image, images_list[i], (paste_line, height_adjustment_list[i]))
+            paste_line += images_list[i].width + space
 
     # save and clean up
-    out_image.save(out_file)
-    out_image.close()
+    saved = canvas.save_canvas(out_image, out_file)
+    canvas.close_canvas(out_image)
 
-    return True
+    return saved
 
 
 #########
@@ -907,16 +965,20 @@ def join_files(infile_list, out_file, offset, space, force = False):
             tmp_name_list.append(infile_name)
 
 
-    # create image list
+    # create image list (they're all decoded at once, in the background--see
+    # image_cache.py)
+    image_cache.prefetch(tmp_name_list)
     in_image_list = []
     for filename in tmp_name_list:
-        try:
-            image = Image.open(filename)
+        image = image_cache.get_image(filename)
+        if image != None:
             in_image_list.append(image)
 
-        except:
+        else:
             print(f'{filename} is not an image file--aborting!')
             # try to clean up the temp files
+            for tmp_name in tmp_name_list:
+                image_cache.release_image(tmp_name)
             for tmp_file in name_to_delete_list:
                 os.remove(tmp_file)
             return False
@@ -938,8 +1000,10 @@ def join_files(infile_list, out_file, offset, space, force = False):
         else:
             return_val = join_files_vertically(in_image_list, out_file, overlap_pixels, overlap_pixels2, offset, space, force)
 
-    for image in in_image_list:
-        image.close()
+    # (the images belong to the cache, so they aren't closed here--just let
+    # go of, since they're all joined now)
+    for tmp_name in tmp_name_list:
+        image_cache.release_image(tmp_name)
 
     # remove tmp files
     for tmp_file in name_to_delete_list:
@@ -22,7 +22,17 @@
 
 import sys      # for command line arguments
 import os       # allows file access
+from collections import deque
 from image_comparator import *
+import edge_cache
+import piece_order
+import edge_index
+import piece_index
+import pair_scoring
+import pipeline
+import image_cache
+import canvas
+import strip_writer
 
 
 ##############################
@@ -33,12 +43,58 @@ usage = """
     merge_images  -- a program to try to fix munged images from bad PDF files.
 
 USAGE:
-    merge_images [path]
+    merge_images [path] [-c] [-s num] [-p] [-r] [-o] [-i] [-h] [-j num] [--max-mem size] [--tiff | --png | --ppm]
 
 Defaulting the current directory, this will go through all the image files and
 try to match 'em up and join them back together.
 
-The output files will be named 'assembled_###'.jpg and will be placed in the
+    -c      Keep the edges of all the pieces in a sidecar file (.edge_signatures.npz)
+            in the directory.  The next run in that directory won't need to decode
+            any of the pieces to match them up.
+
+    -s num  Try shifting the pieces sideways by up to this many pixels when
+            matching (in case they're askew).  Defaults to 2.
+
+    -p      Match coarse to fine: compare shrunken edges first and only look at
+            full size when they might match.  Faster with big shifts or wide pieces.
+
+    -r      Only look at a random sample of each seam, adding more of it until
+            it's clear whether it matches.  Much faster on very wide pieces,
+            but (very rarely) may decide differently than looking at it all.
+
+    -o      Don't assume the files are in order.  Every piece is compared with
+            every other piece of the same width and the best chains are found
+            (pieces that are out of order get joined too).  Slower, and -p
+            and -r don't apply.
+
+    -i      Like -o, but for huge piles of pieces: an index of the edges finds
+            a few likely neighbors for each piece and only those are compared.
+            Much faster, but could (rarely) miss a match.
+
+    -h      The pieces go side by side (left to right) instead of top to bottom.
+            Matches the right edge of each piece with the left edge of the next.
+
+    -j num  Decode the pieces with this many processes at once, and score,
+            join and save them with this many threads (0 means one per CPU).
+            Defaults to 1.  Doesn't apply to -o or -i.
+
+    --max-mem size
+            The most memory to use for decoded pieces, like 2G or 512M.
+            Pieces are thrown out (least recently used first) past that,
+            and decoded again if they're needed.  Defaults to 512M.
+
+    --tiff  For giant images: save the joined images as TIFFs (BigTIFF past
+            4 GB) without ever having a whole one in memory.  Pieces that go
+            top to bottom are written straight into the file as they're
+            decoded.  With -h each image is built in a file on disk first
+            (memory-mapped), so that needs as much free disk space as the
+            image takes.
+
+    --png   Like --tiff, but saves PNGs.
+
+    --ppm   Like --tiff, but saves PPMs (not compressed at all--fastest).
+
+The output files will be named 'assembled_###'.jpg (.tif, .png or .ppm with those) and will be placed in the
 same directory.  
 
 NOTE:  Anything file the same name will be overwritten!!!
@@ -52,6 +108,49 @@ FILE_PREFIX = 'assembled_'
 # to turn on verbose messages
 DEBUG = False
 
+# command param to keep the edge signatures in a sidecar file
+SIDECAR_PARAM = '-c'
+
+# param to indicate that the next param is the biggest shift to try
+SHIFT_PARAM = '-s'
+
+# The biggest sideways shift (in pixels) to try when matching, unless
+# SHIFT_PARAM says otherwise.
+DEFAULT_MAX_SHIFT = 2
+
+# param to match the edges coarse to fine
+PYRAMID_PARAM = '-p'
+
+# param to compare just a sample of each seam
+SAMPLE_PARAM = '-r'
+
+# param to find the best order instead of using the file order
+ORDER_PARAM = '-o'
+
+# param to find the best order using the edge index (for lots of pieces)
+INDEX_PARAM = '-i'
+
+# param to stitch the pieces together horizontally
+HORIZ_PARAM = '-h'
+
+# param to indicate that the next param is the number of worker processes
+WORKERS_PARAM = '-j'
+
+# param to indicate that the next param is the memory for decoded pieces
+MAX_MEM_PARAM = '--max-mem'
+
+# The extension of the joined images normally (which picks their format)
+JPEG_EXTENSION = '.jpg'
+
+# params to save the joined images without ever having a whole one in
+# memory, and the extensions they save as (see strip_writer.py)
+OUTPUT_FORMAT_PARAMS = {'--tiff': '.tif', '--png': '.png', '--ppm': '.ppm'}
+
+# How many joined images can wait to be saved (each one is a whole image
+# in memory).  Also how many runs can wait to be pasted (their pieces are
+# being decoded ahead of time).
+JOINED_QUEUE_DEPTH = 2
+
 
 ##############################
 #   globals
@@ -66,88 +165,481 @@ num_joined_files = 0
 # didn't work but should have.
 unjoined_file_list = list()
 
+# the directory to work in (None means the current directory)
+path = None
 
-##############################
-#   script begin
-##############################
+# When True, read and write the edge signatures sidecar file.
+use_sidecar = False
+
+# All the files in the directory, sorted
+file_list = []
+
+# The sizes of all the pieces (see piece_index.py)
+pieces = {}
+
+# Biggest offset (either way) to try when matching edges
+max_shift = DEFAULT_MAX_SHIFT
+
+# When True, match the edges coarse to fine
+use_pyramid = False
+
+# When True, only a sample of each seam is compared
+use_sampling = False
+
+# When True, find the best order for the pieces (see piece_order.py)
+use_ordering = False
+
+# When True (along with use_ordering), use the edge index to find the order
+use_index = False
+
+# When True, the pieces go left to right instead of top to bottom
+horizontal = False
+
+# How many processes decode the pieces, and threads score, join and save
+# them (see join_in_file_order())
+num_workers = 1
 
-########
-#   parse command line arguments
+# When True, the joined images are never all in memory: they're written
+# straight to the file (see strip_writer.py) or built on disk (canvas.py)
+out_of_core = False
+
+# The extension of the joined images (JPEG_EXTENSION or one from
+# OUTPUT_FORMAT_PARAMS)
+output_extension = JPEG_EXTENSION
+
+
+#########
+#   Parses command line params.  Will exit program if params don't
+#   make sense.
+#
+#   side effects:
+#       path            Set to the directory param (if there is one)
+#
+#       use_sidecar     Set to True iff SIDECAR_PARAM exists
+#
+#       max_shift       May change if SHIFT_PARAM exists
+#
+#       use_pyramid     Set to True iff PYRAMID_PARAM exists
+#
+#       use_sampling    Set to True iff SAMPLE_PARAM exists
+#
+#       use_ordering    Set to True iff ORDER_PARAM exists
+#
+#       use_index       Set to True iff INDEX_PARAM exists (use_ordering
+#                       is set too)
+#
+#       horizontal      Set to True iff HORIZ_PARAM exists
 #
-if DEBUG:
-    print(f'number of args is {len(sys.argv)}')
+#       num_workers     May change if WORKERS_PARAM exists
+#
+#       image_cache.max_bytes   May change if MAX_MEM_PARAM exists
+#
+#       out_of_core, output_extension   Change if one of the
+#                       OUTPUT_FORMAT_PARAMS exists
+#
+def parse_params():
+    global path
+    global use_sidecar
+    global max_shift
+    global use_pyramid
+    global use_sampling
+    global use_ordering
+    global use_index
+    global horizontal
+    global num_workers
+    global out_of_core
+    global output_extension
 
-if len(sys.argv) == 2:
-    path = sys.argv[1]
-    os.chdir(path)
     if DEBUG:
-        print(f'changing directories to {path}')
-
-if len(sys.argv) > 2:
-    exit(usage)
-
-if DEBUG:
-    print('path defaulting to current directory')
-          
-########
-# A list of all the files in the current directory
-# in an array (or list?) of strings.
-temp_file_list = os.listdir()
-file_list = []
+        print(f'number of args is {len(sys.argv)}')
 
-# Strip out the directories
-for f in temp_file_list:
-    if os.path.isfile(f):
-        file_list.append(f)
-    
-# sort the list (I assume that the images are in alphabetical order)
-file_list.sort()
+    # loop through all the params
+    counter = 1
+    while counter < len(sys.argv):
+        this_param = sys.argv[counter]
+
+        if this_param.lower() == SIDECAR_PARAM:
+            use_sidecar = True
+            if DEBUG:
+                print('   use_sidecar is set to True')
+
+        elif this_param.lower() == SHIFT_PARAM:
+            counter += 1
+            try:
+                max_shift = int(sys.argv[counter])
+            except:
+                print(f'unable to parse the shift!')
+                exit(usage)
+
+            if max_shift < 0:
+                print(f'shift must not be negative!')
+                exit(usage)
+            if DEBUG:
+                print(f'   max_shift = {max_shift}')
+
+        elif this_param.lower() == PYRAMID_PARAM:
+            use_pyramid = True
+            if DEBUG:
+                print('   use_pyramid is set to True')
+
+        elif this_param.lower() == SAMPLE_PARAM:
+            use_sampling = True
+            if DEBUG:
+                print('   use_sampling is set to True')
+
+        elif this_param.lower() == ORDER_PARAM:
+            use_ordering = True
+            if DEBUG:
+                print('   use_ordering is set to True')
+
+        elif this_param.lower() == INDEX_PARAM:
+            use_ordering = True
+            use_index = True
+            if DEBUG:
+                print('   use_index is set to True')
+
+        elif this_param.lower() == HORIZ_PARAM:
+            horizontal = True
+            if DEBUG:
+                print('   horizontal is set to True')
+
+        elif this_param.lower() == WORKERS_PARAM:
+            counter += 1
+            try:
+                num_workers = int(sys.argv[counter])
+            except:
+                print(f'unable to parse the number of workers!')
+                exit(usage)
+
+            if num_workers < 0:
+                print(f'number of workers must not be negative!')
+                exit(usage)
+            if num_workers == 0:
+                num_workers = os.cpu_count() or 1
+            if DEBUG:
+                print(f'   num_workers = {num_workers}')
+
+        elif this_param.lower() == MAX_MEM_PARAM:
+            counter += 1
+            max_mem = None
+            if counter < len(sys.argv):
+                max_mem = image_cache.parse_memory_size(sys.argv[counter])
+
+            if max_mem == None:
+                print(f'unable to parse the memory size!')
+                exit(usage)
+            image_cache.max_bytes = max_mem
+            if DEBUG:
+                print(f'   max_mem = {max_mem}')
+
+        elif this_param.lower() in OUTPUT_FORMAT_PARAMS:
+            out_of_core = True
+            output_extension = OUTPUT_FORMAT_PARAMS[this_param.lower()]
+            if DEBUG:
+                print(f'   out_of_core is set to True, output_extension = {output_extension}')
+
+        else:
+            # Must be the path.  But we can only have one.
+            if path != None:
+                print(f'extra parameter {counter}: {this_param}, aborting')
+                exit(usage)
+            path = this_param
+
+        counter += 1
 
 
 #########
 #   Joins the files in the given list.  The list must be ordered top
-#   to bottom.
+#   to bottom (left to right if horizontal).
 #
 #   side effects
-#       A new file will be created with the name {FILE_PREFIX}{output_file_count}.jpg
+#       A new file will be created with the name {FILE_PREFIX}{output_file_count}{output_extension}
 #
 def join_files(file_list):
     global output_file_count
 
+    output_name = f'{FILE_PREFIX}{output_file_count}{output_extension}'
+    output_file_count += 1
+
     length = len(file_list)
-    print(f'      joining {length} files: {file_list[0]} to {file_list[length - 1]} -> {FILE_PREFIX}{output_file_count}.jpg')
-    
-    images = []
+    print(f'      joining {length} files: {file_list[0]} to {file_list[length - 1]} -> {output_name}')
+
+    if can_stream():
+        if not stream_pieces(file_list, output_name):
+            exit(f'Unable to write {output_name}. Aborting!!!')
+        return
+
+    new_image = paste_pieces(file_list)
+
+    # and save the result
+    if not canvas.save_canvas(new_image, output_name):
+        exit(f'Unable to write {output_name}. Aborting!!!')
+
+    # don't forget to close this image
+    canvas.close_canvas(new_image)
+
+
+#########
+#   Returns True if the joined images can be written straight to their
+#   files, without being put together first (see stream_pieces()).
+#
+def can_stream():
+    return out_of_core and not horizontal
+
+
+#########
+#   Writes the pieces in the given list (top to bottom) straight into a
+#   new image file, one after the other as they're decoded, so the joined
+#   image is never in memory--just the piece being written and the few
+#   being decoded in the background (see image_cache.py) while it is.
+#   Every piece is let go of as soon as it's written.
+#
+#   Only works top to bottom (the pieces are all the same width, so the
+#   joined image is just their rows in order).
+#
+#   returns
+#       True if the file was written.
+#
+def stream_pieces(file_list, output_name):
+    width = pieces[file_list[0]][0]
+    height = 0
     for filename in file_list:
-        # open the named image
-        images.append(Image.open(filename))
+        height += pieces[filename][1]
+
+    writer = strip_writer.open_writer(output_name, width, height)
+    if writer == None:
+        return False
+
+    for image in image_cache.take_images(file_list):
+        # (it belongs to the cache, so no closing it)
+        strip_writer.write_image(writer, image)
+    strip_writer.close_writer(writer)
 
+    return True
+
+
+#########
+#   Pastes the pieces in the given list into one new image.  The list
+#   must be ordered top to bottom (left to right if horizontal).  The
+#   size comes from the pieces' headers, and the pieces come from the
+#   image cache (see image_cache.py) a few at a time, each one let go of
+#   as soon as it's pasted.
+#
+#   returns
+#       The new image, or a canvas on disk with out_of_core (see
+#       canvas.py).  The caller closes it.
+#
+def paste_pieces(file_list):
     # find the width and height of the new joined image
-    width = images[0].width
-    height = 0
-    for image in images:
-        height += image.height
+    width, height = pieces[file_list[0]][:2]
+    if horizontal:
+        width = 0
+        for filename in file_list:
+            width += pieces[filename][0]
+    else:
+        height = 0
+        for filename in file_list:
+            height += pieces[filename][1]
 
     # let's make a new image and add in the contents of the other images
-    new_image = Image.new('RGB', (width, height))
+    new_image = canvas.new_canvas(width, height, out_of_core)
 
+    current_x_to_paste = 0
     current_y_to_paste = 0
-    for i in range(len(file_list)):
-        new_image.paste(images[i], (0, current_y_to_paste, images[i].width, current_y_to_paste + images[i].height))
-        current_y_to_paste += images[i].height
+    for image in image_cache.take_images(file_list):
+        # (it belongs to the cache, so no closing it)
+        canvas.paste_image(new_image, image, (current_x_to_paste, current_y_to_paste,
+                                              current_x_to_paste + image.width, current_y_to_paste + image.height))
+        if horizontal:
+            current_x_to_paste += image.width
+        else:
+            current_y_to_paste += image.height
 
-    # and save the result
-    new_image.save(f'{FILE_PREFIX}{output_file_count}.jpg')
-    output_file_count += 1
+    return new_image
+
+
+#########
+#   The stages of join_in_file_order().  Each one gets what the stage
+#   before it made (see pipeline.py).  The ones that can run in worker
+#   processes only use what they're given.
+#
+
+#   Reads the header of a piece.
+#
+#   returns
+#       (filename, header, edges)   (See piece_index.read_piece_header().
+#                                   edges are the ones the seams need.)
+#
+def read_piece(filename):
+    return (filename, piece_index.read_piece_header(filename), edge_cache.get_signature_edges(horizontal))
+
+
+#   Finds the edges of a piece (in the sidecar or by decoding them).
+#
+#   returns
+#       (filename, header, found)  (See edge_cache.load_edge_signature().
+#                                   found is None when it's not an image.)
+#
+def load_piece(piece):
+    filename, header, edges = piece
+    if header == None:
+        return (filename, None, None)
+
+    return (filename, header, edge_cache.load_edge_signature(filename, edges))
+
+
+#   Goes through the pieces in file order, remembering them (file_list
+#   and pieces) and keeping the edges that were decoded.  Pairs each piece
+#   up with the piece before it of the same size (the only one it could go
+#   under--see join_in_file_order()).
+#
+#   yields
+#       (filename, header, edges, options)
+#           edges is the two edges that meet at the seam (see
+#           edge_cache.get_seam_edges()), None if there's nothing to compare.
+#
+def pair_pieces(loaded):
+    options = (HUE_MASK, max_shift, use_pyramid, use_sampling)
+    last_of_size = {}
+
+    for filename, header, found in loaded:
+        file_list.append(filename)
+        pieces[filename] = header
+
+        signature = None
+        if found != None:
+            key, signature, decoded = found
+            if decoded and (signature != None):
+                edge_cache.add_new_signatures({key: signature})
+
+        previous_signature = None
+        if header != None:
+            size = header[1] if horizontal else header[0]
+            previous_signature = last_of_size.get(size)
+            last_of_size[size] = signature
+
+        edges = edge_cache.get_seam_edges(previous_signature, signature, horizontal)
+        yield (filename, header, edges, options)
+
+
+#   Scores the seam between a piece and the one before it.
+#
+#   returns
+#       (filename, header, matched)
+#
+def score_piece(paired):
+    filename, header, edges, options = paired
+
+    matched = None
+    if edges != None:
+        matched, dist, offset = pair_scoring.score_edges(edges[0], edges[1], *options)
+        if DEBUG:
+            print(f'   {filename}: dist = {dist}, offset = {offset}')
+
+    return (filename, header, matched)
+
+
+#   Builds the runs of matching pieces.  A run is finished once the next
+#   piece of its size doesn't match (or there are no more pieces).  The
+#   runs are handed on in the order they started in, so the names of the
+#   joined images come out the same as if it was done one at a time.
+#
+#   yields
+#       (output_name, run)  for each run of more than one piece.
+#
+#   side effects
+#       output_file_count and unjoined_file_list are updated
+#
+def match_pieces(scored):
+    # The runs in the order they started: [files, finished]
+    runs = deque()
+
+    # The run that's still going for each size
+    open_runs = {}
+
+    for filename, header, matched in scored:
+        if header == None:
+            # not an image, nothing to join
+            runs.append([[filename], True])
+
+        else:
+            size = header[1] if horizontal else header[0]
+            run = open_runs.get(size)
+            if (run != None) and matched:
+                # This is a match!!!  Add it to the run.
+                run[0].append(filename)
+            else:
+                if run != None:
+                    run[1] = True
+                run = [[filename], False]
+                runs.append(run)
+                open_runs[size] = run
+
+        yield from finish_runs(runs)
+
+    for run in runs:
+        run[1] = True
+    yield from finish_runs(runs)
+
+
+#   Takes the finished runs off the front of the list.
+#
+def finish_runs(runs):
+    global output_file_count
+
+    while (len(runs) > 0) and runs[0][1]:
+        run = runs.popleft()[0]
+        if len(run) == 1:
+            unjoined_file_list.append(run[0])
+            # (it may have been decoded to find its edges)
+            image_cache.release_image(run[0])
+            continue
+
+        output_name = f'{FILE_PREFIX}{output_file_count}{output_extension}'
+        output_file_count += 1
+        print(f'      joining {len(run)} files: {run[0]} to {run[-1]} -> {output_name}')
+
+        # start decoding the run's first pieces now, while the runs before
+        # it are being pasted and saved
+        image_cache.prefetch(run[:image_cache.PREFETCH_COUNT])
+        yield (output_name, run)
+
+
+#   Pastes the pieces of a run together (or writes them straight to the
+#   file, when they can be--see can_stream()).
+#
+#   returns
+#       (output_name, new_image)    new_image is None if it's already
+#                                   written.
+#
+def paste_run(named_run):
+    output_name, run = named_run
+    if can_stream():
+        if not stream_pieces(run, output_name):
+            exit(f'Unable to write {output_name}. Aborting!!!')
+        return (output_name, None)
 
-    # don't forget to close these images
-    new_image.close()
-    for image in images:
-        image.close()
+    return (output_name, paste_pieces(run))
 
 
+#   Saves a joined image.
+#
+#   returns
+#       output_name
+#
+def save_run(pasted):
+    output_name, new_image = pasted
+    if new_image != None:
+        saved = canvas.save_canvas(new_image, output_name)
+        canvas.close_canvas(new_image)
+        if not saved:
+            exit(f'Unable to write {output_name}. Aborting!!!')
+    return output_name
+
 
 #########
+#   Joins the pieces in the order the files are in (the fast way for
+#   pieces that are already in order).
 #
 #   Method:
 #
@@ -156,105 +648,171 @@ def join_files(file_list):
 # the 2nd one?  If so, add it to the list.  Continue adding
 # to the list until there isn't a match any more.
 #
+# Pieces that can't go with the current one (a different width, or not an
+# image at all--see piece_index.py) are skipped over without being
+# decoded, so the pieces of two images that are mixed together still get
+# joined.  The skipped ones get their turn later.  (So the only piece a
+# piece can ever go under is the one before it of the same size.)
+#
 # At this point, join all the pieces and make a new file.
 #
-# Then continue on, starting with the last file that didn't match.
-i = 0
-while i < len(file_list): 
-    curr_top_file = file_list[i]
-    if DEBUG:
-        print(f'\ntop file is {file_list[i]}, i = {i}')
+# Then continue on, starting with the next file that isn't used yet.
+#
+#   All of this is done as a pipeline (see pipeline.py), so that reading
+#   the files, decoding, matching, joining and saving all overlap:
+#
+#       discovery   Reads the headers (threads).
+#       decode      Finds the edges (processes with num_workers > 1).
+#       pair        Pairs each piece with the one it could go under.
+#       score       Scores those seams (num_workers threads).
+#       match       Builds the runs of matching pieces (and starts decoding
+#                   their first pieces--see image_cache.py).
+#       paste       Pastes each run into one image (num_workers threads),
+#                   or writes it straight to its file (see can_stream()).
+#       save        Encodes them (num_workers threads).
+#
+#   The queues in between only hold so many pieces (and only
+#   JOINED_QUEUE_DEPTH whole images), so the memory used doesn't grow with
+#   the number of pieces.
+#
+#   side effects
+#       file_list, pieces, num_joined_files and unjoined_file_list are updated
+#
+def join_in_file_order():
+    global num_joined_files
+
+    use_processes = num_workers > 1
+    worker_args = (os.getcwd(), use_sidecar)
+
+    stages = pipeline.new_pipeline()
+    items = pipeline.add_source(stages, piece_index.list_files('.', skip = [edge_cache.SIDECAR_NAME]))
+    items = pipeline.add_map_stage(stages, read_piece, items, piece_index.DISCOVERY_THREADS)
+    items = pipeline.add_map_stage(stages, load_piece, items, num_workers, use_processes,
+                                   pair_scoring.init_worker, worker_args)
+    items = pipeline.add_stage(stages, pair_pieces, items)
+    items = pipeline.add_map_stage(stages, score_piece, items, num_workers)
+    items = pipeline.add_stage(stages, match_pieces, items, depth = JOINED_QUEUE_DEPTH)
+    items = pipeline.add_map_stage(stages, paste_run, items, num_workers, depth = JOINED_QUEUE_DEPTH)
+    items = pipeline.add_map_stage(stages, save_run, items, num_workers)
+
+    for output_name in pipeline.drain(stages, items):
+        num_joined_files += 1
 
-    match_list = [file_list[i]]     # start with the top file
 
-    offset = 0
-    j = i + 1
-    while j < len(file_list):
-        if DEBUG:
-            print(f'   starting inner loop. j = {j}, top = {file_list[i]}, bottom = {file_list[j]}')
+#########
+#   Joins the pieces in whatever order matches best (see piece_order.py).
+#   Every edge is compared with every other edge of the same width (or,
+#   with use_index, with the likely ones from edge_index.py), so out of
+#   order pieces still find their neighbors.
+#
+#   side effects
+#       num_joined_files and unjoined_file_list are updated
+#
+def join_in_best_order():
+    global num_joined_files
 
-        # dist = compare_bottom_to_top(file_list[i], file_list[j], False)
-        dist = compare_edges_with_type(file_list[i], file_list[j], HUE_MASK, offset)
-        if DEBUG:
-            print(f'      dist = {dist}')
+    edges = edge_cache.get_signature_edges(horizontal)
+    signatures = []
+    for filename in file_list:
+        if pieces[filename] == None:
+            signatures.append(None)     # not an image, don't bother
+        else:
+            signatures.append(edge_cache.get_edge_signature(filename, edges))
+    if horizontal:
+        first_edges = [None if s == None else s['right'] for s in signatures]
+        second_edges = [None if s == None else s['left'] for s in signatures]
+    else:
+        first_edges = [None if s == None else s['bottom'] for s in signatures]
+        second_edges = [None if s == None else s['top'] for s in signatures]
 
-        if dist == None:
-            # exit this inner loop; we probably encountered a non-image file or images that don't match
-            if DEBUG:
-                print(f'      Not image file or diff sizes. bottom file is {file_list[j]}, j = {j}.  Breaking..')
-            break
-        
-        if is_difference_within_tolerance(dist):
-            # This is a match!!!  Add it to our list.
-            if DEBUG:
-                print(f'      Match! adding bottom file ({file_list[j]}) to list, j = {j}')
+    if use_index:
+        chains = edge_index.find_piece_chains(first_edges, second_edges, HUE_MASK, max_shift)
+    else:
+        chains = piece_order.find_piece_chains(first_edges, second_edges, HUE_MASK, max_shift)
+
+    in_chain = set()
+    for chain in chains:
+        in_chain.update(chain)
+        if len(chain) > 1:
+            join_files([file_list[k] for k in chain])
+            num_joined_files += 1
+        else:
+            unjoined_file_list.append(file_list[chain[0]])
+            image_cache.release_image(file_list[chain[0]])
 
-            match_list.append(file_list[j])
-            i = j    # this increments the top image to be the current bottom image
-            j += 1
-            offset = 0
+    # and the ones that aren't images at all
+    for k in range(len(file_list)):
+        if k not in in_chain:
+            unjoined_file_list.append(file_list[k])
 
-        else:
-            # Didn't match.  Try again with an offset.  Of course we may be in the middle of
-            # trying again, so figure out where we are and act accordingly.
-            match offset:
-                case 0:
-                    if DEBUG:
-                        print(f'      No match. bottom file is {file_list[j]}, j = {j}.  trying with offset +1')
-                    offset = 1
-                    continue
-
-                case 1:
-                    if DEBUG:
-                        print(f'      No match again.  Trying with offset -1')
-                    offset = -1
-                    continue
-
-                case -1:
-                    if DEBUG:
-                        print(f'      No match again.  Trying with offset +2')
-                    offset = 2
-                    continue
-
-                case 2:
-                    if DEBUG:
-                        print(f'      No match again.  Trying with offset -2')
-                    offset = -2
-                    continue
-
-                case _:
-                    if DEBUG:
-                        print(f'      No match after 5 tries!  Breaking..')
-                    break   # no match, exit this inner loop
 
+#########
+#   The whole program: finds the pieces, matches them up and joins them.
+#
+#   side effects
+#       file_list and pieces are filled in
+#
+def main():
+    global file_list
+    global pieces
+
+    ########
+    #   parse command line arguments
     #
-    # if match_list is longer than 1, then we have some joining to do
-    #
-    match_list_len = len(match_list)
-    if match_list_len > 1:
+    parse_params()
+
+    if path != None:
+        os.chdir(path)
         if DEBUG:
-            print('   ...list detected, attempting to join files')
-        join_files(match_list)
-        num_joined_files += 1
+            print(f'changing directories to {path}')
+
+    elif DEBUG:
+        print('path defaulting to current directory')
 
-        # skip ahead
-        i += 1      # todo: this is redundant with below
+    if use_sidecar:
+        edge_cache.load_sidecar()
+
+    ##########
+    #   match 'em up and join 'em
+    #
+    if use_ordering:
+        ########
+        # A sorted list of all the files in the current directory (but not our
+        # own sidecar file), and the sizes of the pieces among them (from
+        # their headers--no decoding).
+        file_list, pieces = piece_index.discover_pieces('.', skip = [edge_cache.SIDECAR_NAME])
+        join_in_best_order()
 
     else:
-        if DEBUG:
-            print('   ...list not big enough, going back to outer loop')
-        unjoined_file_list.append(match_list[0])
-        i += 1
-               
-        
-
-##########
-#   wrapping up
-#
-if len(unjoined_file_list) > 0:
-    print(f'Partial success.  Joined {num_joined_files} files.')
-    print(f'But {len(unjoined_file_list)} files were orphaned:')
-    for name in unjoined_file_list:
-        print(f'   {name}')
-else:
-    print(f'Success!  Joined {num_joined_files} files with no stragglers!')
+        # (finds the files as it goes--I assume that the images are in
+        # alphabetical order)
+        join_in_file_order()
+
+
+    ##########
+    #   wrapping up
+    #
+    if use_sidecar:
+        edge_cache.save_sidecar()
+
+    if DEBUG:
+        print(f'decoded {edge_cache.num_decodes} pieces for matching')
+        print(f'{image_cache.num_hits} pieces were already decoded for joining, {image_cache.num_misses} were not')
+
+    if len(unjoined_file_list) > 0:
+        print(f'Partial success.  Joined {num_joined_files} files.')
+        print(f'But {len(unjoined_file_list)} files were orphaned:')
+        for name in unjoined_file_list:
+            print(f'   {name}')
+    else:
+        print(f'Success!  Joined {num_joined_files} files with no stragglers!')
+
+
+##############################
+#   script begin
+##############################
+
+# Only when run as a program.  The decoding workers (see pair_scoring.py)
+# may import this file again, and they mustn't start joining things too.
+if __name__ == '__main__':
+    main()
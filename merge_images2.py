@@ -14,9 +14,15 @@ import sys      # for command line arguments
 import os       # allows file access
 
 import math
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from PIL import Image
 from PIL import ImageOps
 
+import piece_index
+import image_cache
+import canvas
+import strip_writer
+
 # from image_comparator import *
 
 
@@ -28,7 +34,7 @@ USAGE = """
     merge  -- a program to try to fix munged images from bad PDF files.
 
 USAGE:
-    merge [-h] num
+    merge [-h] [-a] [-b %] [-j num] [--max-mem size] [--tiff | --png | --ppm] num
 
 Where 'num' is an integer that tells how many pieces each original image has been
 broken into.
@@ -44,12 +50,29 @@ broken into.
             So merge -aa 66 will stitch if the next file is 66% smaller than the previous
             piece (instead of only 50 percent).
 
+    -j num  Assemble this many images at once, each in its own process (0 means
+            one per CPU).  Defaults to 1.  The output is the same either way.
+
+    --max-mem size
+            The most memory to use for decoded pieces, like 2G or 512M (split
+            between the processes with -j).  Defaults to 512M.
+
+    --tiff  For giant images: save each image as a TIFF (a BigTIFF past 4 GB)
+            without ever having the whole thing in memory.  Pieces are written
+            straight into the file as they're decoded.  With -h the image is
+            built in a file on disk first (memory-mapped), so that needs as
+            much free disk space as the image takes.
+
+    --png   Like --tiff, but saves PNGs.
+
+    --ppm   Like --tiff, but saves PPMs (not compressed at all--fastest).
+
 This will work ONLY in the current directory.  Maybe later I'll deal with
 directories, but that seems unnecessary now.  But at least I'm smart enough
 to only deal with image files; all other file types will be ignored.
 
-The output files will be named 'assembled_[original_name_of_first_file]'.jpg and 
-will be placed in the same directory.  
+The output files will be named 'assembled_[original_name_of_first_file]'.jpg (.tif,
+.png or .ppm with those) and will be placed in the same directory.  
 
 """
 
@@ -70,6 +93,24 @@ ADD_PIECE_PARAM = '-a'
 # parameter
 ADD_PIECE_PERCENT_PARAM = '-b'
 
+# param to give the number of processes to assemble with (next parameter)
+WORKERS_PARAM = '-j'
+
+# param to give the memory for decoded pieces (next parameter)
+MAX_MEM_PARAM = '--max-mem'
+
+# The extension of the assembled files normally (which picks their format)
+JPEG_EXTENSION = '.jpg'
+
+# params to save the images without ever having a whole one in memory,
+# and the extensions they save as (see strip_writer.py)
+OUTPUT_FORMAT_PARAMS = {'--tiff': '.tif', '--png': '.png', '--ppm': '.ppm'}
+
+# How many groups each worker process can have waiting for it.  Every group
+# that's handed out holds the joined image (and a few of its pieces) in
+# memory, so this keeps a cap on that.
+GROUPS_IN_FLIGHT_PER_WORKER = 2
+
 
 ##############################
 #   globals
@@ -97,6 +138,20 @@ add_piece = False
 # When trying stitching (add_piece = true), this is the amount to test for the stitching condition.
 add_piece_percent = 0.5
 
+# The number of processes to assemble the images with
+num_workers = 1
+
+# The (width, height) of each piece, read from their headers
+piece_sizes = {}
+
+# When True, the images are never all in memory: they're written straight
+# to the file (see strip_writer.py) or assembled on disk (canvas.py)
+out_of_core = False
+
+# The extension of the assembled files (JPEG_EXTENSION or one from
+# OUTPUT_FORMAT_PARAMS)
+output_extension = JPEG_EXTENSION
+
 
 #########
 #
@@ -112,11 +167,21 @@ add_piece_percent = 0.5
 #
 #       num_pieces      Set to the number of pieces per image
 #
+#       num_workers     May change if WORKERS_PARAM exists
+#
+#       image_cache.max_bytes   May change if MAX_MEM_PARAM exists
+#
+#       out_of_core, output_extension   Change if one of the
+#                       OUTPUT_FORMAT_PARAMS exists
+#
 def parse_params():
     global horizontal
     global add_piece
     global add_piece_percent
     global num_pieces
+    global num_workers
+    global out_of_core
+    global output_extension
 
     # loop through all the params
     counter = 1
@@ -143,6 +208,41 @@ def parse_params():
             if DEBUG:
                 print(f'   add_piece is True, add_piece_percent = {add_piece_percent}')
 
+        elif this_param.lower() == WORKERS_PARAM:
+            counter += 1
+            try:
+                num_workers = int(sys.argv[counter])
+            except:
+                print(f'unable to parse the number of workers!')
+                exit(USAGE)
+
+            if num_workers < 0:
+                print(f'number of workers must not be negative!')
+                exit(USAGE)
+            if num_workers == 0:
+                num_workers = os.cpu_count() or 1
+            if DEBUG:
+                print(f'   num_workers = {num_workers}')
+
+        elif this_param.lower() == MAX_MEM_PARAM:
+            counter += 1
+            max_mem = None
+            if counter < len(sys.argv):
+                max_mem = image_cache.parse_memory_size(sys.argv[counter])
+
+            if max_mem == None:
+                print(f'unable to parse the memory size!')
+                exit(USAGE)
+            image_cache.max_bytes = max_mem
+            if DEBUG:
+                print(f'   max_mem = {max_mem}')
+
+        elif this_param.lower() in OUTPUT_FORMAT_PARAMS:
+            out_of_core = True
+            output_extension = OUTPUT_FORMAT_PARAMS[this_param.lower()]
+            if DEBUG:
+                print(f'   out_of_core is set to True, output_extension = {output_extension}')
+
         else:
             # Must be a number.  But have we already set the number? that ain't right.
             if num_pieces != 0:
@@ -192,7 +292,8 @@ def get_numerical_suffix(filename):
 #   Saves the given image.
 #
 #   input
-#       img             The Image file to be saved.
+#       img             The Image file (or canvas on disk--see canvas.py)
+#                       to be saved.
 #
 #       name            The name to save this as (see unique_name below).
 #
@@ -219,149 +320,313 @@ def save_image(img, name, unique_name = True):
             if unique_suffix == sys.maxsize:
                 exit('Unable to find a unique name for our file. Aborting!!!')
 
-        img.save(current_name)
-
     else:
-       img.save(name)
+        current_name = name
+
+    if not canvas.save_canvas(img, current_name):
+        exit(f'Unable to write {current_name}. Aborting!!!')
 
 
 #########
-#   Joins the files in the given list.  The list must be ordered top
-#   to bottom.
+#   Decides whether the extra piece should be added to a group.  Only
+#   needs the sizes of the pieces (from their headers), not their pixels.
 #
 #   input
-#       file_list       List of the files to join
+#       last_size       (width, height) of the last normal piece in the group.
 #
-#       optional_file   An extra file that we may add IF conditions are right.
-#                       Defaults to None (no optional file possible)
+#       extra_size      (width, height) of the extra piece.
 #
 #   returns
-#       The number of files that were joined to make our final file.  This will be
-#       either the length of file_list, or that number + 1 if we added the optional
-#       file.
+#       True iff the extra piece is small enough (see add_piece_percent).
 #
-#   side effects
-#       A new file will be created with the name {FILE_PREFIX}{output_file_count}.jpg
+def uses_extra_piece(last_size, extra_size):
+    if horizontal:
+        # check horizontal
+        return extra_size[0] < last_size[0] * add_piece_percent
+
+    #check vertical
+    return extra_size[1] < last_size[1] * add_piece_percent
+
+
+#########
+#   Returns the (width, height) of a piece.  Uses the sizes found when the
+#   directory was scanned (and reads the header if it wasn't).
 #
-def join_files(file_list, optional_file = None):
-    global output_file_count
-    global add_piece
+def get_piece_size(filename):
+    if filename not in piece_sizes:
+        image = Image.open(filename)
+        piece_sizes[filename] = image.size
+        image.close()
 
-    length = len(file_list)
-    if DEBUG:
-        print(f'join_files(): joining {length} files from {file_list[0]} to {file_list[length - 1]}')
-        print(f'join_files():    (plus possibly {optional_file})')
+    return piece_sizes[filename]
 
-    original_ordering_count = get_numerical_suffix(file_list[0])
 
-    if original_ordering:
-        print(f'join_files():    and the name will be {FILE_PREFIX}{original_ordering_count}.jpg')
-    else:
-        print(f'join_files():    and the name will be {FILE_PREFIX}{output_file_count}.jpg')
-    
-    images = []
-    for filename in file_list:
-        # open the named image
-        images.append(Image.open(filename))
+#########
+#   Finds a unique name for an output file, the same way save_image()
+#   does, but also steers clear of names that were already handed out to
+#   other groups (which may not be saved yet).
+#
+#   input
+#       name            The name we'd like.
+#
+#       claimed         Set of the names already handed out.  The name that
+#                       is returned gets added to it.
+#
+def claim_output_name(name, claimed):
+    prefix, extension = os.path.splitext(name)
 
-    # Are we going to add an optional piece?  Check to see now.
+    current_name = f'{prefix}{extension}'
+    unique_suffix = 0       # int
 
-    using_optional = False
-    if optional_file != None:
-        if DEBUG:
-            print(f'optional_file is {optional_file}')
+    # check to see if the name is used
+    while os.path.exists(current_name) or (current_name in claimed):
+        unique_suffix += 1
+        current_name = f'{prefix}_{unique_suffix}{extension}'
 
-        # compare the heights / widths to see if the optional piece
-        # meets our criteria (ie, it's less than half the size of the last piece)
-        extra_image = Image.open(optional_file)
-        if horizontal:
-            # check horizontal
-            if extra_image.width < (images[len(images) - 1].width) * add_piece_percent:
-            # if extra_image.width * 2 < images[len(images) - 1].width:   # it's less than half width
-                using_optional = True
+        # give up after maxint tries.
+        if unique_suffix == sys.maxsize:
+            exit('Unable to find a unique name for our file. Aborting!!!')
 
+    claimed.add(current_name)
+    return current_name
+
+
+#########
+#   Works out every group before anything is joined: which pieces go
+#   in it, whether the extra piece gets added and what the result will be
+#   called.  Follows the same steps that joining them one at a time would
+#   (see build_all_pieces()), but only reads the piece headers.
+#
+#   input
+#       pieces_per_image, piece_list, check_for_extra
+#                       See build_all_pieces().
+#
+#   returns
+#       A list of groups, in order.  Each is a tuple:
+#           (files_to_join, extra_file, output_name)
+#       where extra_file is None when there's no extra piece.
+#
+def plan_groups(pieces_per_image, piece_list, check_for_extra):
+    groups = []
+    claimed = set()
+
+    # for the next group of pieces to assemble, this is the index of the first one
+    group_start = 0
+
+    # repeat as long as the start is within our range
+    while group_start < len(piece_list):
+        # this is the LAST piece to process in the current image
+        group_end = min(group_start + pieces_per_image - 1, len(piece_list) - 1)
+
+        # index to where the extra piece should be
+        extra_index = group_end + 1
+
+        # create list of files to join by slicing piece_list
+        files_to_join = piece_list[group_start : group_end + 1]
+
+        # add the extra piece if check_for_extra is true AND extra_index is in bounds
+        # AND it meets our criteria (ie, it's less than half the size of the last piece)
+        extra_file = None
+        if check_for_extra and (extra_index < len(piece_list)):
+            if uses_extra_piece(get_piece_size(files_to_join[-1]), get_piece_size(piece_list[extra_index])):
+                extra_file = piece_list[extra_index]
+
+        if original_ordering:
+            output_name = f'{FILE_PREFIX}{get_numerical_suffix(files_to_join[0])}{output_extension}'
         else:
-            #check vertical
-            if extra_image.height < (images[len(images) - 1].height) * add_piece_percent:
-            # if extra_image.height * 2 < images[len(images) - 1].height:
-                using_optional = True
+            output_name = f'{FILE_PREFIX}{len(groups)}{output_extension}'
+
+        groups.append((files_to_join, extra_file, claim_output_name(output_name, claimed)))
+
+        if DEBUG:
+            print(f'plan_groups(): {files_to_join[0]} to {files_to_join[-1]} (extra = {extra_file})')
+
+        # get ready for next loop
+        group_start += len(files_to_join)
+        if extra_file != None:
+            group_start += 1
+
+    return groups
+
+
+#########
+#   Joins the files of a group and saves the result.  Everything it needs
+#   is passed in, so it can run in a worker process.
+#
+#   input
+#       file_list       List of the files to join, ordered top to bottom
+#                       (or left to right).
+#
+#       extra_file      An extra file to add at the end, or None.
+#
+#       output_name     The name to save it as.  This is used as is (see
+#                       plan_groups() for making it unique).
+#
+#       horizontal      True to stitch the pieces side by side.
+#
+#       on_disk         True to never have the whole image in memory: top
+#                       to bottom it's written straight to the file (see
+#                       stream_pieces()), side by side it's built on disk
+#                       (see canvas.py).
+#
+#   returns
+#       The number of files that were joined to make our final file.
+#
+#   side effects
+#       A new file will be created with the name output_name
+#
+def join_files(file_list, extra_file, output_name, horizontal, on_disk = False):
+    group_pieces = get_group_pieces(file_list, extra_file)
 
-    # find the width and height of the new joined image
+    # find the width and height of the new joined image (from the headers,
+    # so nothing has to be decoded yet)
     width = 0
     height = 0
-    for image in images:
+    for filename in file_list:
+        piece_width, piece_height = get_piece_size(filename)
         if horizontal:
             # height is max height; width is sum of all widths
-            if image.height > height:
-                height = image.height
-            width += image.width
+            if piece_height > height:
+                height = piece_height
+            width += piece_width
 
         else:
             # width is max width; height is sum of heights
-            if image.width > width:
-                width = image.width
-            height += image.height
+            if piece_width > width:
+                width = piece_width
+            height += piece_height
 
-    if using_optional:
+    # the extra piece only adds to the length
+    if extra_file != None:
         if horizontal:
-            print('adding optional_file extra size to width')
-            width += extra_image.width
+            width += get_piece_size(extra_file)[0]
         else:
-            print('adding optional_file extra size to height')
-            height += extra_image.height
+            height += get_piece_size(extra_file)[1]
 
+    if on_disk and not horizontal:
+        if not stream_pieces(group_pieces, len(file_list), width, height, output_name):
+            exit(f'Unable to write {output_name}. Aborting!!!')
+        return len(group_pieces)
 
     # let's make a new image and add in the contents of the other images
-    new_image = Image.new('RGB', (width, height))
+    new_image = canvas.new_canvas(width, height, on_disk)
 
     # marker for where to paste the next image
     current_place_to_paste = 0
 
-    for i in range(len(file_list)):
+    # The pieces come from the image cache a few at a time and are let go
+    # of as soon as they're pasted (see image_cache.py), so a huge group
+    # never has all its pieces decoded at once.  They belong to the cache,
+    # so no closing them.
+    i = 0
+    for image in image_cache.take_images(group_pieces):
         if horizontal:
-            if DEBUG:
-                print(f'i = {i}, current_place_to_paste = {current_place_to_paste}')
-            height_adjustment = int((height - images[i].height) / 2)    # center
-            new_image.paste(images[i], (current_place_to_paste, height_adjustment))
-            current_place_to_paste += images[i].width
+            height_adjustment = int((height - image.height) / 2)    # center
+            canvas.paste_image(new_image, image, (current_place_to_paste, height_adjustment))
+            current_place_to_paste += image.width
 
         else:
-            width_adjustment = int((width - images[i].width) / 2)   # center
-            new_image.paste(images[i], (width_adjustment, current_place_to_paste))
-            current_place_to_paste += images[i].height
+            # (the extra piece lines up with the last normal piece)
+            if i < len(file_list):
+                width_adjustment = int((width - image.width) / 2)   # center
+            canvas.paste_image(new_image, image, (width_adjustment, current_place_to_paste))
+            current_place_to_paste += image.height
+        i += 1
 
-    if using_optional:
-        if horizontal:
-            height_adjustment = int((height - extra_image.height) / 2)    # center
-            new_image.paste(extra_image, (current_place_to_paste, height_adjustment))
-        else:
-            new_image.paste(extra_image, (width_adjustment, current_place_to_paste))
+    # and save the result
+    save_image(new_image, output_name, unique_name = False)
 
+    # don't forget to close this image
+    canvas.close_canvas(new_image)
 
-    # and save the result
-    if original_ordering:
-        save_image(new_image, f'{FILE_PREFIX}{original_ordering_count}.jpg')
-    else:
-        save_image(new_image, f'{FILE_PREFIX}{output_file_count}.jpg')
+    # return number of images merged
+    return len(group_pieces)
 
-    output_file_count += 1
 
-    # don't forget to close these images
-    new_image.close()
-    for image in images:
-        image.close()
-    if using_optional:
-        extra_image.close()
+#########
+#   Writes the pieces of a group (top to bottom) straight into a new image
+#   file, one after the other as they're decoded, so the assembled image
+#   is never in memory--just the piece being written and the few being
+#   decoded in the background (see image_cache.py) while it is.  Every
+#   piece is let go of as soon as it's written.  They're centered just
+#   like join_files() does it.
+#
+#   input
+#       group_pieces    All the pieces, in order (see get_group_pieces()).
+#
+#       num_normal      How many of them aren't the extra piece.
+#
+#       width, height   The size of the assembled image.
+#
+#   returns
+#       True if the file was written.
+#
+def stream_pieces(group_pieces, num_normal, width, height, output_name):
+    writer = strip_writer.open_writer(output_name, width, height)
+    if writer == None:
+        return False
+
+    i = 0
+    for image in image_cache.take_images(group_pieces):
+        # (the extra piece lines up with the last normal piece)
+        if i < num_normal:
+            width_adjustment = int((width - image.width) / 2)   # center
+        strip_writer.write_image(writer, image, width_adjustment)
+        i += 1
+    strip_writer.close_writer(writer)
+
+    return True
+
+
+#########
+#   Returns all the pieces of a group (the extra piece too, if there is
+#   one), in order.
+#
+def get_group_pieces(file_list, extra_file):
+    if extra_file == None:
+        return list(file_list)
+
+    return list(file_list) + [extra_file]
+
+
+#########
+#   Sets up a worker process.  The workers share the image cache's budget.
+#
+def init_worker(max_cache_bytes):
+    image_cache.max_bytes = max_cache_bytes
+
+
+#########
+#   Joins the groups in a pool of worker processes.  Only a few groups
+#   are handed out at a time (each one that's being worked on holds the
+#   joined image in memory), and a new one goes out as each finishes.
+#
+#   input
+#       groups          From plan_groups().
+#
+#       workers         The number of processes.
+#
+#       max_in_flight   The most groups that can be handed out at once.
+#
+def join_groups_in_parallel(groups, workers, max_in_flight):
+    next_group = 0
+    in_flight = set()
+
+    with ProcessPoolExecutor(max_workers = workers, initializer = init_worker,
+                             initargs = (image_cache.max_bytes // workers,)) as executor:
+        while (next_group < len(groups)) or (len(in_flight) > 0):
+            # top up
+            while (next_group < len(groups)) and (len(in_flight) < max_in_flight):
+                files_to_join, extra_file, output_name = groups[next_group]
+                print(f'join_files():    and the name will be {output_name}')
+                in_flight.add(executor.submit(join_files, files_to_join, extra_file, output_name, horizontal,
+                                              out_of_core))
+                next_group += 1
+
+            done, in_flight = wait(in_flight, return_when = FIRST_COMPLETED)
+            for future in done:
+                future.result()     # let any errors through
 
-    # return number of images merged
-    if using_optional:
-        if DEBUG:
-            print(f'returning {length + 1}')
-        return length + 1
-    else:
-        if DEBUG:
-            print(f'returning {length}')
-        return length
 
 #########
 #   The main loop: goes through all the pieces, assembling them
@@ -390,113 +655,80 @@ def join_files(file_list, optional_file = None):
 #                   is less than half the size of the last piece in a group, it will
 #                   be considered part of the image.
 #
+#   The groups are all worked out first (see plan_groups()), then joined,
+#   either one at a time or by num_workers processes.
 #
 #   preconditions
 #       parameters have been properly parsed
 #
+#   returns
+#       The number of images assembled.
 #
 def build_all_pieces(pieces_per_image, piece_list, check_for_extra):
-    # number of files that we have completely processed
-    num_completed = 0
-
-    # for the next group of pieces to assemble, this is the index of the first one
-    group_start = 0
-
-    # this is the LAST piece to process in the current image
-    group_end = group_start + pieces_per_image - 1
-
-    # check to make sure this is not out of bounds
-    if group_end > len(piece_list) - 1:
-        group_end = len(piece_list) - 1
-
-    # index to where the extra piece should be
-    extra_index = group_end + 1
+    groups = plan_groups(pieces_per_image, piece_list, check_for_extra)
 
     if DEBUG:
         print('build_all_pieces() start:')
         print(f'   pieces_per_image = {pieces_per_image}, piece_list length = {len(piece_list)}')
-        print(f'   group_start = {group_start}, group_end = {group_end}, extra_index = {extra_index}')
-        print(f'   num_completed = {num_completed}')
+        print(f'   {len(groups)} groups, num_workers = {num_workers}')
 
-    # repeat as long as the start is within our range
-    while group_start < len(piece_list):
-        if DEBUG:
-            print('   - build_all_pieces() main:')
-            print(f'      group_start = {group_start}, group_end = {group_end}, extra_index = {extra_index}')
-            print(f'      num_completed = {num_completed}')
-
-        # create list of files to join by slicing piece_list
-        files_to_join = piece_list[group_start : group_end + 1]
-
-        num_pieces_joined = 0
-
-        # add the extra index if check_for_extra is true AND extra_index is in bounds
-        if check_for_extra and (extra_index < len(piece_list)):
-            num_pieces_joined = join_files(files_to_join, piece_list[extra_index])
-
-        else:
-            # just a regular join
-            num_pieces_joined = join_files(files_to_join)
+    if num_workers > 1:
+        join_groups_in_parallel(groups, num_workers, num_workers * GROUPS_IN_FLIGHT_PER_WORKER)
 
-        if DEBUG:
-            print(f'      -> joined {num_pieces_joined} files')
-        num_completed += 1
-
-        # get ready for next loop
-        group_start += num_pieces_joined
-        group_end = group_start + pieces_per_image - 1
+    else:
+        for k in range(len(groups)):
+            files_to_join, extra_file, output_name = groups[k]
 
-        # check to make sure this is not out of bounds
-        if group_end > len(piece_list) - 1:
-            group_end = len(piece_list) - 1
+            # start decoding the next group's first pieces while this one
+            # is joined and saved
+            if k + 1 < len(groups):
+                next_pieces = get_group_pieces(groups[k + 1][0], groups[k + 1][1])
+                image_cache.prefetch(next_pieces[:image_cache.PREFETCH_COUNT])
 
-        extra_index = group_end + 1
+            print(f'join_files():    and the name will be {output_name}')
+            num_pieces_joined = join_files(files_to_join, extra_file, output_name, horizontal, out_of_core)
+            if DEBUG:
+                print(f'      -> joined {num_pieces_joined} files')
 
-    return num_completed
+    return len(groups)
 
 
 ##############################
 #   script begin (main)
 ##############################
 
-print('merge is starting...')
-
-parse_params()
+def main():
+    global num_joined_files
 
-########
-# A list of all the files in the current directory
-# in an array (or list?) of strings.
-temp_file_list = os.listdir()
-file_list = []
+    print('merge is starting...')
 
+    parse_params()
 
-# Strip out the directories and non-image files
-# if DEBUG:
-#     print(f'stripping out directories and non-image files:')
-for f in temp_file_list:
-    if os.path.isfile(f):
-        try:
-            image = Image.open(f)
+    ########
+    # A list of all the image files in the current directory, sorted (I
+    # assume that the images are in alphabetical order).  Only their
+    # headers are read, and their sizes are kept for later.
+    temp_file_list, index = piece_index.discover_pieces('.')
+    file_list = []
 
-            # success! close it and add the filename to our list
-            image.close()
+    # Strip out the non-image files
+    for f in temp_file_list:
+        if index[f] != None:
+            piece_sizes[f] = index[f][:2]
             file_list.append(f)
 
-        except:
-            if DEBUG:
-                print(f'   discarding {f}')
+        elif DEBUG:
+            print(f'   discarding {f}')
 
-    
-# sort the list (I assume that the images are in alphabetical order)
-file_list.sort()
 
+    # this is the big call
+    num_joined_files = build_all_pieces(num_pieces, file_list, add_piece)
 
-# this is the big call
-num_joined_files = build_all_pieces(num_pieces, file_list, add_piece)
-
-##########
-#   wrapping up
-#
-print(f'Success!  Joined {num_joined_files} files.')
+    ##########
+    #   wrapping up
+    #
+    print(f'Success!  Joined {num_joined_files} files.')
 
 
+if __name__ == '__main__':
+    main()
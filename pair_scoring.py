@@ -0,0 +1,67 @@
+#   Scores the seams between pairs of pieces.
+#
+#   merge_images scores each seam in the score stage of its pipeline
+#   (see join_in_file_order()), with score_edges() on a pool of threads.
+#   The decode stage before it can run in worker processes; init_worker()
+#   sets those up.  Each worker decodes the edges it's given (through its
+#   own edge_cache) and hands back the signatures it decoded, so that
+#   they still end up in the sidecar.
+#
+
+import os
+
+import edge_cache
+import image_cache
+from image_comparator import HUE_MASK, is_difference_within_tolerance
+from image_comparator import compare_rows_pyramid, find_matching_offset
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+
+####################
+#   Scores one seam between two edges, the way merge_images does it.
+#
+#   params
+#       edge1, edge2    From edge_cache.get_seam_edges().
+#
+#       compare_type, max_shift
+#
+#       use_pyramid     Match coarse to fine (see compare_rows_pyramid()).
+#
+#       use_sampling    Only look at a sample of the seam (see
+#                       compare_rows_sampled()).  Otherwise the comparison
+#                       stops as soon as the answer is known (see
+#                       compare_rows_bounded()).
+#
+#   returns
+#       (matched, distance, offset)
+#       (None, None, None) if the edges can't be compared.
+#
+def score_edges(edge1, edge2, compare_type = HUE_MASK, max_shift = 0, use_pyramid = False, use_sampling = False):
+    if use_pyramid:
+        result = compare_rows_pyramid(edge1, edge2, compare_type, max_shift)
+        if result == None:
+            return (None, None, None)
+
+        distance, offset = result
+        return (is_difference_within_tolerance(distance), distance, offset)
+
+    return find_matching_offset(edge1, edge2, compare_type, max_shift, sample = use_sampling)
+
+
+####################
+#   Sets up a worker process for the decode stage: reads the sidecar (so
+#   the worker doesn't decode what's already in there).  The workers
+#   don't keep the images they decode--they never paste them, and the
+#   main process has its own copy of the image cache for that.
+#
+def init_worker(directory, use_sidecar):
+    os.chdir(directory)
+    image_cache.max_bytes = 0
+    if use_sidecar:
+        edge_cache.load_sidecar()
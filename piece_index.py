@@ -0,0 +1,181 @@
+#   Keeps the size and mode of every piece, read from the file headers
+#   only (Image.open() doesn't decode any pixels until it has to).
+#
+#   With this around, pieces that can't possibly go together (different
+#   widths, or heights for side by side pieces) are ruled out before any
+#   of their pixels are touched.
+#
+#   It's also where the pieces are found in the first place.  Listing a
+#   big directory and trying Image.open() on everything in it, one after
+#   the other, is slow (especially over a network), so discover_pieces():
+#
+#       1.  Lists the directory with os.scandir() (no stat() per file).
+#
+#       2.  Reads the first few bytes of each file and checks them against
+#           the magic numbers of the common image formats, so most files
+#           don't have to be shown to every Pillow plugin in turn.
+#
+#       3.  Has Pillow read just the header (only the format that was
+#           sniffed) for the size, mode and EXIF orientation.  Files that
+#           don't match any of the magic numbers (TGA, ICO, PCX, ...) are
+#           still handed to Image.open(), which tries all its plugins.
+#
+#   Steps 2 and 3 are almost all waiting on the disk, so they're done by a
+#   pool of threads.
+#
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+import edge_cache
+from edge_strips import get_image_orientation
+
+
+####################
+#   constants
+####################
+
+# How many bytes to read to recognize a file
+SNIFF_SIZE = 16
+
+# Magic numbers of the common image formats: (offset, bytes, Pillow format).
+# Checked in order.  (Anything else goes through all of Pillow's plugins.)
+IMAGE_MAGIC = (
+    (0, b'\xff\xd8\xff', 'JPEG'),
+    (0, b'\x89PNG\r\n\x1a\n', 'PNG'),
+    (0, b'GIF87a', 'GIF'),
+    (0, b'GIF89a', 'GIF'),
+    (0, b'II*\x00', 'TIFF'),
+    (0, b'MM\x00*', 'TIFF'),
+    (0, b'II+\x00', 'TIFF'),          # BigTIFF
+    (0, b'MM\x00+', 'TIFF'),
+    (8, b'WEBP', 'WEBP'),              # (after 'RIFF' and a length)
+    (0, b'BM', 'BMP'),
+    (0, b'\x00\x00\x00\x0cjP  \r\n\x87\n', 'JPEG2000'),
+    (0, b'\xff\x4f\xff\x51', 'JPEG2000'),
+    (0, b'P1', 'PPM'),
+    (0, b'P2', 'PPM'),
+    (0, b'P3', 'PPM'),
+    (0, b'P4', 'PPM'),
+    (0, b'P5', 'PPM'),
+    (0, b'P6', 'PPM'),
+)
+
+# Number of threads reading headers
+DISCOVERY_THREADS = 16
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+
+####################
+#   Works out the format of a file from its first few bytes.
+#
+#   returns
+#       The Pillow format name, or None if it's not one of IMAGE_MAGIC
+#       (which doesn't mean it isn't an image).
+#
+def sniff_image_format(start):
+    for offset, magic, image_format in IMAGE_MAGIC:
+        if start[offset:offset + len(magic)] == magic:
+            return image_format
+
+
+####################
+#   Reads the size, mode and orientation of an image from its header.
+#   If the edge sidecar already knows about the file, it doesn't even get
+#   opened.
+#
+#   returns
+#       (width, height, mode, orientation), or None if this isn't an image
+#       file.  The size is the size of the pixels as stored (before any
+#       EXIF orientation).
+#
+def read_piece_header(filename):
+    key = edge_cache.get_file_key(filename)
+    if key == None:
+        return
+
+    signature = edge_cache.find_sidecar_signature(key, ())
+    if signature != None:
+        return (signature['width'], signature['height'], signature['mode'], signature['orientation'])
+
+    try:
+        with open(filename, 'rb') as file:
+            image_format = sniff_image_format(file.read(SNIFF_SIZE))
+
+            # (no magic number means asking every plugin)
+            formats = None
+            if image_format != None:
+                formats = [image_format]
+
+            file.seek(0)
+            image = Image.open(file, formats = formats)
+            header = (image.width, image.height, image.mode, get_image_orientation(image))
+            image.close()
+    except:
+        if debug:
+            print(f'read_piece_header() {filename} is not an image file')
+        return
+
+    return header
+
+
+####################
+#   Lists the files (not directories) in a directory.
+#
+#   params
+#       skip            Names of files to leave out (like the sidecar).
+#
+#   returns
+#       Sorted list of their names.
+#
+def list_files(directory = '.', skip = ()):
+    file_list = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and (entry.name not in skip):
+                file_list.append(entry.name)
+
+    file_list.sort()
+    return file_list
+
+
+####################
+#   Finds all the files in a directory and reads the headers of the
+#   images among them (see the top of this file).
+#
+#   params
+#       directory       Where to look.
+#
+#       skip            Names of files to leave out (like the sidecar).
+#
+#       threads         Number of threads reading headers.
+#
+#   returns
+#       (file_list, index)
+#           file_list   Sorted list of the names of all the files.
+#           index       Dictionary: name -> (width, height, mode,
+#                       orientation), or None for the files that aren't
+#                       images.
+#
+def discover_pieces(directory = '.', skip = (), threads = DISCOVERY_THREADS):
+    file_list = list_files(directory, skip)
+
+    paths = [os.path.join(directory, name) for name in file_list]
+    with ThreadPoolExecutor(max_workers = threads) as executor:
+        headers = list(executor.map(read_piece_header, paths))
+
+    index = dict(zip(file_list, headers))
+
+    if debug:
+        images = len([f for f in index if index[f] != None])
+        print(f'discover_pieces() {images} of {len(file_list)} files in {directory} are images')
+
+    return (file_list, index)
@@ -0,0 +1,363 @@
+#   Works out which pieces go together (and in what order) by looking at
+#   all of them at once instead of just the next file in the list.
+#
+#   merge_images normally assumes that the files are already in order and
+#   only ever compares a piece with the one after it.  That's fast, but a
+#   piece that's out of order gets orphaned and one bad seam splits an
+#   image in two.  Here every bottom edge is compared with every top edge
+#   (of the same width) and the best set of chains is picked:
+#
+#       1.  Costs.  The cost of putting piece j under piece i is the
+#           distance between i's bottom edge and j's top edge (best
+#           offset).  Matrix products and a few averages give a lower
+#           bound for every pair (see find_row_distance_bounds()); only
+#           the pairs that might be under the tolerance are compared for
+#           real (see compare_row_to_many()).
+#
+#       2.  Links.  Each piece gets at most one piece below it and at most
+#           one above it, and the total cost is as small as possible.  This
+#           is an assignment problem: every piece is matched with either a
+#           piece to go under it or with "nothing" (which costs TOLERANCE,
+#           so any link under the tolerance beats no link at all).  Only
+#           the links under the tolerance matter, so the pieces are split
+#           into groups that have links between them and each group is
+#           solved on its own.  Uses SciPy if it's installed, otherwise
+#           (and for groups bigger than ASSIGNMENT_LIMIT, which would take
+#           too long) takes the cheapest links first.
+#
+#       3.  Chains.  Following the links gives the chains, top to bottom.
+#           An assignment can make loops (a -> b -> a); those are broken at
+#           their most expensive link.
+#
+
+import numpy as np
+
+from image_comparator import TOLERANCE, HUE_MASK, ROW_BOUND_ROUNDING
+from image_comparator import get_compare_channels, get_max_pixel_distance
+from image_comparator import get_row_summaries, find_row_distance_bounds, find_segment_bounds
+from image_comparator import find_row_distance_blocks, compare_row_to_many, stack_edges_by_width
+
+# SciPy is optional--without it the links are picked greedily.
+try:
+    from scipy.optimize import linear_sum_assignment
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+except ImportError:
+    linear_sum_assignment = None
+
+
+####################
+#   constants
+####################
+
+# The most pieces (with links between them) solved as one assignment
+# problem.  That takes time growing with the cube of the number of
+# pieces; past this the links are picked greedily instead.
+ASSIGNMENT_LIMIT = 1000
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+
+####################
+#   Finds the cost of every seam between a stack of bottom edges and a
+#   stack of top edges (all the same width).
+#
+#   params
+#       bottoms     Bottom edges of the pieces, (n, width, channels).
+#
+#       tops        Top edges of the same pieces, in the same order.
+#
+#       compare_type, max_shift     See compare_rows_with_offsets().
+#
+#       tolerance   Pairs that can't possibly be under this aren't
+#                   compared for real.
+#
+#   returns
+#       (costs, offsets)
+#           costs       Array (n, n).  costs[i, j] is the distance when
+#                       piece j goes under piece i, inf when it's known to
+#                       be at least the tolerance (and on the diagonal).
+#           offsets     Array (n, n) of the best offsets for those.
+#
+def build_cost_matrix(bottoms, tops, compare_type = HUE_MASK, max_shift = 0, tolerance = TOLERANCE):
+    count, width = bottoms.shape[0], bottoms.shape[1]
+    channels = get_compare_channels(compare_type)
+    max_distance = max(get_max_pixel_distance(bottoms, channels), get_max_pixel_distance(tops, channels))
+
+    # The distance at an offset is the average over the pixels that
+    # overlap, so each offset gets its own bound (see
+    # find_row_distance_bounds()) and a pair's bound is the smallest.  The
+    # segment bounds take too long for every pair, so they're only worked
+    # out for the pairs that get past the others.
+    lower_bounds = np.full((count, count), np.inf)
+    offset_summaries = []
+    for offset in range(-max_shift, max_shift + 1):
+        start = max(0, -offset)
+        end = min(width, width - offset)
+        if end <= start:
+            continue
+
+        bottom_pixels = bottoms[:, start:end]
+        top_pixels = tops[:, start + offset:end + offset]
+        bottom_summaries = get_row_summaries(bottom_pixels, compare_type)
+        top_summaries = get_row_summaries(top_pixels, compare_type)
+        offset_summaries.append((bottom_summaries, top_summaries))
+        for start1, start2, block in find_row_distance_blocks(bottom_pixels, top_pixels, compare_type):
+            bounds = find_row_distance_bounds(bottom_summaries, top_summaries, start1, start2, block, max_distance,
+                                              use_segments = False)
+            view = lower_bounds[start1:start1 + len(block), start2:start2 + block.shape[1]]
+            np.minimum(view, bounds, out = view)
+
+    np.fill_diagonal(lower_bounds, np.inf)
+
+    rows, columns = np.nonzero(lower_bounds < tolerance)
+    segment_bounds = np.full(len(rows), np.inf)
+    for bottom_summaries, top_summaries in offset_summaries:
+        np.minimum(segment_bounds, find_segment_bounds(bottom_summaries['segment_means'][rows],
+                                                       top_summaries['segment_means'][columns],
+                                                       bottom_summaries['segment_sizes']), out = segment_bounds)
+    lower_bounds[rows, columns] = np.maximum(lower_bounds[rows, columns], segment_bounds * (1.0 - ROW_BOUND_ROUNDING))
+
+    costs = np.full((count, count), np.inf)
+    offsets = np.zeros((count, count), dtype = np.int64)
+    for i in range(count):
+        candidates = np.nonzero(lower_bounds[i] < tolerance)[0]
+        if len(candidates) == 0:
+            continue
+
+        distances, best_offsets = compare_row_to_many(bottoms[i], tops[candidates], compare_type, max_shift)
+        keep = distances < tolerance
+        costs[i, candidates[keep]] = distances[keep]
+        offsets[i, candidates[keep]] = best_offsets[keep]
+
+    if debug:
+        print(f'build_cost_matrix() {count} pieces, {np.count_nonzero(lower_bounds < tolerance)} pairs compared, '
+              f'{np.count_nonzero(np.isfinite(costs))} under the tolerance')
+
+    return (costs, offsets)
+
+
+####################
+#   Picks the links with the assignment solver.  Only the links under the
+#   tolerance can be picked, so the pieces are split into groups joined
+#   by those links (as the piece above or the piece below) and each group
+#   is solved on its own.  Groups bigger than ASSIGNMENT_LIMIT are
+#   linked greedily instead (see solve_sparse_links_greedily()).
+#
+#   returns
+#       Array (n): the piece that goes under each piece, -1 for none.
+#
+def solve_links_with_assignment(costs, tolerance):
+    count = len(costs)
+    below = np.full(count, -1, dtype = np.int64)
+
+    link_rows, link_columns = np.nonzero(np.isfinite(costs))
+    if len(link_rows) == 0:
+        return below
+
+    # Piece i as the one above is node i, piece j as the one below is node
+    # count + j.
+    graph = coo_matrix((np.ones(len(link_rows)), (link_rows, count + link_columns)), shape = (2 * count, 2 * count))
+    num_groups, groups = connected_components(graph, directed = False)
+    link_groups = groups[link_rows]
+
+    impossible = 2.0 * tolerance + 1.0
+    for group in np.unique(link_groups):
+        in_group = link_groups == group
+        rows, columns = link_rows[in_group], link_columns[in_group]
+        uppers, upper_numbers = np.unique(rows, return_inverse = True)
+        lowers, lower_numbers = np.unique(columns, return_inverse = True)
+
+        if max(len(uppers), len(lowers)) > ASSIGNMENT_LIMIT:
+            if debug:
+                print(f'solve_links_with_assignment() {len(uppers)} pieces linked together, picking links greedily')
+            group_below = solve_sparse_links_greedily(count, rows, columns, costs[rows, columns])
+            below[uppers] = group_below[uppers]
+            continue
+
+        # Rows are the pieces above, the first columns are the pieces that
+        # could go under them and the rest are "nothing".  Each row has its
+        # own "nothing" so that everything can always be assigned.
+        matrix = np.full((len(uppers), len(lowers) + len(uppers)), impossible)
+        matrix[upper_numbers, lower_numbers] = costs[rows, columns]
+        matrix[np.arange(len(uppers)), len(lowers) + np.arange(len(uppers))] = tolerance
+
+        for i, j in zip(*linear_sum_assignment(matrix)):
+            if (j < len(lowers)) and np.isfinite(costs[uppers[i], lowers[j]]):
+                below[uppers[i]] = lowers[j]
+
+    return below
+
+
+####################
+#   Picks the links greedily: cheapest first, skipping any that would
+#   give a piece a second neighbor or close a loop.
+#
+#   returns
+#       Array (n): the piece that goes under each piece, -1 for none.
+#
+def solve_links_greedily(costs):
+    rows, columns = np.nonzero(np.isfinite(costs))
+    return solve_sparse_links_greedily(len(costs), rows, columns, costs[rows, columns])
+
+
+####################
+#   Same as solve_links_greedily(), but for when only some of the
+#   possible links are known (too many pieces for a full cost matrix).
+#
+#   params
+#       count       The number of pieces.
+#
+#       rows, columns, link_costs   Arrays: piece columns[k] can go under
+#                   piece rows[k] at a cost of link_costs[k].
+#
+#   returns
+#       Array (count): the piece that goes under each piece, -1 for none.
+#
+def solve_sparse_links_greedily(count, rows, columns, link_costs):
+    below = np.full(count, -1, dtype = np.int64)
+    has_above = np.zeros(count, dtype = bool)
+
+    # chain_top[k] leads to the top of k's chain (union-find style)
+    chain_top = list(range(count))
+
+    def find_top(k):
+        while chain_top[k] != k:
+            chain_top[k] = chain_top[chain_top[k]]
+            k = chain_top[k]
+        return k
+
+    order = np.argsort(link_costs, kind = 'stable')
+    for k in order:
+        i, j = int(rows[k]), int(columns[k])
+        if (below[i] != -1) or has_above[j]:
+            continue
+        if find_top(i) == find_top(j):
+            continue        # would make a loop
+
+        below[i] = j
+        has_above[j] = True
+        chain_top[find_top(j)] = find_top(i)
+
+    return below
+
+
+####################
+#   Turns the links into chains, breaking any loops at their most
+#   expensive link.
+#
+#   params
+#       below       The piece under each piece, -1 for none.
+#
+#       costs       The cost matrix (anything that can be looked up with
+#                   costs[i, j], so a dictionary keyed by (i, j) works too).
+#
+#   returns
+#       List of chains (lists of piece numbers, top to bottom), in the order
+#       of their top pieces.  Pieces with no links are chains of one.
+#
+def follow_links(below, costs):
+    count = len(below)
+    below = below.copy()
+
+    # break the loops: a loop is a set of links where nobody is on top
+    visited = np.zeros(count, dtype = bool)
+    for start in range(count):
+        if visited[start]:
+            continue
+
+        path = []
+        k = start
+        while (k != -1) and not visited[k]:
+            visited[k] = True
+            path.append(k)
+            k = below[k]
+
+        if (k != -1) and (k in path):
+            loop = path[path.index(k):]
+            worst = max(loop, key = lambda p: costs[p, below[p]])
+            if debug:
+                print(f'follow_links() breaking a loop of {len(loop)} pieces after piece {worst}')
+            below[worst] = -1
+
+    has_above = np.zeros(count, dtype = bool)
+    has_above[below[below != -1]] = True
+
+    chains = []
+    for top in range(count):
+        if has_above[top]:
+            continue
+
+        chain = [top]
+        while below[chain[-1]] != -1:
+            chain.append(int(below[chain[-1]]))
+        chains.append(chain)
+
+    return chains
+
+
+####################
+#   Finds the best chains for a set of pieces that are all the same width.
+#
+#   params
+#       bottoms, tops           See build_cost_matrix().
+#
+#       compare_type, max_shift, tolerance
+#
+#   returns
+#       List of chains (see follow_links()).  Numbers are positions in
+#       bottoms/tops.
+#
+def order_pieces(bottoms, tops, compare_type = HUE_MASK, max_shift = 0, tolerance = TOLERANCE):
+    costs, offsets = build_cost_matrix(bottoms, tops, compare_type, max_shift, tolerance)
+
+    if linear_sum_assignment != None:
+        below = solve_links_with_assignment(costs, tolerance)
+    else:
+        if debug:
+            print('order_pieces() SciPy not found, picking links greedily')
+        below = solve_links_greedily(costs)
+
+    return follow_links(below, costs)
+
+
+####################
+#   Finds the chains for a whole list of pieces.  The pieces are sorted
+#   into buckets by width (only pieces of the same width can go together)
+#   and each bucket is ordered on its own.
+#
+#   params
+#       bottoms, tops   Lists of the bottom and top edges of each piece,
+#                       (width, channels) arrays.  None for the files that
+#                       aren't images.  (For pieces that go side by side,
+#                       give the right and left edges instead.)
+#
+#   returns
+#       List of chains, each a list of indices into the given lists, top to
+#       bottom.  Sorted by their top piece.  Non-images aren't in any chain.
+#
+def find_piece_chains(bottoms, tops, compare_type = HUE_MASK, max_shift = 0, tolerance = TOLERANCE):
+    chains = []
+    bottom_stacks = stack_edges_by_width(bottoms)
+    top_stacks = stack_edges_by_width(tops)
+    for shape in bottom_stacks:
+        indices, bottom_stack = bottom_stacks[shape]
+        top_indices, top_stack = top_stacks.get(shape, (None, None))
+        if (top_indices is None) or not np.array_equal(indices, top_indices):
+            # every piece's edges come in pairs, so this shouldn't happen
+            print(f'find_piece_chains() top and bottom edges of size {shape} do not match up, skipping them')
+            continue
+
+        if debug:
+            print(f'find_piece_chains() ordering {len(indices)} pieces of size {shape}')
+
+        for chain in order_pieces(bottom_stack, top_stack, compare_type, max_shift, tolerance):
+            chains.append([int(indices[k]) for k in chain])
+
+    chains.sort()
+    return chains
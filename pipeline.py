@@ -0,0 +1,290 @@
+#   Runs a job as a chain of stages with bounded queues between them, so
+#   that the stages overlap: while one piece is being decoded, the one
+#   before it is being compared and an earlier image is being JPEG-encoded.
+#
+#   Each stage has its own thread (and, for map stages, its own pool of
+#   threads or processes).  A stage takes items from the queue before it
+#   and puts its results on the queue after it.  The queues only hold so
+#   many items, so a fast stage just waits for a slow one to catch up and
+#   the memory used never grows past what the queues (and the items in
+#   the pools) can hold.
+#
+#       stages = new_pipeline()
+#       queue = add_source(stages, filenames)
+#       queue = add_map_stage(stages, decode, queue, workers = 4)
+#       queue = add_stage(stages, match_them_up, queue)
+#       for result in drain(stages, queue):
+#           ...
+#
+#   Map stages keep their items in order.  If any stage raises, everything
+#   stops and drain() raises the same exception (Ctrl-C too).
+#
+
+import multiprocessing
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+####################
+#   constants
+####################
+
+# Default number of items each queue holds
+QUEUE_DEPTH = 16
+
+# How long (in seconds) a waiting stage sleeps before checking whether
+# the pipeline has been stopped
+POLL_INTERVAL = 0.1
+
+# Put on a queue after the last item
+END_OF_ITEMS = ('end of items',)
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+
+####################
+#   Raised inside a stage when some other stage has failed.
+#
+class PipelineStopped(Exception):
+    pass
+
+
+####################
+#   Makes a new, empty pipeline.
+#
+#   params
+#       depth           How many items each queue holds (unless a stage
+#                       says otherwise).
+#
+#   returns
+#       The pipeline (a dictionary):
+#           'depth'     See above.
+#           'threads'   The stages' threads.
+#           'stopped'   Event that's set when it has to stop.
+#           'error'     The exception that stopped it, if any.
+#
+def new_pipeline(depth = QUEUE_DEPTH):
+    return {
+        'depth': depth,
+        'threads': [],
+        'stopped': threading.Event(),
+        'error': None,
+    }
+
+
+####################
+#   Puts an item on a queue, waiting for room.
+#
+#   raises
+#       PipelineStopped if the pipeline stops while waiting.
+#
+def put_item(stages, items, item):
+    while True:
+        if stages['stopped'].is_set():
+            raise PipelineStopped()
+        try:
+            items.put(item, timeout = POLL_INTERVAL)
+            return
+        except queue.Full:
+            pass
+
+
+####################
+#   Goes through the items on a queue (up to END_OF_ITEMS).
+#
+#   raises
+#       PipelineStopped if the pipeline stops while waiting.
+#
+def get_items(stages, items):
+    while True:
+        if stages['stopped'].is_set():
+            raise PipelineStopped()
+        try:
+            item = items.get(timeout = POLL_INTERVAL)
+        except queue.Empty:
+            continue
+
+        if item is END_OF_ITEMS:
+            return
+        yield item
+
+
+####################
+#   Stops everything.  The first error is the one that's kept.
+#
+def stop_pipeline(stages, error = None):
+    if (error != None) and (stages['error'] == None):
+        stages['error'] = error
+    stages['stopped'].set()
+
+
+####################
+#   Starts a thread that runs a stage, and makes the queue it puts its
+#   results on.
+#
+#   params
+#       run             Function (no params) that does the stage's work
+#                       (putting its results on output).
+#
+#   returns
+#       The output queue.
+#
+def start_stage(stages, name, run, output):
+    def run_stage():
+        try:
+            run()
+            put_item(stages, output, END_OF_ITEMS)
+        except PipelineStopped:
+            pass
+        except BaseException as e:
+            if debug:
+                print(f'pipeline stage {name} failed: {e!r}')
+            stop_pipeline(stages, e)
+
+    thread = threading.Thread(target = run_stage, name = name, daemon = True)
+    stages['threads'].append(thread)
+    thread.start()
+    return output
+
+
+####################
+#   Adds the first stage: just hands out the given items.
+#
+#   returns
+#       The queue the items go on.
+#
+def add_source(stages, items, depth = None):
+    output = queue.Queue(depth or stages['depth'])
+
+    def run():
+        for item in items:
+            put_item(stages, output, item)
+
+    return start_stage(stages, 'source', run, output)
+
+
+####################
+#   Returns the way to start worker processes.  The other stages' threads
+#   are busy by then, and a plain fork() copies whatever locks they happen
+#   to hold (an import half done, say) into the worker, where nobody will
+#   ever let go of them.  So the workers are forked from a clean server
+#   process instead (or started from scratch where there's no such thing).
+#
+def get_process_context():
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+
+    return multiprocessing.get_context('spawn')
+
+
+####################
+#   Adds a stage that runs a function on every item, in a pool of threads
+#   or processes.  The results come out in the same order as the items
+#   went in.  At most twice as many items as there are workers are in the
+#   pool at once.
+#
+#   params
+#       function        Called with each item, returns the result.  For
+#                       processes it has to be picklable (a plain
+#                       module-level function) and so do the items.
+#
+#       source          The queue the items come from.
+#
+#       workers         How many threads (or processes).
+#
+#       use_processes   True for a process pool.
+#
+#       initializer, initargs   For the process pool (see
+#                       ProcessPoolExecutor).
+#
+#       depth           How many results the output queue holds.
+#
+#   returns
+#       The queue the results go on.
+#
+def add_map_stage(stages, function, source, workers = 1, use_processes = False,
+                  initializer = None, initargs = (), depth = None):
+    output = queue.Queue(depth or stages['depth'])
+    workers = max(1, workers)
+
+    def run():
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers = workers, mp_context = get_process_context(),
+                                           initializer = initializer, initargs = initargs)
+        else:
+            executor = ThreadPoolExecutor(max_workers = workers)
+
+        try:
+            in_flight = deque()
+            for item in get_items(stages, source):
+                in_flight.append(executor.submit(function, item))
+                if len(in_flight) >= 2 * workers:
+                    put_item(stages, output, in_flight.popleft().result())
+
+            while len(in_flight) > 0:
+                put_item(stages, output, in_flight.popleft().result())
+
+        finally:
+            executor.shutdown(wait = not stages['stopped'].is_set(), cancel_futures = True)
+
+    return start_stage(stages, getattr(function, '__name__', 'map'), run, output)
+
+
+####################
+#   Adds a stage that runs in a single thread and sees all the items in
+#   order (for work that has to keep track of what came before).
+#
+#   params
+#       function        A generator function.  It's given an iterator over
+#                       the items and yields the results (as many or as few
+#                       as it likes).
+#
+#       source          The queue the items come from.
+#
+#   returns
+#       The queue the results go on.
+#
+def add_stage(stages, function, source, depth = None):
+    output = queue.Queue(depth or stages['depth'])
+
+    def run():
+        for result in function(get_items(stages, source)):
+            put_item(stages, output, result)
+
+    return start_stage(stages, getattr(function, '__name__', 'stage'), run, output)
+
+
+####################
+#   Takes the results off the last queue (in this thread).  When they've
+#   all come out, waits for the stages to finish.
+#
+#   raises
+#       Whatever made a stage fail.
+#
+def drain(stages, source):
+    try:
+        for item in get_items(stages, source):
+            yield item
+
+    except PipelineStopped:
+        pass
+
+    except BaseException as e:
+        # Ctrl-C, or whoever is taking the results gave up
+        stop_pipeline(stages, e)
+        for thread in stages['threads']:
+            thread.join()
+        raise
+
+    for thread in stages['threads']:
+        thread.join()
+
+    if stages['error'] != None:
+        raise stages['error']
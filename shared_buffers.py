@@ -0,0 +1,159 @@
+#   Puts pixels in shared memory so that worker processes can use them
+#   without copying.
+#
+#   Handing a worker a NumPy array (or a PIL image) normally means
+#   pickling the whole thing and unpickling it on the other side.  For big
+#   scans that's most of the work.  Instead the pixels are copied once
+#   into a named shared memory segment and the workers are only given a
+#   small descriptor:
+#
+#       (name, shape, dtype)
+#
+#   which they turn back into a NumPy array that looks right at the
+#   segment (no copy).
+#
+#   Segments belong to the process that made them and must be unlinked or
+#   they hang around until the machine restarts.  So:
+#
+#       with shared_buffers():
+#           descriptor = share_array(pixels)
+#           ...hand descriptor to the workers...
+#
+#   unlinks everything made inside it when it's done, whether it finished,
+#   raised or got a Ctrl-C (or a SIGTERM).  Anything left over is unlinked
+#   when the program exits too.
+#
+
+import atexit
+import signal
+import threading
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+# Segments this process made (name -> SharedMemory).  Only the owner
+# unlinks them.
+owned_segments = {}
+
+# Segments this process has attached to (name -> SharedMemory).  Kept
+# here so the arrays looking at them stay valid.
+attached_segments = {}
+
+
+####################
+#   Copies an array into a new shared memory segment.
+#
+#   returns
+#       The descriptor (name, shape, dtype) for attach_array().
+#
+def share_array(array):
+    array = np.ascontiguousarray(array)
+    segment = shared_memory.SharedMemory(create = True, size = max(1, array.nbytes))
+    owned_segments[segment.name] = segment
+
+    view = np.ndarray(array.shape, dtype = array.dtype, buffer = segment.buf)
+    view[...] = array
+
+    if debug:
+        print(f'share_array() {segment.name}: {array.shape} {array.dtype}')
+
+    return (segment.name, array.shape, array.dtype.str)
+
+
+####################
+#   Returns a NumPy array that looks right at a shared segment (no copy).
+#   Works in the process that made it too.
+#
+def attach_array(descriptor):
+    name, shape, dtype = descriptor
+
+    segment = owned_segments.get(name)
+    if segment == None:
+        segment = attached_segments.get(name)
+    if segment == None:
+        segment = shared_memory.SharedMemory(name = name)
+        attached_segments[name] = segment
+
+    return np.ndarray(shape, dtype = np.dtype(dtype), buffer = segment.buf)
+
+
+####################
+#   Unlinks one of our segments (once nothing needs it any more).
+#
+def release_array(descriptor):
+    segment = owned_segments.pop(descriptor[0], None)
+    if segment == None:
+        return
+
+    try:
+        segment.close()
+    except BufferError:
+        pass            # something still looks at it; unlinking is what matters
+    segment.unlink()
+
+
+####################
+#   Lets go of every segment: closes the ones we attached to and unlinks
+#   the ones we made.
+#
+def release_all():
+    for name in list(attached_segments):
+        try:
+            attached_segments.pop(name).close()
+        except BufferError:
+            pass
+
+    for name in list(owned_segments):
+        segment = owned_segments.pop(name)
+        try:
+            segment.close()
+        except BufferError:
+            pass
+        try:
+            segment.unlink()
+        except FileNotFoundError:
+            pass
+
+        if debug:
+            print(f'release_all() unlinked {name}')
+
+
+# just in case something slips past shared_buffers()
+atexit.register(release_all)
+
+
+####################
+#   Turns a SIGTERM into an exception so the cleanup still happens.
+#
+def raise_on_sigterm(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+####################
+#   Everything shared inside this is unlinked at the end, no matter how
+#   it ends (normally, an exception, Ctrl-C or SIGTERM).
+#
+@contextmanager
+def shared_buffers():
+    old_handler = None
+    if threading.current_thread() is threading.main_thread():
+        old_handler = signal.signal(signal.SIGTERM, raise_on_sigterm)
+
+    before = set(owned_segments)
+    try:
+        yield
+    finally:
+        for name in list(owned_segments):
+            if name not in before:
+                release_array((name, None, None))
+
+        if old_handler != None:
+            signal.signal(signal.SIGTERM, old_handler)
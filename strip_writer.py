@@ -0,0 +1,426 @@
+#   Writes an image to a file a band of rows at a time, top to bottom, so
+#   that the whole image never has to be in memory at once.  Pillow can
+#   only save an Image that's all there, which is no good for the really
+#   big ones (see canvas.py).
+#
+#       writer = open_writer('assembled_0.tif', width, height)
+#       write_rows(writer, rows)        # (rows, width, 3) uint8, in order
+#       write_image(writer, piece)      # or a whole Image's rows
+#       ...
+#       close_writer(writer)
+#
+#   The format comes from the filename's extension:
+#
+#       TIFF    Stored in strips, each one compressed on its own (deflate).
+#               The strips are written as they fill up and the directory
+#               that says where they are goes at the end.  Becomes a
+#               BigTIFF when it could end up bigger than 4 GB (classic
+#               TIFFs can't point past that).
+#
+#       PNG     The rows go through one zlib stream as they come (with the
+#               'up' filter), and out into IDAT chunks as it fills them.
+#
+#       PPM     Raw RGB after a short header, so the rows just go straight
+#               out.  Fastest, but big.
+#
+#   Rows that were never written are black.
+#
+
+import os
+import struct
+import zlib
+
+import numpy as np
+
+
+####################
+#   constants
+####################
+
+# The formats, and the extensions for them
+TIFF_FORMAT = 'TIFF'
+PNG_FORMAT = 'PNG'
+PPM_FORMAT = 'PPM'
+FORMAT_EXTENSIONS = {'.tif': TIFF_FORMAT, '.tiff': TIFF_FORMAT, '.png': PNG_FORMAT, '.ppm': PPM_FORMAT}
+
+# About how many (uncompressed) bytes go in each strip
+STRIP_BYTES = 1 << 20
+
+# How hard zlib tries (1 is fastest, 9 is smallest)
+DEFLATE_LEVEL = 6
+
+# How many rows of an Image are written at a time (see write_image())
+IMAGE_BAND_ROWS = 256
+
+# About how many bytes go in each PNG IDAT chunk
+IDAT_BYTES = 1 << 20
+
+# What every PNG starts with
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# PNG color type for RGB, and the 'up' filter (each byte minus the one
+# above it)
+PNG_RGB_COLOR_TYPE = 2
+PNG_UP_FILTER = 2
+
+# Past this many bytes a classic TIFF can't point at its strips any more
+CLASSIC_TIFF_LIMIT = 1 << 32
+
+# TIFF tags (the ones a plain RGB image needs)
+IMAGE_WIDTH_TAG = 256
+IMAGE_LENGTH_TAG = 257
+BITS_PER_SAMPLE_TAG = 258
+COMPRESSION_TAG = 259
+PHOTOMETRIC_TAG = 262
+STRIP_OFFSETS_TAG = 273
+SAMPLES_PER_PIXEL_TAG = 277
+ROWS_PER_STRIP_TAG = 278
+STRIP_BYTE_COUNTS_TAG = 279
+PLANAR_CONFIG_TAG = 284
+
+# TIFF field types: (type number, numpy type)
+SHORT_TYPE = (3, '<u2')
+LONG_TYPE = (4, '<u4')
+LONG8_TYPE = (16, '<u8')
+
+# Tag values
+DEFLATE_COMPRESSION = 8
+RGB_PHOTOMETRIC = 2
+CHUNKY_PLANAR_CONFIG = 1
+
+
+####################
+#   globals
+####################
+
+debug = False
+
+
+####################
+#   Returns the format (TIFF_FORMAT...) for a filename, or None if its
+#   extension isn't one we can write.
+#
+def get_output_format(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return FORMAT_EXTENSIONS.get(extension)
+
+
+####################
+#   Starts writing an image.
+#
+#   params
+#       filename        Where to write it.  Its extension picks the format
+#                       (see the top of this file).  Overwritten if it's
+#                       already there.
+#
+#       width, height   Size of the whole image.
+#
+#   returns
+#       The writer (a dictionary):
+#           'file'          The open output file.
+#           'format'        TIFF_FORMAT...
+#           'width', 'height'
+#           'rows_written'  How many rows have been handed to write_rows().
+#           'pending'       Rows waiting to fill up a strip (list of arrays).
+#           'pending_rows'  How many rows are in there.
+#           'rows_per_strip'
+#           'strip_offsets', 'strip_byte_counts'    Where the strips went.
+#           'bigtiff'       True for a BigTIFF.
+#       and for a PNG:
+#           'compressor'    The zlib stream.
+#           'compressed'    Compressed bytes waiting to fill up an IDAT.
+#           'previous_row'  The last row written (for the up filter).
+#       None if the format isn't known (or the file can't be made).
+#
+def open_writer(filename, width, height):
+    output_format = get_output_format(filename)
+    if output_format == None:
+        print(f'open_writer() unable to write {filename}: unknown format')
+        return
+
+    try:
+        file = open(filename, 'wb')
+    except OSError as e:
+        print(f'open_writer() unable to create {filename} ({e})')
+        return
+
+    writer = {
+        'file': file,
+        'format': output_format,
+        'width': width,
+        'height': height,
+        'rows_written': 0,
+        'pending': [],
+        'pending_rows': 0,
+        'rows_per_strip': max(1, min(height, STRIP_BYTES // max(1, width * 3))),
+        'strip_offsets': [],
+        'strip_byte_counts': [],
+        'bigtiff': False,
+    }
+
+    if output_format == TIFF_FORMAT:
+        # Deflate can make things a little bigger, never by this much.
+        raw_bytes = width * height * 3
+        writer['bigtiff'] = raw_bytes + raw_bytes // 100 + STRIP_BYTES >= CLASSIC_TIFF_LIMIT
+        write_tiff_header(writer)
+
+    elif output_format == PNG_FORMAT:
+        writer['compressor'] = zlib.compressobj(DEFLATE_LEVEL)
+        writer['compressed'] = []
+        writer['previous_row'] = np.zeros(width * 3, dtype = np.uint8)
+        write_png_header(writer)
+
+    else:
+        file.write(f'P6\n{width} {height}\n255\n'.encode('ascii'))
+
+    if debug:
+        print(f'open_writer() {filename}: {output_format} {width} x {height}, bigtiff = {writer["bigtiff"]}')
+
+    return writer
+
+
+####################
+#   Writes the next rows of the image.
+#
+#   params
+#       rows            Array of (rows, width, 3) uint8, the rows that come
+#                       right after the ones already written.  Rows past the
+#                       bottom of the image are ignored.
+#
+def write_rows(writer, rows):
+    rows_left = writer['height'] - writer['rows_written']
+    if len(rows) > rows_left:
+        if debug:
+            print(f'write_rows() ignoring {len(rows) - rows_left} rows past the bottom')
+        rows = rows[:rows_left]
+    if len(rows) == 0:
+        return
+
+    rows = np.ascontiguousarray(rows, dtype = np.uint8)
+    writer['rows_written'] += len(rows)
+
+    if writer['format'] == TIFF_FORMAT:
+        writer['pending'].append(rows)
+        writer['pending_rows'] += len(rows)
+        write_full_strips(writer)
+
+    elif writer['format'] == PNG_FORMAT:
+        write_png_rows(writer, rows)
+
+    else:
+        writer['file'].write(rows.tobytes())
+
+
+####################
+#   Writes all the rows of an image as the next rows of the output.
+#   Goes a band at a time, so the image is never copied all at once.
+#
+#   params
+#       image           The Image (any mode, it's converted to RGB).
+#
+#       left            The column the image starts at.  The rest of each
+#                       row is black, and whatever of the image doesn't fit
+#                       is cut off (like Image.paste()).
+#
+def write_image(writer, image, left = 0):
+    width = writer['width']
+
+    # the columns of the output that the image covers
+    start = max(0, left)
+    end = min(width, left + image.width)
+
+    for top in range(0, image.height, IMAGE_BAND_ROWS):
+        bottom = min(image.height, top + IMAGE_BAND_ROWS)
+
+        band = None
+        if end > start:
+            band = image.crop((start - left, top, end - left, bottom))
+            if band.mode != 'RGB':
+                band = band.convert('RGB')
+
+        if (start == 0) and (end == width):
+            rows = np.asarray(band)
+        else:
+            rows = np.zeros((bottom - top, width, 3), dtype = np.uint8)
+            if band != None:
+                rows[:, start:end] = np.asarray(band)
+
+        write_rows(writer, rows)
+
+
+####################
+#   Writes out as many whole strips as the pending rows make.
+#
+def write_full_strips(writer):
+    rows_per_strip = writer['rows_per_strip']
+    if writer['pending_rows'] < rows_per_strip:
+        return
+
+    pending = np.concatenate(writer['pending']) if len(writer['pending']) > 1 else writer['pending'][0]
+
+    start = 0
+    while len(pending) - start >= rows_per_strip:
+        write_tiff_strip(writer, pending[start : start + rows_per_strip])
+        start += rows_per_strip
+
+    writer['pending'] = [pending[start:]] if start < len(pending) else []
+    writer['pending_rows'] = len(pending) - start
+
+
+####################
+#   Finishes the image: fills in any rows that weren't written (black),
+#   writes what's left and closes the file.
+#
+def close_writer(writer):
+    width = writer['width']
+    rows_left = writer['height'] - writer['rows_written']
+    while rows_left > 0:
+        rows = min(rows_left, writer['rows_per_strip'])
+        write_rows(writer, np.zeros((rows, width, 3), dtype = np.uint8))
+        rows_left -= rows
+
+    if writer['format'] == TIFF_FORMAT:
+        if writer['pending_rows'] > 0:
+            write_tiff_strip(writer, np.concatenate(writer['pending']))
+            writer['pending'] = []
+            writer['pending_rows'] = 0
+
+        write_tiff_directory(writer)
+
+    elif writer['format'] == PNG_FORMAT:
+        writer['compressed'].append(writer['compressor'].flush())
+        write_png_chunk(writer, b'IDAT', b''.join(writer['compressed']))
+        write_png_chunk(writer, b'IEND', b'')
+
+    writer['file'].close()
+
+
+####################
+#   Writes the TIFF header.  Where the directory is isn't known yet, so
+#   that's filled in at the end (see write_tiff_directory()).
+#
+def write_tiff_header(writer):
+    if writer['bigtiff']:
+        # byte order, version 43, offsets are 8 bytes, (reserved), directory
+        writer['file'].write(b'II' + struct.pack('<HHHQ', 43, 8, 0, 0))
+    else:
+        writer['file'].write(b'II' + struct.pack('<HI', 42, 0))
+
+
+####################
+#   Compresses a strip of rows and writes it at the end of the file.
+#
+def write_tiff_strip(writer, rows):
+    data = zlib.compress(rows.tobytes(), DEFLATE_LEVEL)
+
+    file = writer['file']
+    writer['strip_offsets'].append(file.tell())
+    writer['strip_byte_counts'].append(len(data))
+    file.write(data)
+
+
+####################
+#   Writes the image file directory (the tags) at the end of the file and
+#   points the header at it.
+#
+def write_tiff_directory(writer):
+    file = writer['file']
+    bigtiff = writer['bigtiff']
+    offset_type = LONG8_TYPE if bigtiff else LONG_TYPE
+
+    # (in tag order, as TIFF wants)
+    entries = [
+        (IMAGE_WIDTH_TAG, LONG_TYPE, [writer['width']]),
+        (IMAGE_LENGTH_TAG, LONG_TYPE, [writer['height']]),
+        (BITS_PER_SAMPLE_TAG, SHORT_TYPE, [8, 8, 8]),
+        (COMPRESSION_TAG, SHORT_TYPE, [DEFLATE_COMPRESSION]),
+        (PHOTOMETRIC_TAG, SHORT_TYPE, [RGB_PHOTOMETRIC]),
+        (STRIP_OFFSETS_TAG, offset_type, writer['strip_offsets']),
+        (SAMPLES_PER_PIXEL_TAG, SHORT_TYPE, [3]),
+        (ROWS_PER_STRIP_TAG, LONG_TYPE, [writer['rows_per_strip']]),
+        (STRIP_BYTE_COUNTS_TAG, offset_type, writer['strip_byte_counts']),
+        (PLANAR_CONFIG_TAG, SHORT_TYPE, [CHUNKY_PLANAR_CONFIG]),
+    ]
+
+    if bigtiff:
+        count_format, entry_format, next_format, inline_size = '<Q', '<HHQ', '<Q', 8
+    else:
+        count_format, entry_format, next_format, inline_size = '<H', '<HHI', '<I', 4
+    directory_size = struct.calcsize(count_format) + len(entries) * (struct.calcsize(entry_format) + inline_size) \
+                     + struct.calcsize(next_format)
+
+    # the directory has to start on a word boundary
+    directory_offset = file.tell()
+    if directory_offset % 2 != 0:
+        file.write(b'\0')
+        directory_offset += 1
+
+    # values that don't fit in an entry go after the directory
+    directory = struct.pack(count_format, len(entries))
+    extra = b''
+    extra_offset = directory_offset + directory_size
+    for tag, (type_number, value_type), values in entries:
+        data = np.array(values, dtype = value_type).tobytes()
+        directory += struct.pack(entry_format, tag, type_number, len(values))
+        if len(data) <= inline_size:
+            directory += data.ljust(inline_size, b'\0')
+        else:
+            directory += struct.pack(next_format, extra_offset + len(extra))
+            extra += data
+            if len(extra) % 2 != 0:
+                extra += b'\0'
+
+    directory += struct.pack(next_format, 0)    # no more directories
+    file.write(directory)
+    file.write(extra)
+
+    # and point the header at it
+    if bigtiff:
+        file.seek(8)
+        file.write(struct.pack('<Q', directory_offset))
+    else:
+        file.seek(4)
+        file.write(struct.pack('<I', directory_offset))
+
+
+####################
+#   Writes the PNG signature and header.
+#
+def write_png_header(writer):
+    writer['file'].write(PNG_SIGNATURE)
+    write_png_chunk(writer, b'IHDR', struct.pack('>IIBBBBB', writer['width'], writer['height'], 8,
+                                                 PNG_RGB_COLOR_TYPE, 0, 0, 0))
+
+
+####################
+#   Writes one PNG chunk (length, type, data, CRC).
+#
+def write_png_chunk(writer, chunk_type, data):
+    file = writer['file']
+    file.write(struct.pack('>I', len(data)))
+    file.write(chunk_type)
+    file.write(data)
+    file.write(struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+####################
+#   Filters some rows, feeds them to the zlib stream and writes out an
+#   IDAT chunk whenever there's enough compressed data for one.
+#
+def write_png_rows(writer, rows):
+    flat = rows.reshape(len(rows), -1)
+
+    # the up filter: each row minus the row above it (wrapping around)
+    above = np.concatenate((writer['previous_row'][np.newaxis], flat[:-1]))
+    filtered = np.empty((len(rows), flat.shape[1] + 1), dtype = np.uint8)
+    filtered[:, 0] = PNG_UP_FILTER
+    np.subtract(flat, above, out = filtered[:, 1:])
+    writer['previous_row'] = flat[-1].copy()
+
+    compressed = writer['compressor'].compress(filtered.tobytes())
+    if len(compressed) > 0:
+        writer['compressed'].append(compressed)
+
+    if sum([len(data) for data in writer['compressed']]) >= IDAT_BYTES:
+        write_png_chunk(writer, b'IDAT', b''.join(writer['compressed']))
+        writer['compressed'] = []
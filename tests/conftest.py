@@ -0,0 +1,63 @@
+#   Fixtures shared by the tests.  Every test starts with nothing cached
+#   (no signatures, no sidecar, no decoded images) and the cache settings
+#   back at their defaults, and save_piece makes random pieces to work on.
+#
+
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import edge_cache
+import image_cache
+
+
+####################
+#   fixtures
+####################
+
+#########
+#   Starts every test with nothing cached and no sidecar.
+#
+@pytest.fixture(autouse = True)
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(edge_cache, 'signature_cache', OrderedDict())
+    monkeypatch.setattr(edge_cache, 'new_signatures', {})
+    monkeypatch.setattr(edge_cache, 'sidecar_file', None)
+    monkeypatch.setattr(edge_cache, 'sidecar_entries', {})
+    monkeypatch.setattr(edge_cache, 'num_decodes', 0)
+    image_cache.clear_cache()
+    monkeypatch.setattr(image_cache, 'max_bytes', image_cache.DEFAULT_MAX_BYTES)
+    monkeypatch.setattr(image_cache, 'num_hits', 0)
+    monkeypatch.setattr(image_cache, 'num_misses', 0)
+    yield
+    image_cache.clear_cache()
+
+
+#########
+#   Saves a random piece in the test's directory:
+#
+#       filename, pixels = save_piece('a.png', width, height, seed)
+#
+#   The format comes from the name.  mode can be 'RGB', 'RGBA', 'L' or
+#   'P' (made from random RGB), and anything else is passed on to save().
+#   pixels is what was saved (the RGB for 'P').
+#
+@pytest.fixture
+def save_piece(tmp_path):
+    def save(name, width, height, seed = 0, mode = 'RGB', **save_args):
+        channels = {'RGB': 3, 'RGBA': 4, 'P': 3}.get(mode, 1)
+        pixels = np.random.default_rng(seed).integers(0, 256, (height, width, channels), dtype = np.uint8)
+        if channels == 1:
+            pixels = pixels[..., 0]
+
+        image = Image.fromarray(pixels)
+        if mode == 'P':
+            image = image.convert('P')
+
+        filename = str(tmp_path / name)
+        image.save(filename, **save_args)
+        return (filename, pixels)
+
+    return save
@@ -0,0 +1,99 @@
+#   Tests for canvas.py.  Pasting into a canvas on disk and saving it has
+#   to give the same picture as pasting into an Image in memory.
+#
+
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import canvas
+import merge_images2
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Random pieces of different modes and sizes, and where they go (some
+#   hang off the edges, some overlap).
+#
+def make_pieces(seed):
+    rng = np.random.default_rng(seed)
+    placed = []
+    for mode, size, position in [
+        ('RGB', (30, 50), (0, 0)),
+        ('L', (25, 40), (20, 30)),
+        ('RGBA', (40, 20), (-10, 60)),
+        ('RGB', (30, 30), (45, 70)),
+        ('RGB', (10, 10), (100, 0)),        # not on the canvas at all
+    ]:
+        channels = {'RGB': 3, 'RGBA': 4}.get(mode, 1)
+        pixels = rng.integers(0, 256, (size[1], size[0], channels), dtype = np.uint8)
+        placed.append((Image.fromarray(pixels[..., 0] if channels == 1 else pixels), position))
+    return placed
+
+
+#########
+#   Reads an image back as RGB pixels.
+#
+def read_image(filename):
+    with Image.open(filename) as image:
+        return np.asarray(image.convert('RGB'))
+
+
+####################
+#   tests
+####################
+
+@pytest.mark.parametrize('band_rows', [7, canvas.BAND_ROWS])
+def test_disk_canvas_matches_memory(tmp_path, monkeypatch, band_rows):
+    monkeypatch.setattr(canvas, 'BAND_ROWS', band_rows)
+    in_memory = canvas.new_canvas(60, 90)
+    on_disk = canvas.new_canvas(60, 90, on_disk = True, directory = str(tmp_path))
+    for image, position in make_pieces(80):
+        canvas.paste_image(in_memory, image, position)
+        canvas.paste_image(on_disk, image, position)
+
+    assert canvas.save_canvas(in_memory, str(tmp_path / 'memory.png'))
+    assert canvas.save_canvas(on_disk, str(tmp_path / 'disk.tif'))
+    assert np.array_equal(read_image(tmp_path / 'disk.tif'), read_image(tmp_path / 'memory.png'))
+
+    raw_name = on_disk['raw_name']
+    canvas.close_canvas(in_memory)
+    canvas.close_canvas(on_disk)
+    assert not os.path.exists(raw_name)
+    assert raw_name not in canvas.open_raw_files
+
+
+def test_unsaved_canvas(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    on_disk = canvas.new_canvas(20, 10, on_disk = True)
+
+    # pieces on disk can only be saved a strip at a time
+    assert canvas.save_canvas(on_disk, 'assembled_0.jpg') == False
+    assert not os.path.exists('assembled_0.jpg')
+
+    # and a joined image that can't be saved stops the run
+    with pytest.raises(SystemExit):
+        merge_images2.save_image(on_disk, 'assembled_0.jpg', unique_name = False)
+
+    canvas.close_canvas(on_disk)
+    assert os.listdir('.') == []
+
+
+def test_unsaved_memory_canvas(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    in_memory = canvas.new_canvas(20, 10)
+
+    # no such format, and no such directory: False, just like on disk
+    assert canvas.save_canvas(in_memory, 'assembled_0.xyz') == False
+    assert canvas.save_canvas(in_memory, os.path.join('missing', 'assembled_0.png')) == False
+
+    with pytest.raises(SystemExit):
+        merge_images2.save_image(in_memory, 'assembled_0.xyz', unique_name = False)
+
+    canvas.close_canvas(in_memory)
+    assert os.listdir('.') == []
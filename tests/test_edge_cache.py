@@ -0,0 +1,159 @@
+#   Tests for edge_cache.py.  Signatures have to hold exactly the edges a
+#   full decode has, whether they were just decoded or read back from the
+#   sidecar.
+#
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import edge_cache
+import image_cache
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Checks that a signature holds the edges of these pixels.
+#
+def assert_signature_matches(signature, pixels):
+    assert np.array_equal(signature['top'], pixels[0])
+    assert np.array_equal(signature['bottom'], pixels[-1])
+    assert np.array_equal(signature['left'], pixels[:, 0])
+    assert np.array_equal(signature['right'], pixels[:, -1])
+    assert (signature['width'], signature['height']) == (pixels.shape[1], pixels.shape[0])
+    assert signature['mode'] == 'RGB'
+
+
+####################
+#   tests
+####################
+
+def test_signature_matches_full_decode(save_piece):
+    filename, pixels = save_piece('a.png', 31, 17, 1)
+
+    assert_signature_matches(edge_cache.get_edge_signature(filename), pixels)
+    assert_signature_matches(edge_cache.get_edge_signature(filename), pixels)
+    assert edge_cache.num_decodes == 1
+
+
+def test_sidecar_round_trip(tmp_path, monkeypatch, save_piece):
+    file1, pixels1 = save_piece('a.png', 31, 17, 1)
+    file2, pixels2 = save_piece('b.png', 31, 12, 2)
+    edge_cache.get_edge_signature(file1)
+    edge_cache.get_edge_signature(file2)
+    edge_cache.save_sidecar(str(tmp_path))
+    assert os.path.isfile(tmp_path / edge_cache.SIDECAR_NAME)
+
+    # a new run: nothing in memory, everything comes from the sidecar
+    monkeypatch.setattr(edge_cache, 'signature_cache', OrderedDict())
+    monkeypatch.setattr(edge_cache, 'new_signatures', {})
+    monkeypatch.setattr(edge_cache, 'num_decodes', 0)
+    edge_cache.load_sidecar(str(tmp_path))
+
+    assert_signature_matches(edge_cache.get_edge_signature(file1), pixels1)
+    assert_signature_matches(edge_cache.get_edge_signature(file2), pixels2)
+    assert edge_cache.num_decodes == 0
+
+
+def test_sidecar_ignores_changed_files(tmp_path, monkeypatch, save_piece):
+    filename, _ = save_piece('a.png', 31, 17, 1)
+    edge_cache.get_edge_signature(filename)
+    edge_cache.save_sidecar(str(tmp_path))
+
+    # same name, new pixels (and a different size on disk)
+    _, pixels = save_piece('a.png', 40, 9, 3)
+    monkeypatch.setattr(edge_cache, 'signature_cache', OrderedDict())
+    monkeypatch.setattr(edge_cache, 'num_decodes', 0)
+    edge_cache.load_sidecar(str(tmp_path))
+
+    assert edge_cache.find_cached_signature(filename) == None
+    assert_signature_matches(edge_cache.get_edge_signature(filename), pixels)
+    assert edge_cache.num_decodes == 1
+
+
+def test_not_an_image(tmp_path):
+    not_an_image = tmp_path / 'notes.txt'
+    not_an_image.write_text('not a picture')
+
+    assert edge_cache.get_edge_signature(str(not_an_image)) == None
+    assert edge_cache.get_edge_signature(str(tmp_path / 'missing.png')) == None
+
+
+@pytest.mark.parametrize('name', ['a.bmp', 'a.ppm', 'a.png', 'a.jpg'])
+def test_row_edges_without_a_full_decode(monkeypatch, name, save_piece):
+    monkeypatch.setattr(image_cache, 'num_misses', 0)
+    filename, _ = save_piece(name, 31, 17, 1)
+    with Image.open(filename) as image:
+        pixels = np.asarray(image)
+
+    signature = edge_cache.get_edge_signature(filename, edge_cache.VERTICAL_EDGES)
+    assert np.array_equal(signature['top'], pixels[0])
+    assert np.array_equal(signature['bottom'], pixels[-1])
+    assert (signature['width'], signature['height'], signature['mode']) == (31, 17, 'RGB')
+    assert 'left' not in signature
+
+    # the bottom of a PNG or JPEG still takes the whole thing
+    assert image_cache.num_misses == (1 if name in ('a.png', 'a.jpg') else 0)
+
+
+def test_sidecar_keeps_the_edges_it_has(tmp_path, monkeypatch, save_piece):
+    filename, pixels = save_piece('a.bmp', 31, 17, 1)
+    edge_cache.get_edge_signature(filename, edge_cache.VERTICAL_EDGES)
+    edge_cache.save_sidecar(str(tmp_path))
+
+    monkeypatch.setattr(edge_cache, 'signature_cache', OrderedDict())
+    monkeypatch.setattr(edge_cache, 'new_signatures', {})
+    monkeypatch.setattr(edge_cache, 'num_decodes', 0)
+    edge_cache.load_sidecar(str(tmp_path))
+
+    # the rows are there, the columns have to be decoded
+    assert edge_cache.find_cached_signature(filename, edge_cache.VERTICAL_EDGES) != None
+    assert edge_cache.find_cached_signature(filename, edge_cache.HORIZONTAL_EDGES) == None
+    assert_signature_matches(edge_cache.get_edge_signature(filename, edge_cache.HORIZONTAL_EDGES), pixels)
+    assert edge_cache.num_decodes == 1
+
+    # and after that the sidecar has them all
+    edge_cache.save_sidecar(str(tmp_path))
+    edge_cache.load_sidecar(str(tmp_path))
+    monkeypatch.setattr(edge_cache, 'signature_cache', OrderedDict())
+    assert_signature_matches(edge_cache.find_cached_signature(filename), pixels)
+
+
+def test_sidecar_keeps_the_orientation(tmp_path, monkeypatch):
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    filename = str(tmp_path / 'a.jpg')
+    Image.new('RGB', (30, 20)).save(filename, exif = exif)
+    assert edge_cache.get_edge_signature(filename)['orientation'] == 6
+    edge_cache.save_sidecar(str(tmp_path))
+
+    monkeypatch.setattr(edge_cache, 'signature_cache', OrderedDict())
+    edge_cache.load_sidecar(str(tmp_path))
+    assert edge_cache.find_cached_signature(filename)['orientation'] == 6
+
+
+def test_get_seam_edges_uses_the_right_edges():
+    pixels = np.random.default_rng(41).integers(0, 256, (30, 40, 3), dtype = np.uint8)
+
+    def signature(piece):
+        return {'top': piece[0], 'bottom': piece[-1], 'left': piece[:, 0], 'right': piece[:, -1],
+                'width': piece.shape[1], 'height': piece.shape[0]}
+
+    # the same picture cut across and cut down, with the cut rows and
+    # columns in both pieces
+    above, below = signature(pixels[:16]), signature(pixels[15:])
+    left, right = signature(pixels[:, :21]), signature(pixels[:, 20:])
+
+    for first, second, horizontal in ((above, below, False), (left, right, True)):
+        edge1, edge2 = edge_cache.get_seam_edges(first, second, horizontal)
+        assert np.array_equal(edge1, edge2)
+
+    # side by side pieces aren't the same width
+    assert edge_cache.get_seam_edges(left, right) == None
+    assert edge_cache.get_seam_edges(None, below) == None
@@ -0,0 +1,119 @@
+#   Tests for edge_index.py.  The descriptors are checked against
+#   averaging by hand and the links against the full cost matrix in
+#   piece_order.py.
+#
+
+import numpy as np
+
+import edge_index
+import piece_order
+from image_comparator import RED_MASK, GREEN_MASK, BLUE_MASK
+
+
+RGB_MASK = RED_MASK | GREEN_MASK | BLUE_MASK
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Makes a tall strip and cuts it into pieces 4 rows tall, returning
+#   the pieces' (bottoms, tops) lists in a shuffled order and the right
+#   order of them.
+#
+def cut_strip(num_pieces, width, seed):
+    rng = np.random.default_rng(seed)
+
+    # smooth down the strip but different from column to column
+    steps = rng.integers(-2, 3, (num_pieces * 4, width, 3))
+    strip = np.clip(128 + np.cumsum(steps, axis = 0), 0, 255).astype(np.uint8)
+    strip[:, :, 0] = rng.integers(0, 256, width, dtype = np.uint8)
+    pieces = [strip[k * 4:(k + 1) * 4] for k in range(num_pieces)]
+
+    shuffle = rng.permutation(num_pieces)
+    bottoms = [pieces[k][-1] for k in shuffle]
+    tops = [pieces[k][0] for k in shuffle]
+    right_order = [int(np.nonzero(shuffle == k)[0][0]) for k in range(num_pieces)]
+    return (bottoms, tops, right_order)
+
+
+####################
+#   tests
+####################
+
+def test_descriptor_matches_averaging_by_hand():
+    rng = np.random.default_rng(30)
+    for width in (32, 100, 257, 20):
+        edge = rng.integers(0, 256, (width, 3), dtype = np.uint8)
+        descriptor = edge_index.make_descriptor(edge, RED_MASK | BLUE_MASK)
+
+        expected = []
+        for k in range(edge_index.DESCRIPTOR_LENGTH):
+            start = k * width // edge_index.DESCRIPTOR_LENGTH
+            end = max((k + 1) * width // edge_index.DESCRIPTOR_LENGTH, start + 1)
+            for channel in (0, 2):
+                average = sum(int(edge[x, channel]) for x in range(start, end)) / (end - start)
+                expected.append(min(255, round(average / edge_index.DESCRIPTOR_STEP)))
+
+        assert list(descriptor) == expected
+
+
+def test_links_are_the_ones_the_cost_matrix_has():
+    bottoms, tops, right_order = cut_strip(30, 80, 31)
+
+    rows, columns, costs = edge_index.find_piece_links(bottoms, tops, RGB_MASK, max_shift = 1)
+    full_costs, _ = piece_order.build_cost_matrix(np.stack(bottoms), np.stack(tops), RGB_MASK, 1)
+    for i, j, cost in zip(rows, columns, costs):
+        assert cost == full_costs[i, j]
+
+    # every real seam is found
+    found = set(zip(rows.tolist(), columns.tolist()))
+    for above, below in zip(right_order, right_order[1:]):
+        assert (above, below) in found
+
+    assert edge_index.find_piece_chains(bottoms, tops, RGB_MASK, max_shift = 1) == [right_order]
+
+
+def test_flat_edges_get_a_few_flat_candidates():
+    bottoms, tops, right_order = cut_strip(12, 64, 32)
+
+    # lots of blank pieces (a little noise, like a scan of a margin)
+    rng = np.random.default_rng(33)
+    for k in range(300):
+        bottoms.append((250 + rng.integers(-1, 2, (64, 3))).astype(np.uint8))
+        tops.append((250 + rng.integers(-1, 2, (64, 3))).astype(np.uint8))
+    bottoms.append(None)
+    tops.append(None)
+
+    # and two with a gray margin between them
+    gray_bottom, gray_top = len(bottoms), len(bottoms) + 1
+    bottoms.extend([np.full((64, 3), 100, dtype = np.uint8), bottoms[20]])
+    tops.extend([tops[20], (100 + rng.integers(-1, 2, (64, 3))).astype(np.uint8)])
+
+    # the flat ones stay out of the hash tables
+    index = edge_index.build_edge_index(tops, RGB_MASK)
+    for sorted_keys, numbers in index['tables']:
+        assert sorted(numbers) == list(range(12))
+
+    assert edge_index.is_flat_edge(bottoms[20], RGB_MASK)
+    assert not edge_index.is_flat_edge(bottoms[0], RGB_MASK)
+
+    # but a flat edge gets a few flat candidates, the right color
+    candidates = edge_index.find_candidates(index, bottoms[20], exclude = 20)
+    assert len(candidates) == edge_index.NUM_CANDIDATES
+    assert all(12 <= j < 312 for j in candidates)
+    assert edge_index.find_candidates(index, bottoms[gray_bottom]).tolist() == [gray_top]
+
+    rows, columns, costs = edge_index.find_piece_links(bottoms, tops, RGB_MASK)
+    assert (gray_bottom, gray_top) in set(zip(rows.tolist(), columns.tolist()))
+    assert len(costs) <= edge_index.NUM_CANDIDATES * len(bottoms)
+
+    # the real pieces still come out in order, and the blank ones only
+    # ever go with each other
+    chains = edge_index.find_piece_chains(bottoms, tops, RGB_MASK)
+    assert right_order in chains
+    assert (gray_bottom, gray_top) in set(pair for chain in chains for pair in zip(chain, chain[1:]))
+    for chain in chains:
+        if chain != right_order:
+            assert all(k >= 12 for k in chain)
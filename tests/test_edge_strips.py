@@ -0,0 +1,85 @@
+#   Tests for edge_strips.py.  Every band has to come out exactly the way
+#   a full decode and crop would have it.
+#
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from edge_strips import *
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Returns random RGB pixels, smooth enough that JPEG doesn't make a
+#   complete mess of them.
+#
+def make_pixels(width, height, seed):
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (height // 8 + 1, width // 8 + 1, 3), dtype = np.uint8)
+    return np.repeat(np.repeat(coarse, 8, axis = 0), 8, axis = 1)[:height, :width].copy()
+
+
+#########
+#   The band the slow way: decode everything, then crop.
+#
+def full_decode_band(filename, box):
+    with Image.open(filename) as image:
+        return image_to_array(image.crop(box))
+
+
+####################
+#   tests
+####################
+
+@pytest.mark.parametrize('name, options', [
+    ('piece.jpg', {'quality': 90}),
+    ('piece.png', {}),
+    ('piece.bmp', {}),
+    ('piece.ppm', {}),
+    ('piece.tif', {}),
+    ('strips.tif', {'compression': 'tiff_deflate'}),
+])
+def test_load_edge_strip_matches_full_decode(tmp_path, name, options):
+    filename = str(tmp_path / name)
+    Image.fromarray(make_pixels(301, 203, 1)).save(filename, **options)
+
+    for edge in (TOP_EDGE, BOTTOM_EDGE, LEFT_EDGE, RIGHT_EDGE):
+        for depth in (1, 3, 40):
+            band = load_edge_strip(filename, edge, depth)
+            box = get_edge_box(301, 203, edge, depth)
+            assert np.array_equal(band, full_decode_band(filename, box)), (edge, depth)
+
+
+def test_load_band_jpeg_with_large_header(tmp_path):
+    # A 60 KB ICC profile (and noise, which compresses badly) pushes the
+    # first MCU row past the first chunk the decoder is fed.
+    filename = str(tmp_path / 'scan.jpg')
+    rng = np.random.default_rng(2)
+    icc_profile = bytes(rng.integers(0, 256, 60000, dtype = np.uint8))
+    pixels = rng.integers(0, 256, (64, 2400, 3), dtype = np.uint8)
+    Image.fromarray(pixels).save(filename, quality = 95, icc_profile = icc_profile)
+
+    for rows in (1, 8, 17):
+        box = (0, 0, 2400, rows)
+        assert np.array_equal(load_band(filename, box), full_decode_band(filename, box))
+
+    for edge in (LEFT_EDGE, RIGHT_EDGE):
+        box = get_edge_box(2400, 64, edge)
+        assert np.array_equal(load_edge_strip(filename, edge), full_decode_band(filename, box))
+
+
+def test_decode_jpeg_top_rows_truncated(tmp_path):
+    filename = tmp_path / 'whole.jpg'
+    Image.fromarray(make_pixels(400, 300, 4)).save(str(filename), quality = 90)
+    truncated = tmp_path / 'truncated.jpg'
+    truncated.write_bytes(filename.read_bytes()[:1500])
+
+    with Image.open(str(truncated)) as image:
+        assert not decode_jpeg_top_rows(image, 8)
+
+    with Image.open(str(filename)) as image:
+        assert decode_jpeg_top_rows(image, 8)
@@ -0,0 +1,166 @@
+#   Tests for image_cache.py.  Whether an image was decoded ahead of time
+#   or on the spot, it has to be the same as opening the file.
+#
+
+import os
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import image_cache
+
+
+####################
+#   tests
+####################
+
+def test_prefetched_images_match_the_files(save_piece):
+    files = [save_piece(f'p{k}.png', 20 + k, 10, k) for k in range(6)]
+    names = [filename for filename, pixels in files]
+
+    image_cache.prefetch(names[:4])
+    for filename, pixels in files:
+        assert np.array_equal(np.asarray(image_cache.get_image(filename)), pixels)
+
+    # the first four were decoded in the background, the rest on the spot
+    assert (image_cache.num_hits, image_cache.num_misses) == (4, 2)
+
+    # and they're all still here
+    assert np.array_equal(np.asarray(image_cache.get_image(names[0])), files[0][1])
+    assert image_cache.num_hits == 5
+
+
+def test_take_images_lets_go_as_it_goes(tmp_path, capsys, save_piece):
+    files = [save_piece(f'p{k}.png', 16, 8, k) for k in range(10)]
+    (tmp_path / 'notes.txt').write_text('not a picture')
+    names = [filename for filename, pixels in files]
+    names.insert(3, str(tmp_path / 'notes.txt'))
+    names.insert(6, str(tmp_path / 'missing.png'))
+
+    # the files that can't be opened are skipped
+    taken = 0
+    for image, (filename, pixels) in zip(image_cache.take_images(names), files):
+        assert np.array_equal(np.asarray(image), pixels)
+        taken += 1
+
+        # never more than this one and the ones being decoded ahead
+        assert len(image_cache.image_cache) + len(image_cache.pending) <= 1 + image_cache.PREFETCH_COUNT
+
+    assert taken == len(files)
+    assert len(image_cache.image_cache) == 0
+    assert image_cache.cache_bytes == 0
+
+    output = capsys.readouterr().out
+    assert 'notes.txt' in output
+    assert 'missing.png' in output
+
+
+def test_missing_and_broken_files(tmp_path):
+    (tmp_path / 'broken.png').write_bytes(b'\x89PNG\r\n\x1a\n' + b'\x00' * 30)
+    broken = str(tmp_path / 'broken.png')
+    missing = str(tmp_path / 'missing.png')
+
+    image_cache.prefetch([broken, missing])
+    assert image_cache.get_image(broken) == None
+    assert image_cache.get_image(missing) == None
+    assert len(image_cache.image_cache) == 0
+
+
+def test_least_recently_used_goes_first(monkeypatch, save_piece):
+    files = {name: save_piece(f'{name}.png', 16, 8, seed) for seed, name in enumerate('abcd')}
+    size = 16 * 8 * 3
+    monkeypatch.setattr(image_cache, 'max_bytes', 3 * size)
+
+    for name in 'abc':
+        image_cache.get_image(files[name][0])
+    image_cache.get_image(files['a'][0])
+    image_cache.get_image(files['d'][0])
+
+    # b was the one used longest ago
+    cached = sorted(key[0] for key in image_cache.image_cache)
+    assert cached == sorted(files[name][0] for name in 'acd')
+    assert image_cache.cache_bytes == 3 * size
+
+    # b comes back the same (decoded again), and c goes this time
+    assert np.array_equal(np.asarray(image_cache.get_image(files['b'][0])), files['b'][1])
+    assert files['c'][0] not in [key[0] for key in image_cache.image_cache]
+    assert (image_cache.num_hits, image_cache.num_misses) == (1, 5)
+
+
+def test_too_big_to_keep(monkeypatch, save_piece):
+    filename, pixels = save_piece('big.png', 40, 40, 1)
+    monkeypatch.setattr(image_cache, 'max_bytes', 40 * 40 * 3 - 1)
+
+    assert np.array_equal(np.asarray(image_cache.get_image(filename)), pixels)
+    assert len(image_cache.image_cache) == 0
+    assert image_cache.cache_bytes == 0
+
+
+def test_too_big_to_keep_is_decoded_once(monkeypatch, save_piece):
+    filename, pixels = save_piece('big.png', 40, 40, 1)
+    monkeypatch.setattr(image_cache, 'max_bytes', 40 * 40 * 3 - 1)
+
+    decodes = []
+    decode_image = image_cache.decode_image
+    monkeypatch.setattr(image_cache, 'decode_image', lambda name: decodes.append(name) or decode_image(name))
+
+    # decoded in the background and finished before it's asked for
+    image_cache.prefetch([filename])
+    image_cache.pending[image_cache.get_file_key(filename)].result()
+
+    assert np.array_equal(np.asarray(image_cache.get_image(filename)), pixels)
+    assert decodes == [filename]
+    assert len(image_cache.image_cache) + len(image_cache.pending) == 0
+
+
+@pytest.mark.parametrize('mode, pixel_bytes', [('1', 1), ('L', 1), ('RGB', 3), ('RGBA', 4),
+                                               ('I;16', 2), ('I', 4), ('F', 4)])
+def test_image_bytes_by_mode(mode, pixel_bytes):
+    image = Image.new(mode, (30, 20))
+    assert image_cache.get_image_bytes(image) == 30 * 20 * pixel_bytes
+
+
+def test_sixteen_bit_pieces_are_charged_their_size(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'deep.png')
+    Image.fromarray(np.arange(40 * 40, dtype = np.uint16).reshape(40, 40)).save(filename)
+
+    # room for the 8 bit size, not the 16 bit one
+    monkeypatch.setattr(image_cache, 'max_bytes', 40 * 40 + 100)
+    assert image_cache.get_image(filename).mode.startswith('I')
+    assert image_cache.cache_bytes == 0
+
+    monkeypatch.setattr(image_cache, 'max_bytes', 40 * 40 * 4)
+    image = image_cache.get_image(filename)
+    assert image_cache.cache_bytes == image_cache.get_image_bytes(image) >= 40 * 40 * 2
+
+
+def test_changed_file_is_decoded_again(save_piece):
+    filename, old_pixels = save_piece('a.png', 16, 8, 1)
+    assert np.array_equal(np.asarray(image_cache.get_image(filename)), old_pixels)
+
+    # same name, same size on disk, newer time
+    new_pixels = old_pixels[::-1].copy()
+    Image.fromarray(new_pixels).save(filename)
+    stat = os.stat(filename)
+    os.utime(filename, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    assert np.array_equal(np.asarray(image_cache.get_image(filename)), new_pixels)
+    assert image_cache.num_misses == 2
+
+
+@pytest.mark.parametrize('text, size', [
+    ('300000', 300000),
+    ('512M', 512 << 20),
+    ('2G', 2 << 30),
+    ('1.5g', 3 << 29),
+    ('64kb', 64 << 10),
+    (' 1T ', 1 << 40),
+    ('0', 0),
+    ('-1G', None),
+    ('lots', None),
+    ('G', None),
+    ('', None),
+])
+def test_parse_memory_size(text, size):
+    assert image_cache.parse_memory_size(text) == size
@@ -0,0 +1,465 @@
+#   Tests for image_comparator.py.  The fast versions are checked against
+#   the plain pixel by pixel loops they replaced.
+#
+
+import math
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from image_comparator import *
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Saves a random RGB image as a PNG (lossless, so the pixels read back
+#   are exactly these).
+#
+#   returns
+#       (filename, pixels)
+#
+def save_random_image(directory, name, width, height, seed):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype = np.uint8)
+    filename = str(directory / name)
+    Image.fromarray(pixels).save(filename)
+    return (filename, pixels)
+
+
+#########
+#   The original compare_edges_with_type() loop, pixel by pixel.
+#
+def reference_compare_edges(file1, file2, compare_type, offset = 0):
+    image1 = Image.open(file1)
+    image2 = Image.open(file2)
+    width = image1.width
+    bottom = image1.height - 1
+    map1 = image1.load()
+    map2 = image2.load()
+
+    if compare_type < 8:
+        masks = (HUE_MASK, SATURATION_MASK, LIGHT_MASK)
+    else:
+        masks = (RED_MASK, GREEN_MASK, BLUE_MASK)
+
+    distance_sum = 0.0
+    skipped_pixels = 0
+    for x in range(width):
+        offset_x = x + offset
+        if offset_x not in range(0, width):
+            skipped_pixels += 1
+            continue
+
+        pixel1 = map1[x, bottom]
+        pixel2 = map2[offset_x, 0]
+        dist = 0.0
+        for i in range(3):
+            if compare_type & masks[i]:
+                dist += (pixel1[i] - pixel2[i]) ** 2
+        distance_sum += math.sqrt(dist)
+
+    image2.close()
+    image1.close()
+    return distance_sum / (width - skipped_pixels)
+
+
+####################
+#   tests
+####################
+
+def test_compare_edges_with_type_matches_loop(tmp_path):
+    file1, _ = save_random_image(tmp_path, 'a.png', 97, 13, 1)
+    file2, _ = save_random_image(tmp_path, 'b.png', 97, 9, 2)
+
+    for compare_type in (HUE_MASK, HUE_MASK | LIGHT_MASK, SATURATION_MASK,
+                         RED_MASK, RED_MASK | GREEN_MASK | BLUE_MASK):
+        for offset in (0, 1, -1, 5, -96):
+            expected = reference_compare_edges(file1, file2, compare_type, offset)
+            assert compare_edges_with_type(file1, file2, compare_type, offset) == expected
+
+
+def test_compare_edges_with_type_errors(tmp_path):
+    file1, _ = save_random_image(tmp_path, 'a.png', 20, 5, 1)
+    file2, _ = save_random_image(tmp_path, 'b.png', 21, 5, 2)
+    not_an_image = tmp_path / 'c.png'
+    not_an_image.write_text('nope')
+
+    assert compare_edges_with_type(file1, file2, HUE_MASK) == None
+    assert compare_edges_with_type(file1, str(not_an_image), HUE_MASK) == None
+    assert compare_rows_with_type(np.zeros((4, 3)), np.zeros((4, 3)), HUE_MASK, 4) == None
+
+
+def test_compare_rows_with_offsets_matches_one_at_a_time():
+    rng = np.random.default_rng(3)
+    row1 = rng.integers(0, 256, (120, 3), dtype = np.uint8)
+    row2 = rng.integers(0, 256, (120, 3), dtype = np.uint8)
+
+    for compare_type in (HUE_MASK, RED_MASK | BLUE_MASK):
+        distances, best_offset = compare_rows_with_offsets(row1, row2, compare_type, 4)
+        for offset in range(-4, 5):
+            assert distances[offset + 4] == compare_rows_with_type(row1, row2, compare_type, offset)
+        assert distances[best_offset + 4] == np.min(distances)
+
+
+def test_compare_rows_with_offsets_finds_shift():
+    rng = np.random.default_rng(4)
+    row1 = rng.integers(0, 256, (200, 3), dtype = np.uint8)
+
+    # row2[x + 3] is row1[x], so offset 3 lines them up
+    row2 = np.roll(row1, 3, axis = 0)
+    distances, best_offset = compare_rows_with_offsets(row1, row2, RED_MASK, 5)
+    assert best_offset == 3
+    assert distances[3 + 5] == 0.0
+
+    # ties go to the smallest shift
+    flat = np.zeros((50, 3), dtype = np.uint8)
+    assert compare_rows_with_offsets(flat, flat, RED_MASK, 3)[1] == 0
+
+
+def test_compare_edges_using_blocks_matches_block_loop(tmp_path):
+    file1, _ = save_random_image(tmp_path, 'a.png', 45, 11, 5)
+    file2, _ = save_random_image(tmp_path, 'b.png', 45, 7, 6)
+
+    image1 = Image.open(file1)
+    image2 = Image.open(file2)
+    map1 = image1.load()
+    map2 = image2.load()
+    bottom = image1.height - 1
+
+    for block_size in (1, 2, 3, 7):
+        # the old way: every block's average, one pixel at a time (HUE is
+        # the first color plane)
+        distance_sum = 0.0
+        for x in range(image1.width):
+            color1 = find_average_color_in_block(map1, image1.width, (x, bottom), block_size, True, HUE_MASK)
+            color2 = find_average_color_in_block(map2, image2.width, (x, 0), block_size, False, HUE_MASK)
+            distance_sum += abs(color1 - color2)
+        expected = distance_sum / image1.width
+
+        assert compare_edges_using_blocks(file1, file2, block_size) == pytest.approx(expected, rel = 1e-12)
+
+    image2.close()
+    image1.close()
+
+    # blocks taller than the bottom piece can't be made
+    assert compare_edges_using_blocks(file1, file2, 8) == None
+
+
+def test_row_distance_blocks_match_pixel_loop():
+    from find_match_rows import find_difference_between_two_rows
+
+    rng = np.random.default_rng(7)
+    pixels1 = rng.integers(0, 256, (11, 9, 3), dtype = np.uint8)
+    pixels2 = rng.integers(0, 256, (13, 9, 3), dtype = np.uint8)
+    compare_type = RED_MASK | GREEN_MASK | BLUE_MASK
+    map1 = Image.fromarray(pixels1).load()
+    map2 = Image.fromarray(pixels2).load()
+
+    # small chunks, so the blocks don't line up with the images
+    distances = np.full((11, 13), np.nan)
+    for start1, start2, block in find_row_distance_blocks(pixels1, pixels2, compare_type, chunk_size = 4):
+        distances[start1:start1 + block.shape[0], start2:start2 + block.shape[1]] = block
+
+    for row1 in range(11):
+        for row2 in range(13):
+            squares = [sum((int(pixels1[row1, x, i]) - int(pixels2[row2, x, i])) ** 2 for i in range(3))
+                       for x in range(9)]
+            assert distances[row1, row2] == pytest.approx(sum(squares) / 9, rel = 1e-9, abs = 1e-9)
+
+            # the RMS distance is never below the average distance
+            average = find_difference_between_two_rows(map1, row1, 9, map2, row2, 9)
+            assert math.sqrt(distances[row1, row2]) >= average - 1e-9
+
+    pairs = find_best_row_pairs(pixels1, pixels2, compare_type, num_pairs = 5, chunk_size = 4)
+    expected = sorted((distances[r1, r2], r1, r2) for r1 in range(11) for r2 in range(13))[:5]
+    assert [(r1, r2) for _, r1, r2 in pairs] == [(r1, r2) for _, r1, r2 in expected]
+    assert [d for d, _, _ in pairs] == pytest.approx([math.sqrt(d) for d, _, _ in expected])
+
+
+def test_closest_row_pairs_match_the_pixel_loop():
+    from find_match_rows import find_difference_between_two_rows
+
+    # Rows 0-39 of the second image are rows of the first, a little off
+    # everywhere.  Row 40 is row 45 way off in just one pixel: a smaller
+    # average distance, but a much bigger RMS distance, than all of those.
+    rng = np.random.default_rng(9)
+    pixels1 = rng.integers(20, 200, (50, 16, 3), dtype = np.uint8)
+    pixels2 = np.concatenate((pixels1[:40] + 8, pixels1[45:46], rng.integers(0, 256, (9, 16, 3), dtype = np.uint8)))
+    pixels2[40, 5] += 50
+    map1 = Image.fromarray(pixels1).load()
+    map2 = Image.fromarray(pixels2).load()
+
+    expected = sorted((find_difference_between_two_rows(map1, row1, 16, map2, row2, 16), row1, row2)
+                      for row1 in range(50) for row2 in range(50))
+    assert expected[0][1:] == (45, 40)
+
+    compare_type = RED_MASK | GREEN_MASK | BLUE_MASK
+    for num_pairs in (1, 10, 60):
+        for chunk_size in (7, ROW_CHUNK_SIZE):
+            pairs = find_closest_row_pairs(pixels1, pixels2, compare_type, num_pairs, chunk_size)
+            assert pairs == expected[:num_pairs]
+
+    # the best 32 by RMS distance don't even have it
+    assert (45, 40) not in [pair[1:] for pair in find_best_row_pairs(pixels1, pixels2, compare_type, 32)]
+    assert find_closest_row_pairs(pixels1, pixels2[:, :15], compare_type) == None
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_closest_row_pairs_ties_and_flat_rows(seed):
+    # few colors, so there are lots of ties (and rows all one color)
+    rng = np.random.default_rng(seed)
+    pixels1 = rng.choice([0, 40, 255], (30, int(rng.integers(1, 12)), 3)).astype(np.uint8)
+    pixels2 = rng.choice([0, 40, 255], (25, pixels1.shape[1], 3)).astype(np.uint8)
+    pixels1[3] = 40
+    pixels2[7] = 40
+
+    compare_type = RED_MASK | GREEN_MASK | BLUE_MASK
+    expected = sorted((compare_rows_with_type(pixels1[row1], pixels2[row2], compare_type), row1, row2)
+                      for row1 in range(30) for row2 in range(25))
+    assert find_closest_row_pairs(pixels1, pixels2, compare_type, 20, chunk_size = 6) == expected[:20]
+
+
+def test_find_best_row_pairs_finds_copied_row():
+    rng = np.random.default_rng(8)
+    pixels1 = rng.integers(0, 256, (40, 16, 3), dtype = np.uint8)
+    pixels2 = rng.integers(0, 256, (30, 16, 3), dtype = np.uint8)
+    pixels2[17] = pixels1[25]
+
+    distance, row1, row2 = find_best_row_pairs(pixels1, pixels2, RED_MASK | GREEN_MASK | BLUE_MASK)[0]
+    assert (row1, row2) == (25, 17)
+    assert distance == pytest.approx(0.0, abs = 1e-6)
+    assert find_best_row_pairs(pixels1, pixels2[:, :15], RED_MASK) == None
+
+
+def test_find_overlap_distances_matches_row_by_row():
+    rng = np.random.default_rng(9)
+    pixels1 = rng.integers(0, 256, (30, 12, 3), dtype = np.uint8)
+    pixels2 = rng.integers(0, 256, (25, 12, 3), dtype = np.uint8)
+    compare_type = RED_MASK | GREEN_MASK
+
+    scores = find_overlap_distances(pixels1, pixels2, compare_type)
+    assert len(scores) == 26
+    assert scores[0] == np.inf
+    for overlap in range(1, 26):
+        top = pixels1[30 - overlap:, :, :2].astype(np.float64)
+        bottom = pixels2[:overlap, :, :2].astype(np.float64)
+        expected = np.sum((top - bottom) ** 2) / (overlap * 12)
+        assert scores[overlap] == pytest.approx(expected, rel = 1e-9, abs = 1e-6)
+
+    assert len(find_overlap_distances(pixels1, pixels2, compare_type, max_overlap = 10)) == 11
+
+
+def test_find_best_overlap_finds_shared_rows():
+    rng = np.random.default_rng(10)
+    scroll = rng.integers(0, 256, (100, 20, 3), dtype = np.uint8)
+
+    # the pieces share rows 50 through 59
+    overlap, distance = find_best_overlap(scroll[:60], scroll[50:], RED_MASK | GREEN_MASK | BLUE_MASK)
+    assert overlap == 10
+    assert distance == pytest.approx(0.0, abs = 1e-5)
+    assert find_best_overlap(scroll[:3], scroll[2:5], RED_MASK) == None
+
+
+def test_find_translation_finds_known_shift():
+    rng = np.random.default_rng(11)
+    scene = rng.integers(0, 256, (120, 140, 3), dtype = np.uint8)
+
+    for dx, dy in ((0, 0), (5, -3), (-7, 11)):
+        pixels1 = scene[30:80, 30:100]
+        pixels2 = scene[30 - dy:80 - dy, 30 - dx:100 - dx]
+        found_dx, found_dy, peak = find_translation(pixels1, pixels2, RED_MASK | GREEN_MASK | BLUE_MASK)
+        assert (found_dx, found_dy) == (dx, dy)
+        assert peak > 0.3
+
+        found_dx, found_dy, _ = find_translation(pixels1, pixels2, HUE_MASK, subpixel = True)
+        assert found_dx == pytest.approx(dx, abs = 0.1)
+        assert found_dy == pytest.approx(dy, abs = 0.1)
+
+
+def test_find_overlap_alignment_gives_joiner_overlap_and_offset():
+    rng = np.random.default_rng(12)
+    scroll = rng.integers(0, 256, (120, 40, 3), dtype = np.uint8)
+
+    # the top piece is rows 0-59, the bottom piece starts at row 52 and is
+    # cut 3 columns further right
+    top_band = scroll[40:60, 0:30]
+    bottom_band = scroll[52:72, 3:33]
+    overlap, offset, peak = find_overlap_alignment(top_band, bottom_band, RED_MASK | GREEN_MASK | BLUE_MASK)
+    assert (overlap, offset) == (8.0, 3.0)
+    assert peak > 0.1
+
+
+def test_find_overlap_alignment_short_bottom_piece():
+    rng = np.random.default_rng(14)
+    scroll = rng.integers(0, 256, (120, 40, 3), dtype = np.uint8)
+
+    # a 12 row bottom piece that lines up 30 rows into a 60 row band (it'd
+    # overlap by 30 if it were taller), and one that goes past the bottom
+    top_band = scroll[0:60]
+    compare_type = RED_MASK | GREEN_MASK | BLUE_MASK
+    assert find_overlap_alignment(top_band, scroll[30:42], compare_type)[:2] == (12.0, 0.0)
+    assert find_overlap_alignment(top_band[:10], scroll[0:30], compare_type)[0] <= 10.0
+
+    for bottom_band in (scroll[30:42], scroll[55:70], scroll[0:30]):
+        overlap, offset, peak = find_overlap_alignment(top_band, bottom_band, compare_type)
+        assert 0 < overlap <= min(len(top_band), len(bottom_band))
+
+
+def test_compare_rows_pyramid_matches_exhaustive_search():
+    rng = np.random.default_rng(13)
+    compare_type = RED_MASK | GREEN_MASK | BLUE_MASK
+
+    # high contrast noise, lined up at odd offsets (the blocks of the two
+    # rows don't line up there)
+    for shift in (-11, 7, 1, 0):
+        base = rng.integers(100, 228, (640, 3), dtype = np.uint8)
+        row1 = base[40:540]
+        row2 = base[40 + shift:540 + shift]
+        distances, best_offset = compare_rows_with_offsets(row1, row2, compare_type, 32)
+        assert compare_rows_pyramid(row1, row2, compare_type, 32) == (distances[best_offset + 32], best_offset)
+        assert best_offset == -shift
+
+    # rows that don't match anywhere stay past the tolerance
+    row1 = rng.integers(0, 256, (500, 3), dtype = np.uint8)
+    row2 = rng.integers(0, 256, (500, 3), dtype = np.uint8)
+    distance, _ = compare_rows_pyramid(row1, row2, compare_type, 32)
+    assert distance >= TOLERANCE
+
+    assert compare_rows_pyramid(row1, row2[:400], compare_type, 32) == None
+
+
+def test_column_comparisons_match_transposed_rows(tmp_path):
+    file1, pixels1 = save_random_image(tmp_path, 'a.png', 11, 53, 14)
+    file2, pixels2 = save_random_image(tmp_path, 'b.png', 7, 53, 15)
+
+    # turned on their sides, the right column of a is the bottom row of
+    # at and the left column of b is the top row of bt
+    transposed1 = str(tmp_path / 'at.png')
+    transposed2 = str(tmp_path / 'bt.png')
+    Image.fromarray(pixels1.transpose(1, 0, 2).copy()).save(transposed1)
+    Image.fromarray(pixels2.transpose(1, 0, 2).copy()).save(transposed2)
+
+    for compare_type in (HUE_MASK, RED_MASK | GREEN_MASK | BLUE_MASK):
+        for offset in (0, 2, -3):
+            expected = reference_compare_edges(transposed1, transposed2, compare_type, offset)
+            assert compare_columns_with_type(file1, file2, compare_type, offset) == expected
+
+        distances, best_offset = compare_columns_with_offsets(file1, file2, compare_type, 4)
+        for offset in range(-4, 5):
+            assert distances[offset + 4] == reference_compare_edges(transposed1, transposed2, compare_type, offset)
+
+    for block_size in (1, 3, 7):
+        assert compare_columns_using_blocks(file1, file2, block_size) == \
+               compare_edges_using_blocks(transposed1, transposed2, block_size)
+
+    # side by side pieces need the same heights
+    file3, _ = save_random_image(tmp_path, 'c.png', 7, 52, 16)
+    assert compare_columns_with_type(file1, file3, HUE_MASK) == None
+    assert compare_columns_using_blocks(file1, file2, 8) == None
+
+
+def test_bounded_comparisons_give_the_exact_decision():
+    rng = np.random.default_rng(17)
+    compare_type = RED_MASK | GREEN_MASK | BLUE_MASK
+
+    # noise from none at all to well past the tolerance, so plenty of
+    # seams land on each side of it (and some close to it)
+    for amount in range(0, 24):
+        row1 = rng.integers(30, 226, (1500, 3), dtype = np.uint8)
+        noise = rng.integers(-amount, amount + 1, (1500, 3))
+        row2 = (row1 + noise).astype(np.uint8)
+
+        for offset in (0, 1, -2):
+            exact = compare_rows_with_type(row1, row2, compare_type, offset)
+            within, distance = compare_rows_bounded(row1, row2, compare_type, offset)
+            assert within == (exact < TOLERANCE)
+            assert distance <= exact
+
+            # one chunk covering everything is the full scan
+            assert compare_rows_bounded(row1, row2, compare_type, offset, chunk_size = 1500) == \
+                   (exact < TOLERANCE, exact)
+
+        distances, best_offset = compare_rows_with_offsets(row1, row2, compare_type, 2)
+        within, distance, offset = find_matching_offset(row1, row2, compare_type, 2)
+        assert within == (distances[best_offset + 2] < TOLERANCE)
+        if within:
+            assert distances[offset + 2] < TOLERANCE
+
+    assert compare_rows_bounded(row1, row2[1:], compare_type) == (None, None)
+    assert find_matching_offset(row1, row2[1:], compare_type) == (None, None, None)
+
+
+def test_sampled_comparisons_agree_with_the_full_scan():
+    rng = np.random.default_rng(18)
+    compare_type = RED_MASK | GREEN_MASK | BLUE_MASK
+
+    # every batch has one column from each strip, and all the columns
+    # show up exactly once
+    order = get_stratified_order(1000, 64, np.random.default_rng(0))
+    assert sorted(order) == list(range(1000))
+    strips = np.arange(1000) * 64 // 1000
+    assert sorted(strips[order[:64]]) == list(range(64))
+
+    for amount in (0, 2, 5, 20, 40, 80):
+        row1 = rng.integers(0, 256, (4000, 3), dtype = np.uint8)
+        noise = rng.integers(-amount, amount + 1, (4000, 3))
+        row2 = np.clip(row1 + noise, 0, 255).astype(np.uint8)
+
+        for offset in (0, 3):
+            exact = compare_rows_with_type(row1, row2, compare_type, offset)
+            within, distance, examined = compare_rows_sampled(row1, row2, compare_type, offset)
+            assert within == (exact < TOLERANCE)
+
+            # clear cut seams are decided from a sample
+            assert examined < 4000 - offset
+
+        within, distance, offset = find_matching_offset(row1, row2, compare_type, 2, sample = True)
+        assert within == (compare_rows_with_type(row1, row2, compare_type) < TOLERANCE)
+
+    # a seam right at the tolerance isn't clear from a sample, so it ends
+    # up looking at everything and gets the exact answer
+    row1 = np.zeros((300, 3), dtype = np.uint8)
+    row2 = np.full((300, 3), 7, dtype = np.uint8)
+    row2[::2] = 6
+    exact = compare_rows_with_type(row1, row2, compare_type)
+    assert compare_rows_sampled(row1, row2, compare_type, tolerance = exact) == (False, exact, 300)
+
+    assert compare_rows_sampled(row1, row2[1:], compare_type) == (None, None, 0)
+
+
+def test_compare_row_to_many_matches_one_at_a_time(monkeypatch):
+    rng = np.random.default_rng(19)
+    row = rng.integers(0, 256, (90, 3), dtype = np.uint8)
+    rows = rng.integers(0, 256, (12, 90, 3), dtype = np.uint8)
+    rows[4] = row
+    rows[7, 2:] = row[:-2]
+
+    # flat rows tie at every offset
+    rows[9] = 0
+    flat = np.zeros((90, 3), dtype = np.uint8)
+
+    # small chunks too, so the candidates get split up
+    import image_comparator
+    for chunk_pixels in (image_comparator.MANY_CHUNK_PIXELS, 500):
+        monkeypatch.setattr(image_comparator, 'MANY_CHUNK_PIXELS', chunk_pixels)
+        for compare_type in (HUE_MASK, RED_MASK | BLUE_MASK):
+            for first in (row, flat):
+                for max_shift in (0, 3):
+                    distances, best_offsets = compare_row_to_many(first, rows, compare_type, max_shift)
+                    for n in range(len(rows)):
+                        averages, best_offset = compare_rows_with_offsets(first, rows[n], compare_type, max_shift)
+                        assert (distances[n], best_offsets[n]) == (averages[best_offset + max_shift], best_offset)
+
+    assert compare_row_to_many(row, rows[:, 1:], HUE_MASK) == None
+
+    # the stacks group edges of the same size and skip the missing ones
+    edges = [rows[0], None, rows[1, :50], rows[2], rows[3, :50]]
+    stacks = stack_edges_by_width(edges)
+    assert sorted(stacks) == [(50, 3), (90, 3)]
+    indices, stack = stacks[(90, 3)]
+    assert list(indices) == [0, 3]
+    assert np.array_equal(stack, rows[[0, 2]])
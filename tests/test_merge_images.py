@@ -0,0 +1,130 @@
+#   Tests for merge_images.py.  Joining in file order (as a pipeline, with
+#   one worker or several) has to give back the images the pieces were
+#   cut from, and leave the pieces that don't go with anything alone.
+#
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import canvas
+import merge_images
+import strip_writer
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Runs each test in its own directory with the settings back at their
+#   defaults (conftest.py sees to the caches).
+#
+@pytest.fixture(autouse = True)
+def fresh_settings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(merge_images, 'file_list', [])
+    monkeypatch.setattr(merge_images, 'pieces', {})
+    monkeypatch.setattr(merge_images, 'unjoined_file_list', [])
+    monkeypatch.setattr(merge_images, 'output_file_count', 0)
+    monkeypatch.setattr(merge_images, 'num_joined_files', 0)
+    monkeypatch.setattr(merge_images, 'num_workers', 1)
+    monkeypatch.setattr(merge_images, 'horizontal', False)
+    monkeypatch.setattr(merge_images, 'out_of_core', False)
+    monkeypatch.setattr(merge_images, 'output_extension', '.png')
+
+
+#########
+#   Makes an image that changes slowly from top to bottom (so the rows on
+#   either side of a cut match) but not from side to side (so it doesn't
+#   match any other image).
+#
+def make_image(width, height, seed):
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 200, (1, width, 3))
+    slope = np.arange(height)[:, np.newaxis, np.newaxis] // 8
+    return (base + slope).astype(np.uint8)
+
+
+#########
+#   Saves the given rows of an image as a piece.
+#
+def save_piece(name, pixels):
+    Image.fromarray(pixels).save(name)
+
+
+#########
+#   Reads an assembled image back.
+#
+def read_image(name):
+    with Image.open(name) as image:
+        return np.asarray(image.convert('RGB'))
+
+
+####################
+#   tests
+####################
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('out_of_core', [False, True])
+def test_join_in_file_order(tmp_path, monkeypatch, workers, out_of_core):
+    monkeypatch.setattr(merge_images, 'num_workers', workers)
+    monkeypatch.setattr(merge_images, 'out_of_core', out_of_core)
+
+    # two images mixed together (different widths), a file that isn't an
+    # image, and a piece that doesn't go with anything
+    image_a = make_image(40, 60, 70)
+    image_b = make_image(30, 40, 71)
+    save_piece('p1.png', image_a[:20])
+    save_piece('p2.png', image_b[:25])
+    save_piece('p3.png', image_a[20:45])
+    (tmp_path / 'p4.txt').write_text('notes')
+    save_piece('p5.png', image_b[25:])
+    save_piece('p6.png', image_a[45:])
+    save_piece('p7.png', make_image(40, 10, 72))
+
+    merge_images.join_in_file_order()
+
+    assert merge_images.num_joined_files == 2
+    assert np.array_equal(read_image('assembled_0.png'), image_a)
+    assert np.array_equal(read_image('assembled_1.png'), image_b)
+    assert sorted(merge_images.unjoined_file_list) == ['p4.txt', 'p7.png']
+    assert merge_images.file_list == ['p1.png', 'p2.png', 'p3.png', 'p4.txt', 'p5.png', 'p6.png', 'p7.png']
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_failed_stream_stops_the_run(monkeypatch, workers):
+    monkeypatch.setattr(merge_images, 'num_workers', workers)
+    monkeypatch.setattr(merge_images, 'out_of_core', True)
+    monkeypatch.setattr(strip_writer, 'open_writer', lambda filename, width, height: None)
+    image = make_image(40, 60, 73)
+    save_piece('p1.png', image[:30])
+    save_piece('p2.png', image[30:])
+
+    with pytest.raises(SystemExit):
+        merge_images.join_in_file_order()
+
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_piece_that_cant_be_opened_is_skipped(monkeypatch, capsys, stream):
+    image = make_image(40, 60, 74)
+    save_piece('p1.png', image[:30])
+    save_piece('p2.png', image[30:])
+    monkeypatch.setattr(merge_images, 'pieces', {'p1.png': (40, 30, 'RGB', 1), 'p2.png': (40, 30, 'RGB', 1)})
+
+    # the second piece goes bad after its header was read
+    with open('p2.png', 'r+b') as file:
+        file.truncate(60)
+
+    if stream:
+        assert merge_images.stream_pieces(['p1.png', 'p2.png'], 'joined.png')
+    else:
+        joined = merge_images.paste_pieces(['p1.png', 'p2.png'])
+        assert canvas.save_canvas(joined, 'joined.png')
+        canvas.close_canvas(joined)
+
+    # the rows it would have had are left black
+    joined = read_image('joined.png')
+    assert np.array_equal(joined[:30], image[:30])
+    assert not joined[30:].any()
+    assert 'p2.png' in capsys.readouterr().out
@@ -0,0 +1,94 @@
+#   Tests for merge_images2.py.  Every way of assembling the groups (one
+#   at a time, in worker processes, written straight to the file) has to
+#   give back the images the pieces were cut from.
+#
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import merge_images2
+import strip_writer
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Runs each test in its own directory with the settings back at their
+#   defaults.
+#
+@pytest.fixture(autouse = True)
+def fresh_settings(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(merge_images2, 'piece_sizes', {})
+    monkeypatch.setattr(merge_images2, 'horizontal', False)
+    monkeypatch.setattr(merge_images2, 'num_workers', 1)
+    monkeypatch.setattr(merge_images2, 'out_of_core', False)
+    monkeypatch.setattr(merge_images2, 'output_extension', '.png')
+
+
+#########
+#   Cuts images into pieces (saved as PNGs, p00.png, p01.png, ...).
+#
+#   returns
+#       (file_list, images)  The images are the arrays the pieces came
+#                            from, in order.
+#
+def cut_images(num_images, pieces_per_image, horizontal, seed):
+    rng = np.random.default_rng(seed)
+    file_list = []
+    images = []
+    for k in range(num_images):
+        image = rng.integers(0, 256, (20 * pieces_per_image, 24, 3), dtype = np.uint8)
+        if horizontal:
+            image = image.transpose(1, 0, 2).copy()
+        images.append(image)
+
+        for piece in np.array_split(image, pieces_per_image, axis = 1 if horizontal else 0):
+            name = f'p{len(file_list):02d}.png'
+            Image.fromarray(piece).save(name)
+            file_list.append(name)
+
+    return (file_list, images)
+
+
+#########
+#   Reads back the assembled images (the names come from the first piece
+#   of each group).
+#
+def read_assembled(file_list, pieces_per_image):
+    assembled = []
+    for first in file_list[::pieces_per_image]:
+        name = f'{merge_images2.FILE_PREFIX}{merge_images2.get_numerical_suffix(first)}.png'
+        with Image.open(name) as image:
+            assembled.append(np.asarray(image.convert('RGB')))
+    return assembled
+
+
+####################
+#   tests
+####################
+
+@pytest.mark.parametrize('horizontal', [False, True])
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('out_of_core', [False, True])
+def test_groups_come_back_together(monkeypatch, horizontal, workers, out_of_core):
+    monkeypatch.setattr(merge_images2, 'horizontal', horizontal)
+    monkeypatch.setattr(merge_images2, 'num_workers', workers)
+    monkeypatch.setattr(merge_images2, 'out_of_core', out_of_core)
+    file_list, images = cut_images(4, 3, horizontal, 60)
+
+    assert merge_images2.build_all_pieces(3, file_list, False) == 4
+    for assembled, image in zip(read_assembled(file_list, 3), images):
+        assert np.array_equal(assembled, image)
+
+
+def test_failed_stream_stops_the_run(monkeypatch):
+    monkeypatch.setattr(merge_images2, 'out_of_core', True)
+    monkeypatch.setattr(strip_writer, 'open_writer', lambda filename, width, height: None)
+    file_list, images = cut_images(1, 2, False, 61)
+
+    with pytest.raises(SystemExit):
+        merge_images2.join_files(file_list, None, 'assembled_00.png', False, on_disk = True)
@@ -0,0 +1,76 @@
+#   Tests for pair_scoring.py.  Every way of scoring a seam has to come
+#   to the same yes or no as comparing it at every offset.
+#
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pytest
+
+import edge_cache
+import pair_scoring
+import pipeline
+from image_comparator import TOLERANCE, RED_MASK, GREEN_MASK, BLUE_MASK
+from image_comparator import compare_rows_with_offsets
+
+
+RGB_MASK = RED_MASK | GREEN_MASK | BLUE_MASK
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Pairs of edges from a perfect match to no match at all.
+#
+def make_seams(seed):
+    rng = np.random.default_rng(seed)
+    seams = []
+    for amount in (0, 3, 8, 12, 16, 30, 128):
+        edge1 = rng.integers(30, 226, (700, 3), dtype = np.uint8)
+        edge2 = (edge1 + rng.integers(-amount, amount + 1, edge1.shape)).astype(np.uint8)
+        seams.append((edge1, np.roll(edge2, amount % 3, axis = 0)))
+    return seams
+
+
+####################
+#   tests
+####################
+
+@pytest.mark.parametrize('use_pyramid, use_sampling', [(False, False), (True, False), (False, True)])
+def test_score_edges_gives_the_exact_decision(use_pyramid, use_sampling):
+    for edge1, edge2 in make_seams(40):
+        distances, best_offset = compare_rows_with_offsets(edge1, edge2, RGB_MASK, 2)
+        best = distances[best_offset + 2]
+
+        matched, distance, offset = pair_scoring.score_edges(edge1, edge2, RGB_MASK, 2, use_pyramid, use_sampling)
+        assert matched == (best < TOLERANCE)
+        if matched and use_pyramid:
+            assert (distance, offset) == (best, best_offset)
+
+    assert pair_scoring.score_edges(edge1, edge2[1:], RGB_MASK, 2, use_pyramid, use_sampling) == (None, None, None)
+
+
+def test_decode_workers_find_the_same_edges(tmp_path, save_piece):
+    file1, pixels1 = save_piece('a.png', 31, 17, 1)
+    file2, pixels2 = save_piece('b.png', 31, 12, 2)
+    (tmp_path / 'notes.txt').write_text('not a picture')
+
+    # a is in the sidecar, b isn't
+    edge_cache.get_edge_signature(file1)
+    edge_cache.save_sidecar(str(tmp_path))
+
+    names = ['a.png', 'b.png', 'notes.txt']
+    with ProcessPoolExecutor(max_workers = 2, mp_context = pipeline.get_process_context(),
+                             initializer = pair_scoring.init_worker, initargs = (str(tmp_path), True)) as executor:
+        found = list(executor.map(edge_cache.load_edge_signature, names))
+
+    for (key, signature, decoded), pixels, was_decoded in zip(found, (pixels1, pixels2), (False, True)):
+        assert decoded == was_decoded
+        assert np.array_equal(signature['bottom'], pixels[-1])
+        assert np.array_equal(signature['top'], pixels[0])
+        assert np.array_equal(signature['left'], pixels[:, 0])
+        assert np.array_equal(signature['right'], pixels[:, -1])
+
+    assert found[2][1] == None
@@ -0,0 +1,124 @@
+#   Tests for piece_index.py.  What's read from the headers has to be
+#   what Pillow finds when it opens the whole file.
+#
+
+import pytest
+from PIL import Image, features
+
+import edge_cache
+import piece_index
+
+
+####################
+#   helpers
+####################
+
+#########
+#   The formats to try: (file name, save() arguments, mode).
+#
+SAVED_FORMATS = [
+    ('a.jpg', {}, 'RGB'),
+    ('a.png', {}, 'RGBA'),
+    ('a.gif', {}, 'P'),
+    ('a.tif', {}, 'RGB'),
+    ('b.tif', {'compression': 'tiff_deflate'}, 'L'),
+    ('a.bmp', {}, 'RGB'),
+    ('a.ppm', {}, 'RGB'),
+    ('a.pgm', {}, 'L'),
+]
+if features.check('webp'):
+    SAVED_FORMATS.append(('a.webp', {}, 'RGB'))
+if features.check('jpg_2000'):
+    SAVED_FORMATS.append(('a.jp2', {}, 'RGB'))
+    SAVED_FORMATS.append(('a.j2k', {}, 'RGB'))
+
+
+####################
+#   tests
+####################
+
+@pytest.mark.parametrize('name, save_args, mode', SAVED_FORMATS)
+def test_header_matches_pillow(name, save_args, mode, save_piece):
+    filename, _ = save_piece(name, 37, 21, mode = mode, **save_args)
+
+    with open(filename, 'rb') as file:
+        image_format = piece_index.sniff_image_format(file.read(piece_index.SNIFF_SIZE))
+    image = Image.open(filename)
+    assert image_format == image.format
+    assert piece_index.read_piece_header(filename) == (image.width, image.height, image.mode, 1)
+    image.close()
+
+
+def test_header_keeps_the_orientation(save_piece):
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    filename, _ = save_piece('a.jpg', 30, 20, exif = exif)
+
+    # the size as stored, not as it's shown
+    assert piece_index.read_piece_header(filename) == (30, 20, 'RGB', 6)
+
+
+def test_not_images(tmp_path):
+    (tmp_path / 'notes.txt').write_text('not a picture')
+    (tmp_path / 'fake.png').write_bytes(b'\x89PNG\r\n\x1a\n' + b'\x00' * 40)
+
+    assert piece_index.sniff_image_format(b'not a picture') == None
+    assert piece_index.read_piece_header(str(tmp_path / 'notes.txt')) == None
+    assert piece_index.read_piece_header(str(tmp_path / 'fake.png')) == None
+    assert piece_index.read_piece_header(str(tmp_path / 'missing.png')) == None
+
+
+@pytest.mark.parametrize('name, mode', [('a.tga', 'RGB'), ('a.pcx', 'RGB'), ('a.sgi', 'RGB'), ('a.ico', 'RGBA')])
+def test_header_of_formats_without_magic(name, mode, save_piece):
+    filename, _ = save_piece(name, 32, 32, mode = mode)
+
+    with open(filename, 'rb') as file:
+        assert piece_index.sniff_image_format(file.read(piece_index.SNIFF_SIZE)) == None
+    image = Image.open(filename)
+    assert piece_index.read_piece_header(filename) == (image.width, image.height, image.mode, 1)
+    image.close()
+
+
+def test_header_comes_from_the_sidecar(tmp_path, monkeypatch, save_piece):
+    filename, _ = save_piece('a.png', 33, 12)
+    edge_cache.get_edge_signature(filename)
+    edge_cache.save_sidecar(str(tmp_path))
+    edge_cache.load_sidecar(str(tmp_path))
+
+    # the file doesn't even get opened
+    def no_opening(*args, **kwargs):
+        raise AssertionError('opened the file')
+    monkeypatch.setattr(Image, 'open', no_opening)
+    assert piece_index.read_piece_header(filename) == (33, 12, 'RGB', 1)
+
+
+def test_list_files(tmp_path):
+    for name in ('c.png', 'a.txt', 'skip.me', 'b.jpg'):
+        (tmp_path / name).write_text('x')
+    (tmp_path / 'folder').mkdir()
+
+    assert piece_index.list_files(str(tmp_path), skip = ['skip.me']) == ['a.txt', 'b.jpg', 'c.png']
+
+
+def test_discover_pieces_matches_pillow(tmp_path, save_piece):
+    sizes = {}
+    for k in range(40):
+        width, height = 10 + k % 7, 5 + k % 11
+        name = f'piece{k:03d}.' + ('png', 'jpg', 'bmp', 'tif')[k % 4]
+        save_piece(name, width, height)
+        sizes[name] = (width, height)
+    (tmp_path / 'notes.txt').write_text('not a picture')
+    (tmp_path / 'skip.me').write_text('x')
+    (tmp_path / 'folder').mkdir()
+
+    file_list, index = piece_index.discover_pieces(str(tmp_path), skip = ['skip.me'], threads = 4)
+
+    assert file_list == sorted(list(sizes) + ['notes.txt'])
+    assert index['notes.txt'] == None
+    for name in sizes:
+        with Image.open(tmp_path / name) as image:
+            assert index[name] == (image.width, image.height, image.mode, 1)
+        assert index[name][:2] == sizes[name]
+
+    # one thread reads the same thing
+    assert piece_index.discover_pieces(str(tmp_path), skip = ['skip.me'], threads = 1) == (file_list, index)
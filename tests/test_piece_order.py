@@ -0,0 +1,181 @@
+#   Tests for piece_order.py.  The costs are checked against comparing
+#   every pair one at a time and the links against trying every possible
+#   set of links.
+#
+
+import itertools
+
+import numpy as np
+import pytest
+
+import piece_order
+from image_comparator import TOLERANCE, RED_MASK, GREEN_MASK, BLUE_MASK
+from image_comparator import compare_rows_with_offsets
+
+
+####################
+#   helpers
+####################
+
+#########
+#   The cheapest possible total for a cost matrix, found by trying every
+#   set of links (each piece with at most one below it and one above it).
+#   A piece with nothing below it costs the tolerance.
+#
+def brute_force_total(costs, tolerance):
+    count = len(costs)
+    best = np.inf
+    for choice in itertools.product(range(-1, count), repeat = count):
+        below = [j for j in choice if j != -1]
+        if len(below) != len(set(below)):
+            continue
+
+        total = 0.0
+        for i, j in enumerate(choice):
+            total += tolerance if j == -1 else costs[i, j]
+        best = min(best, total)
+
+    return best
+
+
+#########
+#   Makes a tall strip and cuts it into pieces, returning the pieces'
+#   (bottoms, tops) lists in a shuffled order and the right order of them.
+#
+def cut_strip(num_pieces, width, seed):
+    rng = np.random.default_rng(seed)
+
+    # smooth down the strip (so the rows either side of a cut are close)
+    # but different from column to column
+    steps = rng.integers(-2, 3, (num_pieces * 4, width, 3))
+    strip = np.clip(128 + np.cumsum(steps, axis = 0), 0, 255).astype(np.uint8)
+    strip[:, :, 0] = rng.integers(0, 256, width, dtype = np.uint8)
+    pieces = [strip[k * 4:(k + 1) * 4] for k in range(num_pieces)]
+
+    shuffle = rng.permutation(num_pieces)
+    bottoms = [pieces[k][-1] for k in shuffle]
+    tops = [pieces[k][0] for k in shuffle]
+
+    # where each piece of the strip ended up
+    right_order = [int(np.nonzero(shuffle == k)[0][0]) for k in range(num_pieces)]
+    return (bottoms, tops, right_order)
+
+
+####################
+#   tests
+####################
+
+def test_cost_matrix_matches_pair_by_pair():
+    rng = np.random.default_rng(20)
+    compare_type = RED_MASK | GREEN_MASK | BLUE_MASK
+    base = rng.integers(40, 216, (200, 3))
+
+    # edges near one shared row, some closer to it than others
+    amounts = [0, 2, 4, 6, 9, 12, 20, 40]
+    bottoms = np.stack([base + rng.integers(-a, a + 1, base.shape) for a in amounts]).astype(np.uint8)
+    tops = np.stack([base + rng.integers(-a, a + 1, base.shape) for a in amounts]).astype(np.uint8)
+
+    for max_shift in (0, 2):
+        costs, offsets = piece_order.build_cost_matrix(bottoms, tops, compare_type, max_shift)
+        assert np.isfinite(costs).any() and not np.isfinite(costs).all()
+
+        for i in range(len(amounts)):
+            for j in range(len(amounts)):
+                if i == j:
+                    assert costs[i, j] == np.inf
+                    continue
+
+                distances, best_offset = compare_rows_with_offsets(bottoms[i], tops[j], compare_type, max_shift)
+                distance = distances[best_offset + max_shift]
+                if distance < TOLERANCE:
+                    assert (costs[i, j], offsets[i, j]) == (distance, best_offset)
+                else:
+                    assert costs[i, j] == np.inf
+
+
+@pytest.mark.skipif(piece_order.linear_sum_assignment == None, reason = 'needs SciPy')
+def test_assignment_finds_the_cheapest_links():
+    rng = np.random.default_rng(21)
+    for trial in range(20):
+        costs = rng.uniform(0.0, 2.0 * TOLERANCE, (5, 5))
+        costs[costs >= TOLERANCE] = np.inf
+        np.fill_diagonal(costs, np.inf)
+
+        below = piece_order.solve_links_with_assignment(costs, TOLERANCE)
+        linked = below[below != -1]
+        assert len(linked) == len(set(linked))
+
+        total = sum(TOLERANCE if j == -1 else costs[i, j] for i, j in enumerate(below))
+        assert total == pytest.approx(brute_force_total(costs, TOLERANCE))
+
+
+@pytest.mark.skipif(piece_order.linear_sum_assignment == None, reason = 'needs SciPy')
+def test_assignment_solves_each_group_on_its_own(monkeypatch):
+    rng = np.random.default_rng(25)
+
+    # two groups of pieces with no links between them, and one piece with
+    # no links at all
+    costs = np.full((11, 11), np.inf)
+    for group in (slice(0, 5), slice(5, 10)):
+        block = rng.uniform(0.0, 2.0 * TOLERANCE, (5, 5))
+        block[block >= TOLERANCE] = np.inf
+        costs[group, group] = block
+    np.fill_diagonal(costs, np.inf)
+
+    below = piece_order.solve_links_with_assignment(costs, TOLERANCE)
+    assert below[10] == -1 and not (below == 10).any()
+    total = sum(TOLERANCE if j == -1 else costs[i, j] for i, j in enumerate(below))
+    expected = sum(brute_force_total(costs[group, group], TOLERANCE) for group in (slice(0, 5), slice(5, 10)))
+    assert total == pytest.approx(expected + TOLERANCE)
+
+    # groups too big to solve are linked greedily
+    monkeypatch.setattr(piece_order, 'ASSIGNMENT_LIMIT', 0)
+    below = piece_order.solve_links_with_assignment(costs, TOLERANCE)
+    assert np.array_equal(below, piece_order.solve_links_greedily(costs))
+
+
+def test_greedy_links_make_chains():
+    rng = np.random.default_rng(22)
+    for trial in range(20):
+        costs = rng.uniform(0.0, 2.0 * TOLERANCE, (7, 7))
+        costs[costs >= TOLERANCE] = np.inf
+        np.fill_diagonal(costs, np.inf)
+
+        below = piece_order.solve_links_greedily(costs)
+        linked = below[below != -1]
+        assert len(linked) == len(set(linked))
+        assert all(np.isfinite(costs[i, j]) for i, j in enumerate(below) if j != -1)
+
+        # no loops, so following the links changes nothing and every piece
+        # is in exactly one chain
+        chains = piece_order.follow_links(below, costs)
+        assert sorted(sum(chains, [])) == list(range(7))
+        assert sum(len(chain) - 1 for chain in chains) == len(linked)
+
+
+def test_follow_links_breaks_loops_at_the_worst_link():
+    costs = np.array([[np.inf, 1.0, np.inf],
+                      [np.inf, np.inf, 5.0],
+                      [2.0, np.inf, np.inf]])
+    below = np.array([1, 2, 0])
+    assert piece_order.follow_links(below, costs) == [[2, 0, 1]]
+
+
+@pytest.mark.parametrize('use_scipy', [True, False])
+def test_find_piece_chains_puts_a_shuffled_strip_back(monkeypatch, use_scipy):
+    if use_scipy and (piece_order.linear_sum_assignment == None):
+        pytest.skip('needs SciPy')
+    if not use_scipy:
+        monkeypatch.setattr(piece_order, 'linear_sum_assignment', None)
+
+    bottoms, tops, right_order = cut_strip(9, 60, 23)
+
+    # a piece of some other width, and a file that isn't an image
+    rng = np.random.default_rng(24)
+    bottoms.append(rng.integers(0, 256, (50, 3), dtype = np.uint8))
+    tops.append(rng.integers(0, 256, (50, 3), dtype = np.uint8))
+    bottoms.append(None)
+    tops.append(None)
+
+    chains = piece_order.find_piece_chains(bottoms, tops, RED_MASK | GREEN_MASK | BLUE_MASK)
+    assert chains == sorted([right_order, [9]])
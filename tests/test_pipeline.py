@@ -0,0 +1,115 @@
+#   Tests for pipeline.py.  What comes out has to be what running the
+#   stages one after the other gives, and a failure anywhere has to stop
+#   everything without leaving threads behind.
+#
+
+import math
+import time
+
+import pytest
+
+import pipeline
+
+
+####################
+#   helpers
+####################
+
+#########
+#   A stage that sees every item: running totals.
+#
+def running_totals(items):
+    total = 0
+    for item in items:
+        total += item
+        yield total
+
+
+#########
+#   A map function that takes longer on some items than others (so the
+#   pool finishes them out of order).
+#
+def slow_square(item):
+    time.sleep(0.01 * (item % 3))
+    return item * item
+
+
+#########
+#   Fails on one item.
+#
+def fail_on_seven(item):
+    if item == 7:
+        raise ValueError('seven')
+    return item
+
+
+####################
+#   tests
+####################
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_items_come_out_in_order(workers):
+    stages = pipeline.new_pipeline(depth = 3)
+    items = pipeline.add_source(stages, range(40))
+    items = pipeline.add_map_stage(stages, slow_square, items, workers)
+    items = pipeline.add_stage(stages, running_totals, items)
+
+    expected = list(running_totals(x * x for x in range(40)))
+    assert list(pipeline.drain(stages, items)) == expected
+    assert not any(thread.is_alive() for thread in stages['threads'])
+
+
+def test_process_stage_keeps_order():
+    stages = pipeline.new_pipeline()
+    items = pipeline.add_source(stages, range(30))
+    items = pipeline.add_map_stage(stages, math.factorial, items, 3, use_processes = True)
+
+    assert list(pipeline.drain(stages, items)) == [math.factorial(n) for n in range(30)]
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_a_failing_stage_stops_everything(workers):
+    stages = pipeline.new_pipeline(depth = 2)
+    items = pipeline.add_source(stages, range(1000))
+    items = pipeline.add_map_stage(stages, fail_on_seven, items, workers)
+    items = pipeline.add_stage(stages, running_totals, items)
+
+    with pytest.raises(ValueError, match = 'seven'):
+        for total in pipeline.drain(stages, items):
+            pass
+
+    assert not any(thread.is_alive() for thread in stages['threads'])
+
+
+def test_queues_hold_back_a_fast_source():
+    made = []
+
+    def source():
+        for k in range(200):
+            made.append(k)
+            yield k
+
+    stages = pipeline.new_pipeline(depth = 2)
+    items = pipeline.add_source(stages, source())
+    items = pipeline.add_map_stage(stages, slow_square, items, 2)
+
+    results = pipeline.drain(stages, items)
+    next(results)
+    time.sleep(0.3)
+
+    # two queues of 2, 2 * 2 in the pool, and one in each stage's hands
+    assert len(made) <= 2 + 2 + 4 + 3
+    assert len(list(results)) == 199
+
+
+def test_giving_up_on_the_results_stops_the_stages():
+    stages = pipeline.new_pipeline(depth = 2)
+    items = pipeline.add_source(stages, range(10 ** 6))
+    items = pipeline.add_map_stage(stages, slow_square, items, 2)
+
+    results = pipeline.drain(stages, items)
+    next(results)
+    results.close()
+
+    assert stages['stopped'].is_set()
+    assert not any(thread.is_alive() for thread in stages['threads'])
@@ -0,0 +1,88 @@
+#   Tests for shared_buffers.py.  A worker has to see exactly the pixels
+#   that were shared, and nothing may be left behind afterwards.
+#
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+
+import find_match_rows
+import pipeline
+import shared_buffers
+from image_comparator import RED_MASK, GREEN_MASK, BLUE_MASK
+from image_comparator import find_closest_row_pairs
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Runs in a worker: looks at the shared array and hands back a copy.
+#
+def copy_shared(descriptor):
+    return shared_buffers.attach_array(descriptor).copy()
+
+
+#########
+#   Is there still a segment with this name?
+#
+def segment_exists(name):
+    try:
+        shared_memory.SharedMemory(name = name).close()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+####################
+#   tests
+####################
+
+def test_workers_see_the_shared_pixels():
+    rng = np.random.default_rng(50)
+    arrays = [rng.integers(0, 256, (40, 30, 3), dtype = np.uint8),
+              rng.standard_normal((7, 5)),
+              np.arange(12, dtype = np.int64)[::2]]
+
+    with shared_buffers.shared_buffers():
+        descriptors = [shared_buffers.share_array(array) for array in arrays]
+
+        # the process that made them can look too
+        for array, descriptor in zip(arrays, descriptors):
+            assert np.array_equal(shared_buffers.attach_array(descriptor), array)
+
+        with ProcessPoolExecutor(max_workers = 2, mp_context = pipeline.get_process_context()) as executor:
+            copies = list(executor.map(copy_shared, descriptors))
+
+    for array, copy in zip(arrays, copies):
+        assert copy.dtype == array.dtype
+        assert np.array_equal(copy, array)
+
+    for descriptor in descriptors:
+        assert not segment_exists(descriptor[0])
+
+
+def test_segments_are_unlinked_after_an_error():
+    with pytest.raises(RuntimeError):
+        with shared_buffers.shared_buffers():
+            descriptor = shared_buffers.share_array(np.zeros(100))
+            raise RuntimeError('oops')
+
+    assert not segment_exists(descriptor[0])
+    assert descriptor[0] not in shared_buffers.owned_segments
+
+
+def test_parallel_row_pairs_match_one_process():
+    rng = np.random.default_rng(51)
+    pixels1 = rng.integers(0, 256, (37, 20, 3), dtype = np.uint8)
+    pixels2 = rng.integers(0, 256, (25, 20, 3), dtype = np.uint8)
+    pixels2[10] = pixels1[30]
+    pixels2[3] = pixels1[2]
+
+    compare_type = RED_MASK | GREEN_MASK | BLUE_MASK
+    expected = find_closest_row_pairs(pixels1, pixels2, compare_type, 5)
+    assert find_match_rows.find_best_row_pairs_parallel(pixels1, pixels2, compare_type, 5, workers = 3) == expected
+    assert [pair[1:] for pair in expected[:2]] == [(2, 3), (30, 10)]
@@ -0,0 +1,131 @@
+#   Tests for strip_writer.py.  Whatever it writes a strip at a time has
+#   to read back through Pillow as the image that went in.
+#
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import strip_writer
+
+
+####################
+#   helpers
+####################
+
+#########
+#   Random RGB pixels.
+#
+def random_pixels(width, height, seed):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype = np.uint8)
+
+
+#########
+#   Writes pixels in bands of uneven sizes and returns the filename.
+#
+def write_in_bands(filename, pixels, band_sizes):
+    writer = strip_writer.open_writer(filename, pixels.shape[1], pixels.shape[0])
+    top = 0
+    for rows in band_sizes:
+        strip_writer.write_rows(writer, pixels[top : top + rows])
+        top += rows
+    strip_writer.close_writer(writer)
+    return filename
+
+
+#########
+#   Reads an image back as RGB pixels.
+#
+def read_image(filename):
+    with Image.open(filename) as image:
+        return np.asarray(image.convert('RGB'))
+
+
+####################
+#   tests
+####################
+
+@pytest.mark.parametrize('strip_bytes', [1000, strip_writer.STRIP_BYTES])
+def test_tiff_reads_back(tmp_path, monkeypatch, strip_bytes):
+    monkeypatch.setattr(strip_writer, 'STRIP_BYTES', strip_bytes)
+    pixels = random_pixels(37, 101, 90)
+    filename = write_in_bands(str(tmp_path / 'a.tif'), pixels, [1, 30, 3, 50, 17])
+
+    with Image.open(filename) as image:
+        assert (image.format, image.mode, image.size) == ('TIFF', 'RGB', (37, 101))
+    assert np.array_equal(read_image(filename), pixels)
+
+
+def test_bigtiff_reads_back(tmp_path, monkeypatch):
+    # (anything bigger than this is too big for a classic TIFF)
+    monkeypatch.setattr(strip_writer, 'CLASSIC_TIFF_LIMIT', 1000)
+    monkeypatch.setattr(strip_writer, 'STRIP_BYTES', 500)
+    pixels = random_pixels(20, 40, 91)
+    filename = write_in_bands(str(tmp_path / 'a.tiff'), pixels, [40])
+
+    with open(filename, 'rb') as file:
+        assert file.read(4) == b'II+\x00'
+    assert np.array_equal(read_image(filename), pixels)
+
+
+def test_unwritten_rows_are_black(tmp_path):
+    pixels = random_pixels(12, 30, 92)
+    filename = write_in_bands(str(tmp_path / 'a.tif'), pixels, [10])
+
+    # and rows past the bottom are dropped
+    writer = strip_writer.open_writer(str(tmp_path / 'b.tif'), 12, 30)
+    strip_writer.write_rows(writer, np.concatenate((pixels, pixels)))
+    strip_writer.close_writer(writer)
+
+    expected = pixels.copy()
+    expected[10:] = 0
+    assert np.array_equal(read_image(filename), expected)
+    assert np.array_equal(read_image(tmp_path / 'b.tif'), pixels)
+
+
+@pytest.mark.parametrize('name, image_format', [('a.png', 'PNG'), ('a.ppm', 'PPM')])
+@pytest.mark.parametrize('idat_bytes', [100, strip_writer.IDAT_BYTES])
+def test_png_and_ppm_read_back(tmp_path, monkeypatch, name, image_format, idat_bytes):
+    monkeypatch.setattr(strip_writer, 'IDAT_BYTES', idat_bytes)
+    pixels = random_pixels(45, 70, 93)
+    filename = write_in_bands(str(tmp_path / name), pixels, [1, 20, 2, 47])
+
+    with Image.open(filename) as image:
+        assert (image.format, image.mode, image.size) == (image_format, 'RGB', (45, 70))
+    assert np.array_equal(read_image(filename), pixels)
+
+
+@pytest.mark.parametrize('name', ['a.tif', 'a.png', 'a.ppm'])
+@pytest.mark.parametrize('band_rows', [4, strip_writer.IMAGE_BAND_ROWS])
+def test_write_image_pads_and_clips(tmp_path, monkeypatch, name, band_rows):
+    monkeypatch.setattr(strip_writer, 'IMAGE_BAND_ROWS', band_rows)
+    rng = np.random.default_rng(94)
+
+    # narrower and off to the right, hanging off the left, not on the
+    # page at all, a different mode, and one that runs past the bottom
+    placed = [
+        (Image.fromarray(random_pixels(20, 9, 95)), 8),
+        (Image.fromarray(random_pixels(25, 7, 96)), -10),
+        (Image.fromarray(random_pixels(10, 5, 97)), 40),
+        (Image.fromarray(rng.integers(0, 256, (6, 30), dtype = np.uint8)), 0),
+        (Image.fromarray(random_pixels(30, 10, 98)), 0),
+    ]
+
+    # what pasting them one under the other gives
+    expected = Image.new('RGB', (30, 30))
+    top = 0
+    for image, left in placed:
+        expected.paste(image, (left, top))
+        top += image.height
+
+    writer = strip_writer.open_writer(str(tmp_path / name), 30, 30)
+    for image, left in placed:
+        strip_writer.write_image(writer, image, left)
+    strip_writer.close_writer(writer)
+
+    assert np.array_equal(read_image(tmp_path / name), np.asarray(expected))
+
+
+def test_cant_write(tmp_path):
+    assert strip_writer.open_writer(str(tmp_path / 'a.jpg'), 10, 10) == None
+    assert strip_writer.open_writer(str(tmp_path / 'missing' / 'a.tif'), 10, 10) == None